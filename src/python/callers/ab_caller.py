@@ -19,11 +19,71 @@
 #  limitations under the License.
 
 from abc import abstractmethod
+from collections.abc import Mapping
 from typing import Dict, Set, Tuple, List
+
+import numpy as np
 import vcf as pyvcf
 from vcf.model import _Record
 
 from .abstract_caller import AbstractCaller
+from utils.vcf_wrappers import LazyRecord, LazyGenotypes
+
+
+class GenotypeBlock:
+    '''
+    Genotypes and allele depths of a block of records, stored as
+    samples x records matrices. Genotype -1 stands for no call.
+    Records, which could not be decoded, are marked as not valid
+    '''
+    def __init__(self, samples: List, records: List) -> None:
+        self.samples = samples
+        self.index = {sample: i for i, sample in enumerate(samples)}
+        self.records = records
+        shape = (len(samples), len(records))
+        self.gt = np.full(shape, -1, dtype=np.int8)
+        self.ref = np.zeros(shape, dtype=np.int64)
+        self.alt = np.zeros(shape, dtype=np.int64)
+        self.has_ad = np.zeros(shape, dtype=bool)
+        self.valid = np.ones(len(records), dtype=bool)
+        # AF over all samples, calculated on first use if shared
+        self.shared_af = False
+        self._af = None
+
+    @property
+    def af(self) -> np.ndarray:
+        if self._af is None and self.shared_af:
+            self._af = ABCaller.calculate_block_af(self)
+        return self._af
+
+    @af.setter
+    def af(self, af: np.ndarray):
+        self._af = af
+
+    def get_indices(self, samples) -> np.ndarray:
+        return np.array([self.index[s] for s in samples], dtype=np.int64)
+
+    def get_genotypes(self, j: int) -> "BlockGenotypes":
+        return BlockGenotypes(self, j)
+
+
+class BlockGenotypes(Mapping):
+    '''
+    Genotypes of a single record of a block, by sample
+    '''
+    def __init__(self, block: GenotypeBlock, j: int) -> None:
+        self.block = block
+        self.j = j
+
+    def __getitem__(self, sample):
+        gt = self.block.gt[self.block.index[sample], self.j]
+        return None if gt < 0 else int(gt)
+
+    def __iter__(self):
+        return iter(self.block.samples)
+
+    def __len__(self):
+        return len(self.block.samples)
 
 
 class ABCaller(AbstractCaller):
@@ -33,25 +93,101 @@ class ABCaller(AbstractCaller):
         super().__init__()
         self.recall_genotypes = recall_genotypes
         self.genotypes = None
+        self.block_samples = None
+        self.block_indices = None
 
     def make_call(self, record: _Record) -> Dict:
         self.genotypes = None
         genotypes = self.get_genotypes(record)
-        if (not self.validate(genotypes)):
-            return {}
         a = self.affected(genotypes)
         u = self.unaffected(genotypes)
         result = self.check_genotypes(a, u)
+        if not result:
+            return {}
+        # AF needs genotypes of all unrelated samples, hence it is
+        # checked only for variants, matching the family pattern
+        if (not self.validate(genotypes)):
+            return {}
         if len(result) > 1:
             return {result[0]: result[1]}
-        if result:
-            return {result[0]: None}
-        return {}
+        return {result[0]: None}
 
     @abstractmethod
     def check_genotypes(self, a: List, u: List) -> Tuple:
         pass
 
+    def get_af_source(self) -> str:
+        '''
+        Samples AF is calculated over: all samples of the VCF, when AF is
+        taken from a shared context, unrelated samples otherwise
+        '''
+        return "all" if self.shared_context else "unrelated"
+
+    def get_output_key(self) -> Tuple:
+        return (type(self).__name__, self.recall_genotypes,
+                tuple(self.affected_samples), tuple(self.unaffected_samples),
+                self.get_af_source())
+
+    def has_block_calls(self) -> bool:
+        # Genotypes in a block are always recalled
+        return self.recall_genotypes or self.shared_context
+
+    def has_prescreen(self) -> bool:
+        return True
+
+    def get_prescreen_samples(self) -> Set:
+        return set(self.family)
+
+    def prescreen(self, fields: List, calls: Dict) -> str:
+        # Genotypes are recalled whenever make_call() or make_calls()
+        # would recall them
+        if self.recall_genotypes or self.shared_context:
+            genotypes = {s: self.recall_genotype(gt, ad)
+                         for s, (gt, ad) in calls.items()}
+        else:
+            genotypes = {s: gt for s, (gt, ad) in calls.items()}
+        if not self.check_genotypes(self.affected(genotypes),
+                                    self.unaffected(genotypes)):
+            return "family_pattern"
+        return None
+
+    @abstractmethod
+    def check_block(self, a: np.ndarray, u: np.ndarray) -> Tuple:
+        '''
+        Block version of check_genotypes. Arguments are affected x records
+        and unaffected x records genotype matrices, returns a mask of
+        records passing the check and a list of values for every record
+        '''
+        pass
+
+    def get_block_indices(self, block: GenotypeBlock) -> Tuple:
+        if self.block_samples is not block.samples:
+            self.block_indices = (
+                block.get_indices(self.affected_samples),
+                block.get_indices(self.unaffected_samples),
+                block.get_indices(self.unrelated_samples)
+            )
+            self.block_samples = block.samples
+        return self.block_indices
+
+    def make_calls(self, block: GenotypeBlock) -> List[Dict]:
+        affected, unaffected, unrelated = self.get_block_indices(block)
+        a = np.maximum(block.gt[affected, :], 0)
+        u = np.maximum(block.gt[unaffected, :], 0)
+        passed, values = self.check_block(a, u)
+        passed &= block.valid
+        if passed.any():
+            if block.af is not None:
+                af = block.af
+            else:
+                af = self.calculate_block_af(block, unrelated)
+            passed &= af < self.AF_THRESHOLD
+        calls = [dict() for _ in block.records]
+        tag = self.get_my_tag()
+        for j in np.flatnonzero(passed):
+            calls[j] = {tag: values[j]}
+        return calls
+
     def get_genotypes(self, record: _Record):
         if self.genotypes:
             return self.genotypes
@@ -59,7 +195,10 @@ class ABCaller(AbstractCaller):
             self.genotypes = self.variant_context["genotypes"]
             return self.genotypes
         if not self.recall_genotypes:
-            self.genotypes = {s.sample: s.gt_type for s in record.samples}
+            if isinstance(record, LazyRecord):
+                self.genotypes = LazyGenotypes(record)
+            else:
+                self.genotypes = {s.sample: s.gt_type for s in record.samples}
             return self.genotypes
 
         self.genotypes = self.calculate_genotypes(record)
@@ -67,27 +206,84 @@ class ABCaller(AbstractCaller):
 
     @classmethod
     def calculate_genotypes(cls, record: _Record) -> Dict:
+        if isinstance(record, LazyRecord):
+            return LazyGenotypes(record, cls.recall_genotype)
         genotypes = dict()
         for sample in record.samples:
-            gt = sample.gt_type
-            ad = getattr(sample.data, 'AD', None)
-            if ad and isinstance(ad, list):
-                n_ref = ad[0]
-                n_alt = sum(ad[1:])
-                if n_ref + n_alt > 0:
-                    balance = n_alt / (n_ref + n_alt)
-                    if balance <= cls.AB[0]:
-                        gt = 0
-                    elif balance <= cls.AB[1]:
-                        gt = 1
-                    else:
-                        gt = 2
-            genotypes[sample.sample] = gt
+            genotypes[sample.sample] = cls.recall_genotype(
+                sample.gt_type, getattr(sample.data, 'AD', None))
         return genotypes
 
+    @classmethod
+    def recall_genotype(cls, gt, ad):
+        if ad and isinstance(ad, list):
+            n_ref = ad[0]
+            n_alt = sum(ad[1:])
+            if n_ref + n_alt > 0:
+                balance = n_alt / (n_ref + n_alt)
+                if balance <= cls.AB[0]:
+                    gt = 0
+                elif balance <= cls.AB[1]:
+                    gt = 1
+                else:
+                    gt = 2
+        return gt
+
+    @classmethod
+    def calculate_block_genotypes(cls, records: List,
+                                  samples: List) -> GenotypeBlock:
+        block = GenotypeBlock(samples, records)
+        for j, record in enumerate(records):
+            arrays = None
+            if isinstance(record, LazyRecord):
+                arrays = record.get_gt_ad_arrays()
+            if arrays is not None:
+                gt, ref, alt, has_ad = arrays
+                block.gt[:, j] = gt
+                block.ref[:, j] = ref
+                block.alt[:, j] = alt
+                block.has_ad[:, j] = has_ad
+                continue
+            try:
+                genotypes = cls.calculate_genotypes(record)
+                block.gt[:, j] = [
+                    -1 if genotypes[s] is None else genotypes[s]
+                    for s in samples
+                ]
+            except Exception:
+                block.valid[j] = False
+            # genotypes are already recalled
+            block.has_ad[:, j] = False
+        cls.recall_block(block)
+        return block
+
+    @classmethod
+    def recall_block(cls, block: GenotypeBlock):
+        depth = block.ref + block.alt
+        recall = block.has_ad & (depth > 0)
+        balance = np.divide(block.alt, depth, where=recall,
+                            out=np.zeros(depth.shape))
+        recalled = np.where(balance <= cls.AB[0], 0,
+                            np.where(balance <= cls.AB[1], 1, 2))
+        block.gt = np.where(recall, recalled, block.gt).astype(np.int8)
+
+    @classmethod
+    def calculate_block_af(cls, block: GenotypeBlock,
+                           indices: np.ndarray = None) -> np.ndarray:
+        gt = block.gt
+        if indices is not None:
+            gt = gt[indices, :]
+        called = gt >= 0
+        n = called.sum(axis=0)
+        total = np.where(called, gt, 0).sum(axis=0, dtype=np.int64)
+        return np.divide(total, 2. * n, where=n > 0,
+                         out=np.zeros(len(n)))
+
     def get_af(self, genotypes: Dict):
-        if "af" in self.variant_context:
-            return self.variant_context["af"]
+        # AF in a context is keyed by samples it is calculated over
+        key = ("af", self.get_af_source())
+        if key in self.variant_context:
+            return self.variant_context[key]
 
         return self.calculate_af(genotypes, self.unrelated_samples)
 
@@ -100,6 +296,10 @@ class ABCaller(AbstractCaller):
             return 0.
         return sum(gts) / (2. * len(gts))
 
+    def get_required_samples(self) -> Set:
+        # Unrelated samples are used for AF
+        return set(self.samples)
+
     def validate(self, genotypes: Dict):
         return self.get_af(genotypes) < self.AF_THRESHOLD
 
@@ -19,6 +19,8 @@
 #  limitations under the License.
 
 from typing import Dict, Set, Tuple, List
+
+import numpy as np
 import vcf as pyvcf
 
 from .ab_caller import ABCaller
@@ -36,6 +38,14 @@ class ABCompoundHeterozygousCaller(ABCaller):
             return (self.get_my_tag(), str(value))
         return ()
 
+    def check_block(self, a: np.ndarray, u: np.ndarray) -> Tuple:
+        # Python integers, if the bit mask does not fit into int64
+        dtype = np.int64 if len(u) < 63 else object
+        bits = np.array([1 << i for i in range(len(u))], dtype=dtype)
+        values = ((u > 0) * bits[:, np.newaxis]).sum(axis=0)
+        passed = (a > 0).all(axis=0) & (values != 0)
+        return passed, [str(v) for v in values.tolist()]
+
     def get_my_tag(self):
         return super(ABCompoundHeterozygousCaller, self).get_my_tag() + "_CMPD_HET"
 
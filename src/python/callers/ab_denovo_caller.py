@@ -20,6 +20,8 @@
 
 from typing import Dict, Set, Tuple, List
 
+import numpy as np
+
 from .ab_caller import ABCaller
 
 
@@ -32,6 +34,10 @@ class ABDenovoCaller(ABCaller):
             return (self.get_my_tag(), self.get_value())
         return ()
 
+    def check_block(self, a: np.ndarray, u: np.ndarray) -> Tuple:
+        passed = (a > 0).all(axis=0) & (u.sum(axis=0) == 0)
+        return passed, [self.get_value()] * len(passed)
+
     def get_my_tag(self):
         return super(ABDenovoCaller, self).get_my_tag() + "_DE_NOVO"
 
@@ -19,6 +19,8 @@
 #  limitations under the License.
 
 from typing import Dict, Set, Tuple, List
+
+import numpy as np
 import vcf as pyvcf
 
 from .ab_caller import ABCaller
@@ -33,6 +35,10 @@ class ABHomozygousRecessiveCaller(ABCaller):
             return (self.get_my_tag(), None)
         return ()
 
+    def check_block(self, a: np.ndarray, u: np.ndarray) -> Tuple:
+        passed = (a == 2).all(axis=0) & (u < 2).all(axis=0)
+        return passed, [None] * len(passed)
+
     def get_my_tag(self):
         return super(ABHomozygousRecessiveCaller, self).get_my_tag() + "_HOM_REC"
 
@@ -19,23 +19,70 @@
 #  limitations under the License.
 import sys
 from abc import ABC, abstractmethod
-from typing import Dict, Set, Tuple, List
+from concurrent.futures import Future
+from contextlib import nullcontext
+from typing import Any, Callable, Dict, Set, Tuple, List
 from vcf.model import _Record
 
 from utils.misc import raiseException
 import random
 
 class VariantContext(dict):
+    '''
+    Values of the current record, shared by callers. Besides the values
+    put by callers, it holds products (genotypes, AF, AD matrices): a
+    product is calculated by its function on first access by any caller
+    and kept until reset()
+    '''
     def __init__(self):
         super().__init__()
         self.random = random.randint(0, sys.maxsize)
+        self.products = dict()
 
     def reset(self):
         self.clear()
+        self.products = dict()
 
     def put(self, key, value):
         self[key] = value
 
+    def set_product(self, key, function: Callable[[], Any]):
+        self.pop(key, None)
+        self.products[key] = function
+
+    def __missing__(self, key):
+        function = self.products.pop(key)
+        value = function()
+        self[key] = value
+        return value
+
+    def __contains__(self, key) -> bool:
+        return dict.__contains__(self, key) or key in self.products
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
+
+
+class DeferredCall:
+    '''
+    Calls of a record, which are made asynchronously: make_call() may
+    return it instead of a dictionary. Calls are assembled by a function
+    from the results of the futures, Harness reassembles calls of all
+    records in order
+    '''
+    def __init__(self, futures: List[Future],
+                 assemble: Callable[[List], Dict]) -> None:
+        self.futures = futures
+        self.assemble = assemble
+
+    def done(self) -> bool:
+        return all(future.done() for future in self.futures)
+
+    def result(self) -> Dict:
+        return self.assemble([future.result() for future in self.futures])
+
 
 class AbstractCaller(ABC):
     def __init__(self):
@@ -44,6 +91,7 @@ class AbstractCaller(ABC):
         self.variant_context = VariantContext()
         self.shared_context = False
         self.unrelated_samples = set()
+        self.metrics = None
         return
 
     def init(self, family: Dict, samples: Set):
@@ -61,6 +109,73 @@ class AbstractCaller(ABC):
     def make_call(self, record: _Record) -> Dict:
         return {}
 
+    def has_block_calls(self) -> bool:
+        return False
+
+    def make_calls(self, block) -> List[Dict]:
+        '''
+        Calls for a block of records (see ab_caller.GenotypeBlock), one
+        dictionary per record. Only used if has_block_calls() is True
+        '''
+        return [self.make_call(record) for record in block.records]
+
+    def get_inputs(self) -> List["AbstractCaller"]:
+        '''
+        Callers, whose calls of a record are used by this caller
+        (see callers.caller_graph)
+        '''
+        return []
+
+    def replace_input(self, caller: "AbstractCaller",
+                      equivalent: "AbstractCaller"):
+        '''
+        Makes the caller use an equivalent input caller (with the same
+        output key) instead of caller
+        '''
+        pass
+
+    def get_output_key(self) -> Tuple:
+        '''
+        Identifies calls of the caller: callers with equal keys make
+        equal calls of every record. Valid after init()
+        '''
+        return type(self).__name__, id(self)
+
+    def get_calls_key(self) -> Tuple:
+        return ("calls",) + self.get_output_key()
+
+    def call_input(self, caller: "AbstractCaller", record: _Record) -> Dict:
+        '''
+        Calls of an input caller. If the context is shared with other
+        callers of the record, calls are made once and reused
+        '''
+        key = caller.get_calls_key()
+        if key in self.variant_context:
+            return self.variant_context[key]
+        return caller.make_call(record)
+
+    def get_required_samples(self) -> Set:
+        return set(self.family)
+
+    def has_prescreen(self) -> bool:
+        return False
+
+    def get_prescreen_samples(self) -> Set:
+        return set()
+
+    def prescreen(self, fields: List, calls: Dict) -> str:
+        '''
+        Checks the text of a VCF line before a record is parsed. Fields
+        are split up to the samples of get_prescreen_samples(), calls
+        are pairs of GT type and AD of these samples. Returns the name
+        of the rule proving that the line can not produce a call or None.
+        Only used if has_prescreen() is True
+        '''
+        return None
+
+    def get_required_info(self) -> Set:
+        return set()
+
     def get_my_tag(self):
         return "BGM"
 
@@ -102,6 +217,18 @@ class AbstractCaller(ABC):
     def reset_context(self):
         self.variant_context.reset()
 
+    def set_metrics(self, metrics):
+        self.metrics = metrics
+
+    def stage(self, name: str):
+        '''
+        Context manager measuring time of a stage of the caller,
+        if metrics are collected
+        '''
+        if self.metrics is None:
+            return nullcontext()
+        return self.metrics.stage("{}.{}".format(self.get_my_tag(), name))
+
     def set_shared_context(self, shared_ctx: VariantContext):
         self.variant_context = shared_ctx
         self.shared_context = True
@@ -18,7 +18,7 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 
-from typing import Dict, Set
+from typing import Dict, Set, List, Tuple
 from vcf.model import _Record
 
 from callers.ab_caller import ABCaller
@@ -51,12 +51,46 @@ class BayesDenovoCaller(AbstractCaller):
         list_of_bam_files = [
             self.path_to_bams.format(sample) for sample in trio
         ]
+        # Callers of a worker are initialized for every shard
+        self.close()
         self.detector = DenovoDetector(self.path_to_library,
                                        trio_list=list_of_bam_files)
 
+    def get_inputs(self) -> List[AbstractCaller]:
+        return [self.parent]
+
+    def replace_input(self, caller: AbstractCaller,
+                      equivalent: AbstractCaller):
+        if self.parent is caller:
+            self.parent = equivalent
+
+    def get_output_key(self) -> Tuple:
+        return (type(self).__name__, self.parent.get_output_key(),
+                tuple(self.get_trio()), self.path_to_bams,
+                self.path_to_library, self.pp_threshold,
+                self.return_parent_calls, self.assembly)
+
+    def get_required_samples(self) -> Set:
+        return self.parent.get_required_samples() | set(self.family)
+
+    def get_required_info(self) -> Set:
+        return self.parent.get_required_info()
+
+    def has_prescreen(self) -> bool:
+        return self.parent.has_prescreen()
+
+    def get_prescreen_samples(self) -> Set:
+        return self.parent.get_prescreen_samples()
+
+    def prescreen(self, fields: List, calls: Dict) -> str:
+        # No de novo call without a call of the parent
+        return self.parent.prescreen(fields, calls)
+
     def make_call(self, record: _Record) -> Dict:
         result = dict()
-        parent_call = self.parent.make_call(record)
+        with self.stage("parent"):
+            parent_call = self.call_input(self.parent, record)
+        # The detector is run only for calls of the parent
         if not parent_call:
             return result
         if (self.return_parent_calls and self.parent.get_type()):
@@ -69,7 +103,7 @@ class BayesDenovoCaller(AbstractCaller):
         af = self.parent.get_af(genotypes)
         variant = VariantHandler(chromosome, pos, record.REF, record.ALT, af,
                                  base_ref = self.assembly)
-        passed = self.detector.detect(variant)
+        passed = self.detector.detect(variant, self.stage)
         if (passed):
             pp = variant.getProp("PP")
             if (pp > self.pp_threshold):
@@ -0,0 +1,79 @@
+#  Copyright (c) 2019. Partners HealthCare, Harvard Medical School’s
+#  Department of Biomedical Informatics
+#
+#  Developed by Sergey Trifonov and Michael Bouzinier, based on contributions by:
+#  Anwoy Kumar Mohanty, Andrew Bjonnes,
+#  Ignat Leshchiner, Shamil Sunyaev and other members of Division of Genetics,
+#  Brigham and Women's Hospital
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+from collections import OrderedDict, defaultdict
+from functools import partial
+from typing import Collection, Dict
+
+from vcf.model import _Record
+
+from callers.abstract_caller import AbstractCaller, VariantContext
+
+
+class CallerGraph:
+    '''
+    Callers and their inputs (see AbstractCaller.get_inputs) as a graph.
+    Callers with equal output keys are merged into one node and their
+    consumers are rewired to it. Calls of nodes used more than once are
+    set as products of the shared context, so that they are made once
+    per record; a consumer skips its own stages if its input makes no
+    call. Build the graph after callers are initialized
+    '''
+    def __init__(self, callers: Collection[AbstractCaller]) -> None:
+        # Inputs come before their consumers
+        self.nodes = OrderedDict()
+        self.uses = defaultdict(int)
+        keys = dict()
+        for caller in callers:
+            key = self.add(caller).get_output_key()
+            self.uses[key] += 1
+            keys[id(caller)] = key
+        self.shared = [(node.get_calls_key(), node)
+                       for key, node in self.nodes.items()
+                       if self.uses[key] > 1]
+        # Calls keys of the callers, which are shared nodes
+        self.calls_keys = {caller_id: self.nodes[key].get_calls_key()
+                           for caller_id, key in keys.items()
+                           if self.uses[key] > 1}
+
+    def add(self, caller: AbstractCaller) -> AbstractCaller:
+        for input_caller in caller.get_inputs():
+            node = self.add(input_caller)
+            self.uses[node.get_output_key()] += 1
+            if node is not input_caller:
+                caller.replace_input(input_caller, node)
+        key = caller.get_output_key()
+        if key not in self.nodes:
+            self.nodes[key] = caller
+        return self.nodes[key]
+
+    def set_products(self, context: VariantContext, record: _Record):
+        '''
+        Sets calls of shared nodes for the record, they are made on first
+        use by any caller
+        '''
+        for key, node in self.shared:
+            context.set_product(key, partial(node.make_call, record))
+
+    def make_call(self, caller: AbstractCaller, record: _Record,
+                  context: VariantContext = None) -> Dict:
+        key = self.calls_keys.get(id(caller))
+        if key is not None and context is not None and key in context:
+            return context[key]
+        return caller.make_call(record)
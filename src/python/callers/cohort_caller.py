@@ -0,0 +1,258 @@
+#  Copyright (c) 2019. Partners HealthCare, Harvard Medical School’s
+#  Department of Biomedical Informatics
+#
+#  Developed by Sergey Trifonov and Michael Bouzinier, based on contributions by:
+#  Anwoy Kumar Mohanty, Andrew Bjonnes,
+#  Ignat Leshchiner, Shamil Sunyaev and other members of Division of Genetics,
+#  Brigham and Women's Hospital
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import re
+from typing import Dict, Set, List, Collection
+
+import numpy as np
+from vcf.model import _Record
+
+from .ab_caller import ABCaller, GenotypeBlock
+from .abstract_caller import AbstractCaller
+from utils.vcf_wrappers import LazyRecord, read_samples
+
+DE_NOVO = "DE_NOVO"
+HOM_REC = "HOM_REC"
+CMPD_HET = "CMPD_HET"
+PATTERNS = (DE_NOVO, HOM_REC, CMPD_HET)
+PATTERN_TYPES = {DE_NOVO: "Flag", HOM_REC: "Flag", CMPD_HET: "Integer"}
+PATTERN_DESCRIPTIONS = {
+    DE_NOVO: "De-novo",
+    HOM_REC: "Homozygous recessive",
+    CMPD_HET: "Compound heterozygous"
+}
+# Characters not allowed in INFO IDs
+TAG_PATTERN = re.compile(r"[^0-9A-Za-z_.]")
+
+
+def pack_bits(mask: np.ndarray) -> np.ndarray:
+    '''
+    Packs a samples x records boolean matrix into records x words
+    matrix of 64-bit words, bit i of the planes is sample i
+    '''
+    bits = np.packbits(mask.T, axis=1, bitorder="little")
+    padding = -bits.shape[1] % 8
+    if padding:
+        bits = np.pad(bits, ((0, 0), (0, padding)))
+    return np.ascontiguousarray(bits).view(np.uint64)
+
+
+def count_bits(words: np.ndarray) -> np.ndarray:
+    '''
+    Number of set bits in every row of a matrix of 64-bit words
+    '''
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(words).sum(axis=-1, dtype=np.int64)
+    bits = np.unpackbits(words.view(np.uint8), axis=-1)
+    return bits.sum(axis=-1, dtype=np.int64)
+
+
+class BitPlanes:
+    '''
+    Genotypes of a block of records as bit-planes: for every record,
+    bits of heterozygous, homozygous alternative and not called samples
+    '''
+    def __init__(self, gt: np.ndarray) -> None:
+        self.n_samples = gt.shape[0]
+        self.het = pack_bits(gt == 1)
+        self.hom = pack_bits(gt == 2)
+        self.no_call = pack_bits(gt < 0)
+
+    def carrier(self) -> np.ndarray:
+        return self.het | self.hom
+
+    def af(self) -> np.ndarray:
+        # Same as ABCaller.calculate_block_af() over all samples
+        n = self.n_samples - count_bits(self.no_call)
+        total = count_bits(self.het) + 2 * count_bits(self.hom)
+        return np.divide(total, 2. * n, where=n > 0, out=np.zeros(len(n)))
+
+
+class CohortCaller(AbstractCaller):
+    '''
+    Screens many families in a single pass over a joint VCF. Genotypes
+    of every block of records are packed into bit-planes once, then
+    de novo, homozygous recessive and compound heterozygous patterns of
+    all families are evaluated with bitwise operations. Calls are the
+    same as of ABDenovoCaller, ABHomozygousRecessiveCaller and
+    ABCompoundHeterozygousCaller run together for each family (AF is
+    calculated over all samples), written to a column per family
+    and pattern
+    '''
+    def __init__(self, families: Dict, vcf_file: str = None,
+                 patterns: Collection = PATTERNS):
+        super().__init__()
+        if vcf_file:
+            samples = set(read_samples(vcf_file))
+            skipped = [name for name in families
+                       if not all(s in samples for s in families[name])]
+            for name in skipped:
+                print("Skipping family {}: not all samples are in VCF".
+                      format(name))
+            families = {name: families[name] for name in families
+                        if name not in skipped}
+        self.families = families
+        self.patterns = [p for p in PATTERNS if p in patterns]
+        self.family_tags = {
+            name: TAG_PATTERN.sub('_', name) for name in self.families
+        }
+        self.sample_list = None
+        self.sample_index = None
+        self.members = None
+        print("Total families: {:d}".format(len(self.families)))
+
+    def init(self, families: Dict, samples: Set):
+        self.samples = samples
+        for name, family in self.families.items():
+            if not all(s in samples for s in family):
+                raise ValueError(
+                    "Samples of family {} are not in VCF".format(name))
+        return
+
+    def get_required_samples(self) -> Set:
+        # AF is calculated over all samples in VCF
+        return set(self.samples)
+
+    def has_block_calls(self) -> bool:
+        return True
+
+    def get_tag(self, pattern: str, name: str) -> str:
+        return "{}_{}_{}".format(super().get_my_tag(), pattern,
+                                 self.family_tags[name])
+
+    def get_my_tag(self):
+        return super().get_my_tag() + "_COHORT"
+
+    def get_all_tags(self):
+        return [self.get_tag(pattern, name)
+                for name in self.families for pattern in self.patterns]
+
+    def get_family_tags(self, name: str) -> List[str]:
+        return [self.get_tag(pattern, name) for pattern in self.patterns]
+
+    def get_type(self):
+        return "String"
+
+    def get_description(self):
+        return "Calls of BGM allele balance callers for every family"
+
+    def get_header(self):
+        pattern = '##INFO=<ID={tag},Number={n},Type={type},' \
+                  'Description="{desc} in family {family} by BGM allele ' \
+                  'balance caller">'
+        headers = []
+        for name in self.families:
+            for p in self.patterns:
+                headers.append(pattern.format(
+                    tag=self.get_tag(p, name), type=PATTERN_TYPES[p],
+                    n=0 if PATTERN_TYPES[p] == "Flag" else 1,
+                    desc=PATTERN_DESCRIPTIONS[p], family=name))
+        return '\n'.join(headers)
+
+    def set_samples(self, samples: List):
+        '''
+        Builds masks of affected and unaffected samples of every family
+        for the order of samples in genotype blocks
+        '''
+        self.sample_list = samples
+        self.sample_index = {s: i for i, s in enumerate(samples)}
+        n = len(samples)
+        affected = np.zeros((n, len(self.families)), dtype=bool)
+        unaffected = np.zeros((n, len(self.families)), dtype=bool)
+        self.members = []
+        for f, family in enumerate(self.families.values()):
+            a = [self.sample_index[s] for s in family if family[s]['affected']]
+            u = [self.sample_index[s] for s in family
+                 if not family[s]['affected']]
+            affected[a, f] = True
+            unaffected[u, f] = True
+            self.members.append((np.array(a, dtype=np.int64),
+                               np.array(u, dtype=np.int64)))
+        self.affected_planes = pack_bits(affected)
+        self.unaffected_planes = pack_bits(unaffected)
+
+    @staticmethod
+    def has_all(planes: np.ndarray, masks: np.ndarray) -> np.ndarray:
+        '''
+        records x families matrix: all samples of the mask are set
+        '''
+        planes = planes[:, np.newaxis, :]
+        return ((planes & masks) == masks).all(axis=2)
+
+    @staticmethod
+    def has_none(planes: np.ndarray, masks: np.ndarray) -> np.ndarray:
+        '''
+        records x families matrix: none of samples of the mask is set
+        '''
+        return ((planes[:, np.newaxis, :] & masks) == 0).all(axis=2)
+
+    def check_planes(self, planes: BitPlanes, passed: np.ndarray) -> Dict:
+        carrier = planes.carrier()
+        all_affected_carry = self.has_all(carrier, self.affected_planes)
+        results = dict()
+        if DE_NOVO in self.patterns:
+            results[DE_NOVO] = all_affected_carry & \
+                self.has_none(carrier, self.unaffected_planes)
+        if HOM_REC in self.patterns:
+            hom = planes.hom
+            results[HOM_REC] = self.has_all(hom, self.affected_planes) & \
+                self.has_none(hom, self.unaffected_planes)
+        if CMPD_HET in self.patterns:
+            results[CMPD_HET] = all_affected_carry & \
+                ~self.has_none(carrier, self.unaffected_planes)
+        for pattern in results:
+            results[pattern] &= passed[:, np.newaxis]
+        return results
+
+    def call_matrix(self, gt: np.ndarray, valid: np.ndarray) -> List[Dict]:
+        planes = BitPlanes(gt)
+        passed = valid & (planes.af() < ABCaller.AF_THRESHOLD)
+        calls = [dict() for _ in range(gt.shape[1])]
+        if not passed.any():
+            return calls
+        names = list(self.families)
+        for pattern, result in self.check_planes(planes, passed).items():
+            for j, f in zip(*np.nonzero(result)):
+                value = None
+                if pattern == CMPD_HET:
+                    # Bit i is the i-th unaffected member of the family
+                    u = gt[self.members[f][1], j] > 0
+                    value = str(sum(1 << i for i, c in enumerate(u) if c))
+                calls[j][self.get_tag(pattern, names[f])] = value
+        return calls
+
+    def make_calls(self, block: GenotypeBlock) -> List[Dict]:
+        if self.sample_list is not block.samples:
+            self.set_samples(block.samples)
+        return self.call_matrix(block.gt, block.valid)
+
+    def make_call(self, record: _Record) -> Dict:
+        if "genotypes" in self.variant_context:
+            genotypes = self.variant_context["genotypes"]
+        else:
+            genotypes = ABCaller.calculate_genotypes(record)
+        if self.sample_list is None:
+            if isinstance(record, LazyRecord):
+                self.set_samples(list(record.reader.selected))
+            else:
+                self.set_samples(sorted(self.samples))
+        gt = np.array([[-1 if genotypes[s] is None else genotypes[s]]
+                       for s in self.sample_list], dtype=np.int8)
+        return self.call_matrix(gt, np.ones(1, dtype=bool))[0]
@@ -0,0 +1,121 @@
+#  Copyright (c) 2019. Partners HealthCare, Harvard Medical School’s
+#  Department of Biomedical Informatics
+#
+#  Developed by Sergey Trifonov and Michael Bouzinier, based on contributions by:
+#  Anwoy Kumar Mohanty, Andrew Bjonnes,
+#  Ignat Leshchiner, Shamil Sunyaev and other members of Division of Genetics,
+#  Brigham and Women's Hospital
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+import multiprocessing.util
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Dict, List, Tuple
+
+from denovo2.detect.detect2 import DenovoDetector, VariantHandler
+
+# Detectors of a worker process by proband, None for the detector
+# shared by trios without BAM files, in the order of use
+_detectors = OrderedDict()
+_config = None
+# Detectors kept open by a worker, the least recently used one is closed
+# over the limit
+MAX_DETECTORS = 128
+
+
+def init_worker(path_to_library: str, bams: Dict[str, List[str]]):
+    global _config
+    _config = (path_to_library, bams)
+    multiprocessing.util.Finalize(None, close_detectors, exitpriority=10)
+
+
+def get_detector(proband: str) -> DenovoDetector:
+    path_to_library, bams = _config
+    key = proband if bams.get(proband) else None
+    detector = _detectors.get(key)
+    if detector is None:
+        if key is None:
+            detector = DenovoDetector(path_to_library)
+        else:
+            detector = DenovoDetector(path_to_library,
+                                      trio_list=bams[proband])
+        _detectors[key] = detector
+        if len(_detectors) > MAX_DETECTORS:
+            _, evicted = _detectors.popitem(last=False)
+            evicted.close()
+    else:
+        _detectors.move_to_end(key)
+    return detector
+
+
+def detect(task: Tuple) -> Tuple:
+    '''
+    Runs the detector of the trio of a proband on a variant in a worker.
+    Returns if the variant passed, if the detector gives PP and PP
+    '''
+    proband, chromosome, pos, ref, alt, af, assembly = task
+    detector = get_detector(proband)
+    variant = VariantHandler(chromosome, pos, ref, alt, af,
+                             base_ref=assembly)
+    passed = detector.detect(variant)
+    return passed, detector.gives_pp(), variant.getProp("PP")
+
+
+def close_detectors():
+    for detector in _detectors.values():
+        detector.close()
+    _detectors.clear()
+
+
+class DenovoPipeline:
+    '''
+    Pool of worker processes running the Bayesian stage of de novo
+    calling (BAM pileups and EM), while the allele balance screen runs
+    in the main process. Trios are assigned to workers in turn, so that
+    the detector of a trio, created for its first variant, is open in
+    a single worker. Bams are lists of BAM files of the trio by proband,
+    detectors of trios without BAM files only check the library of
+    unrelated samples
+    '''
+    def __init__(self, workers: int, path_to_library: str,
+                 bams: Dict[str, List[str]], assembly: str = None) -> None:
+        self.workers = workers
+        self.path_to_library = path_to_library
+        self.bams = bams
+        self.assembly = assembly
+        self.executors = []
+        # Index of the worker by proband
+        self.routes = dict()
+
+    def get_executor(self, proband: str) -> ProcessPoolExecutor:
+        if not self.executors:
+            self.executors = [
+                ProcessPoolExecutor(1, initializer=init_worker,
+                                    initargs=(self.path_to_library,
+                                              self.bams))
+                for _ in range(self.workers)]
+        i = self.routes.get(proband)
+        if i is None:
+            i = len(self.routes) % self.workers
+            self.routes[proband] = i
+        return self.executors[i]
+
+    def submit(self, proband: str, chromosome: str, pos: int, ref, alt,
+               af: float) -> Future:
+        return self.get_executor(proband).submit(
+            detect, (proband, chromosome, pos, ref, alt, af, self.assembly))
+
+    def close(self):
+        for executor in self.executors:
+            executor.shutdown(wait=True)
+        self.executors = []
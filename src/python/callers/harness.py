@@ -18,29 +18,52 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 
+import bisect
+import json
 import os
 import shutil
 import time
 import traceback
-from collections import OrderedDict
+from collections import deque
+from functools import partial
 
+import pysam
 import sortedcontainers
 import vcf as pyvcf
 from vcf.model import _Record
 from typing import Dict, Set, List, Collection
 
-from callers.ab_caller import ABCaller
-from callers.abstract_caller import AbstractCaller, VariantContext
-from utils.vcf_wrappers import JumpVCFReader
+from callers.ab_caller import ABCaller, GenotypeBlock
+from callers.abstract_caller import AbstractCaller, VariantContext, \
+    DeferredCall
+from callers.caller_graph import CallerGraph
+from utils.columnar import convert_calls, read_tag_types
+from utils.metrics import Metrics
+from utils.profiler import SamplingProfiler
+from utils.regions import format_interval
+from utils.tsv import iterate_calls, CallsWriter, CallBuffer, Pos, \
+    SPILL_LIMIT
+from utils.vcf_annotator import VCFAnnotator, BlockAnnotator
+from utils.vcf_wrappers import JumpVCFReader, PysamVCFReader, Prescreen, \
+    open_vcf_reader, get_indexed_contigs, STDIN
 
 HEADER_FILE_NAME = "new_calls_header.vcf"
 CALLS_FILE_NAME = "new_calls.tsv"
 LIMIT = 100
+BLOCK_SIZE = 256
+# Records waiting for deferred calls, before the oldest one is waited for
+PENDING_LIMIT = 4096
+CHECKPOINT_INTERVAL = 60
 
 
-def execute(cmd):
-    print (cmd) 
-    os.system(cmd)
+def write_checkpoint(checkpoint_file: str, checkpoint: Dict,
+                     calls_file_size: int):
+    checkpoint["calls_file_size"] = calls_file_size
+    with open(checkpoint_file + ".tmp", "w") as f:
+        json.dump(checkpoint, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(checkpoint_file + ".tmp", checkpoint_file)
 
 
 def next_chromosome(chromosome:str) -> str:
@@ -65,14 +88,17 @@ def next_chromosome(chromosome:str) -> str:
 class Harness():
     def __init__(self, vcf_file: str, family: Dict, callers: Set,
                  flush = None, call_set:List = None, start_pos = None,
-                 stop = False) -> None:
+                 stop = False, regions: List = None, resume = False,
+                 reader: str = None, spill_limit: int = SPILL_LIMIT,
+                 threads: int = 1) -> None:
         super().__init__()
         self.input_vcf = vcf_file
-        if call_set:
-            self.vcf_reader = JumpVCFReader(filename=self.input_vcf,
-                                            call_set=call_set)
-        else:
-            self.vcf_reader = pyvcf.Reader(filename=self.input_vcf)
+        self.reader = reader
+        self.vcf_reader = open_vcf_reader(self.input_vcf, reader, call_set,
+                                          threads)
+        if start_pos and resume:
+            print("Resuming from checkpoint, start position is ignored")
+            start_pos = None
         if start_pos:
             x = start_pos.split(':')
             chromosome = x[0].strip()
@@ -88,24 +114,59 @@ class Harness():
                 self.fetch_next = True
         else:
             self.fetch_next = False
+        self.regions = regions
         self.family = family
-        self.calls = OrderedDict()
+        # Calls, which are not flushed, are spilled to disk over the limit
+        self.calls = CallBuffer(spill_limit)
+        # Position of the last calls added
+        self.last_key = None
         self.callers = callers
         if flush and not isinstance(flush, str):
             flush = CALLS_FILE_NAME
         self.calls_file = flush
         self.calls_file_open = False
-        if self.calls_file:
-            self.open_calls()
-            self.calls_file_open = True
-
+        self.writer = None
+        self.tags = None
         self.header_file = None
         self.variant_counter = 0
+        # Records rejected by prescreen, included in variant_counter
+        self.rejected = 0
         self.call_counter = 0
         self.variant_called = 0
+        # The last record processed: chromosome, position and the number
+        # of records at this position
+        self.position = None
+        self.resume_position = None
+        self.complete = False
+        # Checkpoints are only written if the run can be resumed
+        self.checkpointing = bool(resume and self.calls_file)
+        self.checkpoint_time = time.time()
+        if self.calls_file and resume and self.resume():
+            self.calls_file_open = True
+        elif self.calls_file:
+            self.open_calls()
+            self.calls_file_open = True
+
         self.use_context = len(callers) > 1
         self.shared_context = None
+        self.graph = None
+        self.context_records = None
+        self.context_block = None
+        # Records waiting for deferred calls, with their calls
+        self.pending = deque()
+        self.pending_limit = PENDING_LIMIT
         self.debug_mode = False
+        self.annotator = None
+        self.annotated_file = None
+        self.metrics = None
+        self.profiler = None
+        self.annotated_tags = None
+        self.use_prescreen = True
+        self.prescreen = None
+        self.report_intervals = False
+        self.interval = None
+        # Calls are only written to annotated VCF, if not kept
+        self.keep_calls = True
 
     def update_calls(self, caller:AbstractCaller, all_calls: Dict, new_calls: Dict) -> None:
         if (caller.get_n() > 0):
@@ -118,15 +179,185 @@ class Harness():
             all_calls.update(new_calls)
 
 
-    def init_context(self, samples: Set, record: _Record):
-        self.shared_context.reset()
-        genotypes = ABCaller.calculate_genotypes(record)
-        af = ABCaller.calculate_af(genotypes, samples)
-        self.shared_context["genotypes"] = genotypes
-        self.shared_context["af"] = af
+    def init_context(self, samples: Set, record: _Record, j: int):
+        '''
+        Sets products of the j-th record of the current block, shared by
+        callers. Nothing is decoded until a caller looks up genotypes, AF
+        (over all samples) or AD; genotypes of the whole block are
+        decoded once, for the first record needing AF or AD
+        '''
+        context = self.shared_context
+        context.reset()
+
+        def genotypes():
+            block = self.context_block
+            if block is not None and block.valid[j]:
+                return block.get_genotypes(j)
+            return ABCaller.calculate_genotypes(record)
+
+        def af():
+            block = self.get_context_block()
+            if block.valid[j]:
+                return float(block.af[j])
+            return ABCaller.calculate_af(context["genotypes"], samples)
+
+        def ad():
+            block = self.get_context_block()
+            return block.ref[:, j], block.alt[:, j], block.has_ad[:, j]
+
+        context.set_product("genotypes", genotypes)
+        context.set_product(("af", "all"), af)
+        context.set_product("ad", ad)
+
+    def set_context_block(self, records: List, block: GenotypeBlock = None):
+        self.context_records = records
+        self.context_block = block
+
+    def get_context_block(self) -> GenotypeBlock:
+        if self.context_block is None:
+            self.context_block = self.calculate_block_genotypes(
+                self.context_records)
+        return self.context_block
+
+    def select_samples(self, samples: Set):
+        if self.use_context:
+            required = set(samples)
+        else:
+            required = set()
+            for caller in self.callers:
+                required.update(caller.get_required_samples())
+        self.vcf_reader.set_samples(required)
+
+    def select_info(self):
+        keys = set()
+        for caller in self.callers:
+            keys.update(caller.get_required_info())
+        self.vcf_reader.set_info_keys(keys)
+
+    def select_prescreen(self):
+        '''
+        Makes the reader skip lines, for which every caller proves from
+        the raw text that no call is possible. Not used with a call set,
+        with htslib reader, when all lines are annotated or if any caller
+        can not prescreen
+        '''
+        if not self.use_prescreen or self.annotator is not None or \
+                isinstance(self.vcf_reader, (JumpVCFReader, PysamVCFReader)):
+            return
+        if not all(caller.has_prescreen() for caller in self.callers):
+            return
+        samples = set()
+        for caller in self.callers:
+            samples.update(caller.get_prescreen_samples())
+        self.prescreen = Prescreen(self.vcf_reader, samples,
+                                   self.check_prescreen)
+        self.vcf_reader.set_prescreen(self.prescreen)
+
+    def check_prescreen(self, fields: List, calls: Dict) -> List:
+        rules = []
+        for caller in self.callers:
+            rule = caller.prescreen(fields, calls)
+            if rule is None:
+                return None
+            rules.append("{}: {}".format(type(caller).__name__, rule))
+        return rules
+
+    def report_prescreen(self):
+        print("Prescreen rejected {:d} of {:d} variants".format(
+            self.prescreen.rejected,
+            self.prescreen.rejected + self.prescreen.accepted))
+        for rule, count in sorted(self.prescreen.counts.items()):
+            print("    {:<60} {:10d}".format(rule, count))
+        if self.prescreen.errors:
+            print("Prescreen could not check {:d} variants, accepted them. "
+                  "First error: {}".format(self.prescreen.errors,
+                                           self.prescreen.error))
+
+    def records(self):
+        if self.resume_position:
+            return self.skip_processed(self.read_records())
+        return self.read_records()
+
+    def skip_processed(self, records):
+        '''
+        Skips records up to the checkpoint, including the records
+        at the checkpoint position, which have been processed
+        '''
+        chromosome, pos, n = self.resume_position
+        found = False
+        for record in records:
+            if record is None:
+                # End of an interval
+                yield record
+                continue
+            if not found:
+                if record.CHROM != chromosome or record.POS < pos:
+                    continue
+                found = True
+            if n > 0 and record.POS == pos and record.CHROM == chromosome:
+                n -= 1
+                continue
+            n = 0
+            yield record
+
+    def read_records(self):
+        '''
+        Records of the input or of the regions, fetched with the index.
+        If intervals are reported, end of every region is marked by None
+        '''
+        if self.regions:
+            for i, region in enumerate(self.regions):
+                chromosome, start, end = region
+                if self.report_intervals:
+                    self.start_interval(i)
+                for record in self.vcf_reader.fetch(chromosome, start, end):
+                    # fetch() also returns records overlapping the start
+                    if start is not None and record.POS <= start:
+                        continue
+                    yield record
+                if self.report_intervals:
+                    yield None
+            return
+
+        chromosome = None
+        while True:
+            try:
+                record = next(self.vcf_reader)
+                chromosome = record.CHROM
+            except StopIteration:
+                if chromosome and self.fetch_next:
+                    chromosome = next_chromosome(chromosome)
+                    if chromosome:
+                        print("Jumping to {}".format(chromosome))
+                        self.vcf_reader.fetch(chromosome)
+                        continue
+                break
+            yield record
+
+    def blocks(self):
+        block = []
+        for record in self.records():
+            if record is None:
+                # Blocks do not span intervals, the interval is reported
+                # when its last block is processed
+                if block:
+                    yield block
+                    block = []
+                self.end_interval()
+                continue
+            block.append(record)
+            if len(block) >= BLOCK_SIZE:
+                yield block
+                block = []
+        if block:
+            yield block
 
     def run(self):
         t0 = time.time()
+        if self.complete:
+            print("Run is already complete: {:d} variants processed".
+                  format(self.variant_counter))
+            return time.time() - t0
         samples = {s for s in self.vcf_reader.samples}
         for caller in self.callers:
             caller.init(self.family, samples)
@@ -134,88 +365,372 @@ class Harness():
             self.shared_context = VariantContext()
             for caller in self.callers:
                 caller.set_shared_context(self.shared_context)
+        self.graph = CallerGraph(self.callers)
+        self.select_samples(samples)
+        self.select_info()
+        self.select_prescreen()
+        batch = all(caller.has_block_calls() for caller in self.callers)
+        if self.metrics is not None:
+            for caller in self.callers:
+                caller.set_metrics(self.metrics)
 
-        #        for record in self.vcf_reader:
-        record = None
+        metrics = self.metrics
+        blocks = self.blocks()
         while True:
-            prev = record
-            try:
-                record = next(self.vcf_reader)
-            except StopIteration:
-                if prev and self.fetch_next:
-                    chromosome = next_chromosome(prev.CHROM)
-                    if chromosome:
-                        print("Jumping to {}".format(chromosome))
-                        self.vcf_reader.fetch(chromosome)
+            t = time.perf_counter()
+            block = next(blocks, None)
+            if block is None:
+                break
+            if metrics is not None:
+                t = self.add_time("parsing", t)
+            profile = self.profiler is not None and \
+                      self.profiler.sample_block(block)
+            genotype_block = None
+            if batch:
+                genotype_block = self.calculate_block_genotypes(block,
+                                                                profile)
+            if self.use_context:
+                self.set_context_block(block, genotype_block)
+            if metrics is not None:
+                t = self.add_time("genotypes", t)
+            block_calls = None
+            if batch:
+                block_calls = self.make_block_calls(genotype_block, profile)
+            for j, record in enumerate(block):
+                calls = None
+                deferred = []
+                try:
+                    if block_calls is not None and genotype_block.valid[j]:
+                        calls = self.collect_block_calls(block_calls, j)
                     else:
-                        break
+                        calls = self.make_record_calls(samples, record,
+                                                       genotype_block, j,
+                                                       profile, deferred)
+                    if metrics is not None:
+                        t = self.add_time("calling", t)
+                except Exception as e:
+                    self.report_error(record, e)
+                    calls = None
+                    deferred = []
+                if deferred or self.pending:
+                    self.pending.append((record, calls, deferred))
+                    self.finish_pending(t0, self.pending_limit)
                 else:
-                    break
+                    self.finish_record(t0, record, calls)
+                if metrics is not None:
+                    # flushing is measured by flush_calls(), annotating
+                    # by finish_record()
+                    t = time.perf_counter()
+            if self.checkpointing and \
+                    time.time() - self.checkpoint_time > CHECKPOINT_INTERVAL:
+                self.commit_calls()
+            if metrics is not None:
+                self.update_metrics()
+                metrics.maybe_write()
 
-            self.variant_counter += 1
-            if (hasattr(self.vcf_reader, "jump")):
-                step = 1000
-            else:
-                step = 10000
-            if (self.variant_counter % step) == 0:
-                print("Processed {:d} variants in {:7.2f} sec, detected {:d} calls."
-                      " Current: {}:{:d}".
-                      format(self.variant_counter, time.time() - t0,
-                            self.call_counter,
-                            record.CHROM,
-                            record.POS
-                ))
+        self.finish_pending(t0, 0)
+        # Lines rejected by prescreen after the last record
+        self.count_rejected(getattr(self.vcf_reader, "skipped", 0))
+        if self.annotator is not None:
+            self.annotator.close()
+            print("Annotated {:d} records in {}".format(
+                self.annotator.annotated, self.annotated_file))
+        if self.calls_file_open:
+            self.complete = True
+            self.flush_calls()
+            self.close_calls()
+            self.remove_checkpoint()
+            print("Totally: processed {:d} variants, flushed {:d} calls".
+                  format(self.variant_counter, self.call_counter))
+        if self.prescreen is not None:
+            self.report_prescreen()
+        if metrics is not None:
+            self.update_metrics()
+            metrics.write()
+        if self.profiler is not None:
+            self.profiler.write()
+
+        return (time.time() - t0)
+
+    def collect_metrics(self, metrics_file: str):
+        '''
+        Makes run() measure time spent in stages and by every caller and
+        periodically write the metrics to a file
+        '''
+        self.metrics = Metrics(metrics_file)
+
+    def profile_to(self, profile_file: str, rate: float, region: str = None):
+        '''
+        Makes run() profile callers on a random sample of records, or on
+        records of a region, and write folded stacks to a file
+        '''
+        self.profiler = SamplingProfiler(profile_file, rate, region)
 
+    def add_time(self, stage: str, t: float) -> float:
+        now = time.perf_counter()
+        self.metrics.add_time(stage, now - t)
+        return now
+
+    def update_metrics(self):
+        self.metrics.set_counters(records=self.variant_counter,
+                                  calls=self.call_counter,
+                                  variants_called=self.variant_called)
+        if self.prescreen is not None:
+            self.metrics.set_counters(prescreened=self.rejected)
+
+    def start_interval(self, i: int):
+        self.interval = (i, time.time(), self.variant_counter,
+                         self.call_counter)
+
+    def end_interval(self):
+        i, t, n, n_calls = self.interval
+        n_intervals = len(self.regions)
+        if self.metrics is not None:
+            self.metrics.set_counters(intervals=i + 1,
+                                      intervals_total=n_intervals)
+        step = max(1, n_intervals // 100)
+        if (i + 1) % step == 0 or i + 1 == n_intervals:
+            print("Interval {:d}/{:d} {}: {:d} variants, {:d} calls in "
+                  "{:.2f} sec".format(i + 1, n_intervals,
+                                      format_interval(self.regions[i]),
+                                      self.variant_counter - n,
+                                      self.call_counter - n_calls,
+                                      time.time() - t))
+
+    def update_position(self, record: _Record):
+        if self.position and self.position[0] == record.CHROM \
+                and self.position[1] == record.POS:
+            self.position[2] += 1
+        else:
+            self.position = [record.CHROM, record.POS, 1]
+
+    def report_progress(self, t0, record, n: int = 1):
+        '''
+        Reports progress when the last n records processed cross
+        a multiple of the step
+        '''
+        if (hasattr(self.vcf_reader, "jump")):
+            step = 1000
+        else:
+            step = 10000
+        if self.variant_counter // step != \
+                (self.variant_counter - n) // step:
+            print("Processed {:d} variants in {:7.2f} sec, detected {:d} calls."
+                  " Current: {}:{:d}".
+                  format(self.variant_counter, time.time() - t0,
+                        self.call_counter,
+                        record.CHROM,
+                        record.POS
+            ))
+
+    def calculate_block_genotypes(self, block: List,
+                                  profile: bool = False) -> GenotypeBlock:
+        if profile:
+            with self.profiler.profile("GenotypeBlock"):
+                return self.calculate_block_genotypes(block)
+        genotype_block = ABCaller.calculate_block_genotypes(
+            block, self.vcf_reader.selected)
+        # AF of the shared context is calculated only if a caller uses it
+        genotype_block.shared_af = self.use_context
+        return genotype_block
+
+    def finish_record(self, t0, record: _Record, calls: Dict):
+        '''
+        Counts a processed record, together with the records rejected by
+        prescreen before it, adds its calls and annotates it.
+        Records are finished in the order of input
+        '''
+        skipped = getattr(record, "skipped", 0)
+        self.count_rejected(skipped)
+        self.variant_counter += 1
+        self.report_progress(t0, record, skipped + 1)
+        self.update_position(record)
+        try:
+            self.add_calls(record, calls)
+        except Exception as e:
+            self.report_error(record, e)
+        if self.annotator is not None:
+            t = time.perf_counter()
+            self.annotator.write(record.line, self.get_values(
+                calls, self.annotated_tags))
+            if self.metrics is not None:
+                self.add_time("annotating", t)
+
+    def count_rejected(self, n: int):
+        '''
+        Counts records rejected by prescreen as processed
+        '''
+        self.variant_counter += n
+        self.rejected += n
+
+    def finish_pending(self, t0, limit: int):
+        '''
+        Finishes records waiting for deferred calls, in order, while
+        their calls are made or more than limit records are waiting
+        '''
+        while self.pending:
+            record, calls, deferred = self.pending[0]
+            if len(self.pending) <= limit and \
+                    not all(call.done() for caller, call in deferred):
+                break
+            self.pending.popleft()
             try:
-                if self.use_context:
-                    self.init_context(samples, record)
-                else:
-                    for caller in self.callers:
-                        caller.reset_context()
-                calls = dict()
-                for caller in self.callers:
-                    call = caller.make_call(record)
+                for caller, call in deferred:
+                    call = call.result()
                     if (call):
                         self.update_calls(caller, calls, call)
-                if not calls:
-                    continue
-                chromosome = record.CHROM
-                pos = record.POS
-                self.calls[(chromosome, pos)] = calls
-                self.call_counter += len(calls)
-                self.variant_called += 1
-                if self.calls_file_open and len(self.calls) > LIMIT:
-                    self.flush_calls()
-                    print("Processed {:d} variants, flushed {:d} calls".
-                          format(self.variant_counter, self.call_counter))
             except Exception as e:
-                print("Error in {}: {}".format(record.CHROM, record.POS))
-                print(str(e))
-                if self.debug_mode:
-                    traceback.print_exc()
+                self.report_error(record, e)
+                calls = None
+            self.finish_record(t0, record, calls)
+
+    def report_error(self, record: _Record, e: Exception):
+        print("Error in {}: {}".format(record.CHROM, record.POS))
+        print(str(e))
+        if self.debug_mode:
+            traceback.print_exc()
+
+    def make_record_calls(self, samples: Set, record: _Record,
+                          genotype_block: GenotypeBlock, j: int,
+                          profile: bool = False,
+                          deferred: List = None) -> Dict:
+        '''
+        Calls of a record. Deferred calls (see DeferredCall) are appended
+        to the deferred list with their callers or, without it, waited for
+        '''
+        if self.use_context:
+            self.init_context(samples, record, j)
+            self.graph.set_products(self.shared_context, record)
+        else:
+            for caller in self.callers:
+                caller.reset_context()
+        calls = dict()
+        graph, context = self.graph, self.shared_context
+        for caller in self.callers:
+            if profile:
+                with self.profiler.profile(type(caller).__name__):
+                    call = graph.make_call(caller, record, context)
+            elif self.metrics is not None:
+                t = time.perf_counter()
+                call = graph.make_call(caller, record, context)
+                self.metrics.observe(caller.get_my_tag(),
+                                     time.perf_counter() - t)
+            else:
+                call = graph.make_call(caller, record, context)
+            if isinstance(call, DeferredCall):
+                if deferred is not None:
+                    deferred.append((caller, call))
+                    continue
+                call = call.result()
+            if (call):
+                self.update_calls(caller, calls, call)
+        return calls
 
+    def make_block_calls(self, genotype_block: GenotypeBlock,
+                         profile: bool = False) -> List:
+        try:
+            if profile:
+                block_calls = []
+                for caller in self.callers:
+                    with self.profiler.profile(type(caller).__name__):
+                        block_calls.append(
+                            (caller, caller.make_calls(genotype_block)))
+                return block_calls
+            if self.metrics is None:
+                return [(caller, caller.make_calls(genotype_block))
+                        for caller in self.callers]
+            block_calls = []
+            n = len(genotype_block.records)
+            for caller in self.callers:
+                t = time.perf_counter()
+                block_calls.append((caller, caller.make_calls(genotype_block)))
+                self.metrics.observe(caller.get_my_tag(),
+                                     (time.perf_counter() - t) / n, n)
+            return block_calls
+        except Exception as e:
+            # Records of this block are called one by one
+            print("Error in block of records: {}".format(e))
+            if self.debug_mode:
+                traceback.print_exc()
+            return None
 
-        if self.calls_file_open and len(self.calls) > 0:
+    def collect_block_calls(self, block_calls: List, j: int) -> Dict:
+        calls = dict()
+        for caller, caller_calls in block_calls:
+            call = caller_calls[j]
+            if (call):
+                self.update_calls(caller, calls, call)
+        return calls
+
+    def add_calls(self, record: _Record, calls: Dict):
+        if not calls:
+            return
+        chromosome = record.CHROM
+        pos = record.POS
+        self.call_counter += len(calls)
+        self.variant_called += 1
+        if not self.keep_calls:
+            return
+        key = (chromosome, pos)
+        # Calls of records at the same position replace each other, they
+        # are not flushed in between, so that a position is written once
+        if self.calls_file_open and len(self.calls) > LIMIT and \
+                key != self.last_key:
             self.flush_calls()
-            print("Totally: processed {:d} variants, flushed {:d} calls".
+            print("Processed {:d} variants, flushed {:d} calls".
                   format(self.variant_counter, self.call_counter))
-
-        return (time.time() - t0)
+        self.calls[key] = calls
+        self.last_key = key
 
     def get_calls(self):
         return self.calls
 
+    @staticmethod
+    def get_values(calls: Dict, tags: Collection = None) -> Dict:
+        if not calls:
+            return calls
+        if tags is None:
+            tags = calls
+        return {tag: calls[tag] if calls[tag] != None else "1"
+                for tag in tags if tag in calls}
+
+    def annotate_to(self, output_file: str, tags = None, threads = 2):
+        '''
+        Makes run() write annotated copy of the input VCF while
+        iterating, instead of a second pass with apply_calls(). Requires
+        sequential reading of the whole input. Input from stdin is
+        annotated with its header as parsed
+        '''
+        if not tags:
+            tags = [t for t in self.get_tags()]
+        self.annotator = VCFAnnotator.from_header_lines(
+            self.get_header_lines(), tags)
+        header = None
+        if self.input_vcf == STDIN:
+            header = self.vcf_reader.get_header_lines()
+        self.annotator.open(self.input_vcf, output_file, threads, header)
+        self.annotated_file = output_file
+        self.annotated_tags = list(self.get_tags())
+
+    def get_header_lines(self) -> List[str]:
+        '''
+        VCF header lines of the tags of callers
+        '''
+        tags = set()
+        lines = []
+        for caller in self.callers:
+            if len(set(caller.get_all_tags()) - tags) == 0:
+                continue
+            tags.update(caller.get_all_tags())
+            lines.extend(line + '\n'
+                         for line in caller.get_header().split('\n'))
+        return lines
+
     def write_header(self, file_name = None):
         if file_name is None:
             file_name = HEADER_FILE_NAME
-        tags = set()
         with open(file_name, "w") as header:
-            for caller in self.callers:
-                if len(set(caller.get_all_tags()) - tags) == 0:
-                    continue
-                tags.update(caller.get_all_tags())
-                header_line = caller.get_header()
-                header.write(header_line + '\n')
+            header.writelines(self.get_header_lines())
         self.header_file = file_name
 
     def get_tags(self) -> sortedcontainers.SortedSet:
@@ -225,11 +740,27 @@ class Harness():
         return tags
 
     def open_calls(self):
-        tags = self.get_tags()
+        self.close_calls()
+        self.tags = list(self.get_tags())
         with open(self.calls_file, "w") as f:
-            f.write("# CHROM\tPOS\t{}\n".format('\t'.join(tags)))
+            f.write("# CHROM\tPOS\t{}\n".format('\t'.join(self.tags)))
         self.calls_file_open = True
 
+    def get_writer(self) -> CallsWriter:
+        if self.writer is None:
+            if self.tags is None:
+                self.tags = list(self.get_tags())
+            self.writer = CallsWriter(self.calls_file, self.tags)
+        return self.writer
+
+    def close_calls(self):
+        '''
+        Waits until all flushed calls are written to the calls file
+        '''
+        if self.writer is not None:
+            writer, self.writer = self.writer, None
+            writer.close()
+
     def write_calls(self, file_name = None):
         if file_name:
             self.calls_file = file_name
@@ -237,48 +768,144 @@ class Harness():
             self.calls_file = CALLS_FILE_NAME
         if not self.calls_file_open:
             self.open_calls()
+        self.close_calls()
         if os.path.exists(self.calls_file):
             try:
                 shutil.copyfile(self.calls_file, self.calls_file + ".bak")
             except Exception as e:
                 print(e)
         self.flush_calls()
+        self.close_calls()
+
+    def write_columnar(self, output_file: str) -> str:
+        '''
+        Writes the calls file in columnar format (Arrow IPC, Parquet or
+        npz, by extension) with columns typed as the tags in the header.
+        Returns the name of the written file
+        '''
+        self.close_calls()
+        types = dict()
+        for caller in self.callers:
+            types.update(read_tag_types(caller.get_header().splitlines()))
+        return convert_calls(self.calls_file, output_file, types)
 
     def flush_calls(self):
         if not self.calls:
             return
+        t = time.perf_counter()
         if not self.calls_file_open:
             self.open_calls()
-        tags = self.get_tags()
-        with open(self.calls_file, "a") as f:
-            for key in self.calls:
-                calls = {tag: v if v != None else "1" for tag, v in self.calls[key].items()}
-                p = [str(k) for k in key]
-                line = '\t'.join(p + [calls.get(tag, ".") for tag in tags])
-                f.write(line + '\n')
+        for batch in self.calls.batches():
+            self.get_writer().write(batch)
         self.calls.clear()
+        if self.metrics is not None:
+            self.add_time("flushing", t)
+
+    def get_checkpoint_file(self) -> str:
+        return self.calls_file + ".checkpoint"
+
+    def commit_calls(self):
+        '''
+        Flushes calls and atomically writes checkpoint with
+        the position of the last processed record, counters and the size
+        of calls file. Only used if the run can be resumed
+        '''
+        self.flush_calls()
+        checkpoint = {
+            "vcf": self.input_vcf,
+            "position": list(self.position) if self.position else None,
+            "variant_counter": self.variant_counter,
+            "rejected": self.rejected,
+            "call_counter": self.call_counter,
+            "variant_called": self.variant_called,
+            "complete": self.complete
+        }
+        # Written by the writer thread, when the calls are in the file
+        self.get_writer().callback(partial(write_checkpoint,
+                                           self.get_checkpoint_file(),
+                                           checkpoint))
+        self.checkpoint_time = time.time()
 
-    def apply_calls(self, output_file, tags = None):
+    def remove_checkpoint(self):
+        '''
+        Removes the checkpoint of a complete run, when all calls
+        are written
+        '''
+        if not self.checkpointing:
+            return
+        checkpoint_file = self.get_checkpoint_file()
+        if os.path.exists(checkpoint_file):
+            os.remove(checkpoint_file)
+
+    def resume(self) -> bool:
+        '''
+        Restores state from the checkpoint: truncates calls file
+        to the size at the checkpoint and positions the reader after
+        the last processed record. Returns False if there is nothing
+        to resume from
+        '''
+        checkpoint_file = self.get_checkpoint_file()
+        if not os.path.exists(checkpoint_file) or \
+                not os.path.exists(self.calls_file):
+            print("No checkpoint found for {}, starting from the beginning".
+                  format(self.calls_file))
+            return False
+        with open(checkpoint_file) as f:
+            checkpoint = json.load(f)
+        if checkpoint["vcf"] != self.input_vcf:
+            raise ValueError("Checkpoint {} was written for {}".format(
+                checkpoint_file, checkpoint["vcf"]))
+        with open(self.calls_file, "r+") as f:
+            f.truncate(checkpoint["calls_file_size"])
+        self.variant_counter = checkpoint["variant_counter"]
+        self.rejected = checkpoint.get("rejected", 0)
+        self.call_counter = checkpoint["call_counter"]
+        self.variant_called = checkpoint["variant_called"]
+        self.complete = checkpoint["complete"]
+        self.position = checkpoint["position"]
+        if self.complete or not self.position:
+            return True
+        print("Resuming after {}:{:d}, {:d} variants processed".format(
+            self.position[0], self.position[1], self.variant_counter))
+        self.resume_position = tuple(self.position)
+        if isinstance(self.vcf_reader, JumpVCFReader):
+            # Candidates are read from the checkpoint position, records
+            # there, which have been processed, are skipped
+            # by skip_processed()
+            self.vcf_reader.pos_in_call_set = bisect.bisect_left(
+                self.vcf_reader.call_set, Pos(*self.position[:2]))
+            return True
+        chromosome = self.position[0]
+        contigs = get_indexed_contigs(self.input_vcf)
+        if self.regions is None and contigs:
+            if chromosome in contigs:
+                following = contigs[contigs.index(chromosome) + 1:]
+                self.regions = [(chromosome, self.position[1] - 1, None)] + \
+                               [(c, None, None) for c in following]
+        return True
+
+    def apply_calls(self, output_file, tags = None, threads = 2):
         self.flush_calls()
+        self.close_calls()
         if not tags:
             tags = [t for t in self.get_tags()]
-        calls_file_final = self.calls_file + ".final"
-        if os.path.exists(self.calls_file):
-            execute("cp {} {}".format(self.calls_file, calls_file_final))
+        calls_file = self.calls_file
+        if not os.path.exists(calls_file):
+            calls_file = self.calls_file + ".final"
+        passthrough = BlockAnnotator.can_annotate(self.input_vcf, output_file)
+        if passthrough:
+            annotator = BlockAnnotator.from_header_file(self.header_file, tags)
         else:
-            execute("cp {} {}".format(calls_file_final, self.calls_file))
-
-        execute("bgzip -f {}".format(self.calls_file))
-        execute("tabix -s1 -b2 -e2 -f {}.gz".format(self.calls_file))
-        columns = ','.join(["CHROM","POS"] + tags)
-        if output_file.endswith("gz"):
-            pack = "-Oz --threads 2 "
-        else:
-            pack = ""
-        execute("bcftools annotate -a {}.gz -h {} -c {} -o {} {} {}".
-                  format(self.calls_file, self.header_file,
-                         columns, output_file, self.input_vcf, pack))
-
+            annotator = VCFAnnotator.from_header_file(self.header_file, tags)
+        annotator.annotate(self.input_vcf, output_file,
+                           iterate_calls(calls_file), threads=threads)
+        if passthrough:
+            pysam.tabix_index(output_file, preset="vcf", force=True)
+        print("Annotated {:d} records in {}".format(annotator.annotated,
+                                                    output_file))
+        if annotator.unmatched:
+            print("Warning: {:d} calls do not match any record in {}".
+                  format(annotator.unmatched, self.input_vcf))
 
     @classmethod
     def read_header(cls, header_file):
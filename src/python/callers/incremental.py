@@ -0,0 +1,262 @@
+#  Copyright (c) 2019. Partners HealthCare, Harvard Medical School’s
+#  Department of Biomedical Informatics
+#
+#  Developed by Sergey Trifonov and Michael Bouzinier, based on contributions by:
+#  Anwoy Kumar Mohanty, Andrew Bjonnes,
+#  Ignat Leshchiner, Shamil Sunyaev and other members of Division of Genetics,
+#  Brigham and Women's Hospital
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import hashlib
+import multiprocessing
+import time
+from collections import OrderedDict
+from functools import partial
+from itertools import islice
+from typing import Collection, Dict, List, Callable, Tuple
+
+import numpy as np
+
+from callers.ab_caller import ABCaller
+from callers.harness import BLOCK_SIZE, LIMIT
+from callers.parallel import ShardedHarness, plan_shards, run_shard, \
+    SHARD_SIZE
+from utils.regions import format_interval
+from utils.result_store import ResultStore, get_hash, make_key
+from utils.tsv import CallBuffer, SPILL_LIMIT
+from utils.vcf_wrappers import open_vcf_reader
+
+
+def plan_store_shards(vcf_file: str, contigs: Dict, regions: List = None,
+                      shard_size: int = SHARD_SIZE) -> List[Tuple]:
+    '''
+    Shards of the input VCF as pairs of a name and a list of regions,
+    which do not depend on the number of processes: regions of
+    plan_shards() or target intervals, grouped by these regions
+    '''
+    if regions is None:
+        return [(format_interval(shard), [shard])
+                for shard in plan_shards(vcf_file, contigs, shard_size)]
+    shards = OrderedDict()
+    for region in regions:
+        chromosome, start, end = region
+        n = start // shard_size
+        name = format_interval((chromosome, n * shard_size,
+                                (n + 1) * shard_size))
+        shards.setdefault(name, []).append(region)
+    return list(shards.items())
+
+
+def get_fingerprints(vcf_file: str, regions: List[Tuple],
+                     families: Dict[str, Collection], reader: str = None,
+                     exact_af: bool = False) -> Dict[str, str]:
+    '''
+    Fingerprints of the records in the regions by family, in a single
+    pass: site columns and FORMAT with the columns of the samples of
+    the family, and AF over all samples and over the samples not in
+    the family, which calls of the family depend on. Unless exact_af,
+    AF is only taken as below the threshold or not, so that samples
+    added for another family change the fingerprint only if they change
+    calls of the family
+    '''
+    vcf_reader = open_vcf_reader(vcf_file, reader)
+    samples = list(vcf_reader.samples)
+    index = {sample: i for i, sample in enumerate(samples)}
+    digests = dict()
+    columns = dict()
+    others = dict()
+    for name, family in families.items():
+        present = [sample for sample in sorted(family) if sample in index]
+        digests[name] = hashlib.sha1('\t'.join(present).encode())
+        columns[name] = [index[sample] for sample in present]
+        others[name] = np.array([i for sample, i in index.items()
+                                 if sample not in family], dtype=int)
+    for region in regions:
+        chromosome, start, end = region
+        interval = format_interval(region).encode()
+        for digest in digests.values():
+            digest.update(interval)
+        # fetch() also returns records overlapping the start
+        records = (record for record in
+                   vcf_reader.fetch(chromosome, start, end)
+                   if start is None or record.POS > start)
+        while True:
+            block = list(islice(records, BLOCK_SIZE))
+            if not block:
+                break
+            genotypes = ABCaller.calculate_block_genotypes(block, samples)
+            af = ABCaller.calculate_block_af(genotypes)
+            other_af = {name: ABCaller.calculate_block_af(genotypes,
+                                                          others[name])
+                        for name in families}
+            for j, record in enumerate(block):
+                row = record.row
+                site = '\t'.join(row[:9])
+                calls = row[9].split('\t') if len(row) > 9 else []
+                for name, digest in digests.items():
+                    values = [site] + [calls[i] for i in columns[name]
+                                       if i < len(calls)]
+                    if not genotypes.valid[j]:
+                        values.append("invalid")
+                    elif exact_af:
+                        values += [repr(af[j]), repr(other_af[name][j])]
+                    else:
+                        values += [str(af[j] < ABCaller.AF_THRESHOLD),
+                                   str(other_af[name][j] <
+                                       ABCaller.AF_THRESHOLD)]
+                    digest.update(('\t'.join(values) + '\n').
+                                  encode("latin-1"))
+    return {name: digest.hexdigest() for name, digest in digests.items()}
+
+
+class StoredHarness(ShardedHarness):
+    '''
+    Keeps calls of every family by shard of the input VCF in a result
+    store and runs callers only for shards and families, which are not
+    there: new families, families with changed pedigree or callers and
+    shards with changed records. Callers for a subset of families are
+    created by callers_factory(names). The calls file is assembled from
+    the store and is identical to the one written by a sequential run
+    '''
+    def __init__(self, vcf_file: str, family: Dict, callers: set,
+                 callers_factory: Callable, store: ResultStore,
+                 families: Dict, config: Dict, jobs: int = 1,
+                 flush = None, reader: str = None,
+                 regions: List = None, spill_limit: int = SPILL_LIMIT) -> None:
+        super().__init__(vcf_file, family, callers,
+                         callers_factory=callers_factory, jobs=jobs,
+                         flush=flush, reader=reader, regions=regions,
+                         spill_limit=spill_limit)
+        self.store = store
+        self.families = families
+        self.config_hash = get_hash(config)
+        # The Bayesian caller takes the value of AF
+        self.exact_af = bool(config.get("dnlib"))
+
+    def get_family_tags(self, name: str) -> List[str]:
+        tags = set()
+        for caller in self.callers:
+            if hasattr(caller, "get_family_tags"):
+                tags.update(caller.get_family_tags(name))
+            else:
+                tags.update(caller.get_all_tags())
+        return sorted(tags)
+
+    def plan(self, shards: List[Tuple]) -> List[Tuple]:
+        '''
+        Keys of the families for every shard and the families, which
+        entries are missing or stale
+        '''
+        family_hashes = {name: get_hash(family)
+                         for name, family in self.families.items()}
+        plan = []
+        for shard, regions in shards:
+            fingerprints = get_fingerprints(self.input_vcf, regions,
+                                            self.families, self.reader,
+                                            self.exact_af)
+            keys = {name: make_key(shard, family_hashes[name],
+                                   self.config_hash, fingerprints[name])
+                    for name in self.families}
+            stale = [name for name in self.families
+                     if self.store.get(name, keys[name]) is None]
+            plan.append((shard, regions, keys, stale))
+        return plan
+
+    def store_calls(self, regions: List, keys: Dict, stale: List,
+                    calls: CallBuffer, records: int):
+        for name in stale:
+            tags = self.get_family_tags(name)
+            selected = set(tags)
+            family_calls = []
+            for key, values in calls.items():
+                values = {tag: value for tag, value in values.items()
+                          if tag in selected}
+                if values:
+                    family_calls.append((key, values))
+            self.store.put(name, keys[name], regions, tags, family_calls,
+                           records)
+
+    def compute(self, plan: List[Tuple]):
+        t0 = time.time()
+        pending = [(regions, keys, stale)
+                   for shard, regions, keys, stale in plan if stale]
+        n_families = len({name for _, _, stale in pending for name in stale})
+        print("Computing {:d} of {:d} shards for {:d} of {:d} families, "
+              "the rest is in the store".format(len(pending), len(plan),
+                                                n_families,
+                                                len(self.families)))
+        tasks = [(self.input_vcf, self.family,
+                  partial(self.callers_factory, stale), regions, None,
+                  self.debug_mode, self.use_prescreen, self.reader,
+                  self.spill_limit)
+                 for regions, keys, stale in pending]
+        if self.jobs > 1 and len(tasks) > 1:
+            with multiprocessing.Pool(self.jobs) as pool:
+                self.store_results(pending, pool.imap(run_shard, tasks), t0)
+        else:
+            self.store_results(pending, map(run_shard, tasks), t0)
+
+    def store_results(self, pending: List, results, t0: float):
+        n = 0
+        for (regions, keys, stale), ((runs, n_runs), counters) in \
+                zip(pending, results):
+            calls = CallBuffer(self.spill_limit)
+            calls.adopt(runs, n_runs)
+            try:
+                self.store_calls(regions, keys, stale, calls, counters[0])
+            finally:
+                calls.clear()
+            n += counters[0]
+            print("Processed {:d} variants in {:7.2f} sec".
+                  format(n, time.time() - t0))
+
+    def assemble(self, plan: List[Tuple]):
+        for shard, regions, keys, stale in plan:
+            records = None
+            rows = dict()
+            for name in self.families:
+                entry = self.store.get(name, keys[name])
+                if entry is None:
+                    raise ValueError("Calls of {} for {} are not in the "
+                                     "store".format(name, shard))
+                records = entry["records"]
+                for chromosome, pos, values in self.store.read_calls(
+                        name, keys[name]):
+                    rows.setdefault((chromosome, pos), dict()).update(values)
+            if records is not None:
+                self.variant_counter += records
+            # A shard is a part of a single chromosome
+            for key in sorted(rows, key=lambda k: k[1]):
+                self.calls[key] = rows[key]
+                self.call_counter += len(rows[key])
+                self.variant_called += 1
+                if self.calls_file_open and len(self.calls) > LIMIT:
+                    self.flush_calls()
+
+    def run(self):
+        t0 = time.time()
+        plan = self.plan(plan_store_shards(self.input_vcf,
+                                           self.vcf_reader.contigs,
+                                           self.regions))
+        self.compute(plan)
+        self.assemble(plan)
+        if self.calls_file_open and len(self.calls) > 0:
+            self.flush_calls()
+        print("Totally: processed {:d} variants, flushed {:d} calls".
+              format(self.variant_counter, self.call_counter))
+        self.close_calls()
+        if self.metrics is not None:
+            self.update_metrics()
+            self.metrics.write()
+        return (time.time() - t0)
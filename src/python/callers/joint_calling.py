@@ -18,13 +18,26 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 import argparse
+from functools import partial
+
 import vcf as pyvcf
 
 from callers.ab_denovo_caller import SpABDenovoCaller
 from callers.harness import Harness
+from callers.parallel import ShardedHarness
 from callers.joint_denovo_caller import JointDenovoCaller
 from utils.case_utils import parse_all_fam_files, get_trios_for_family
-from utils.tsv import create_tsv_reader
+from utils.profiler import PROFILE_SAMPLE_RATE
+from utils.tsv import create_tsv_reader, SPILL_LIMIT
+from utils.vcf_wrappers import VCF_READERS
+
+
+def create_callers(args, families):
+    return {JointDenovoCaller(f_metadata=args.families, vcf_file=args.vcf,
+                              path_to_bams=args.bams, path_to_library=args.dnlib,
+                              bayesian=True, first_stage_calls=args.f1,
+                              families_subset=families,
+                              workers=args.workers, assembly=args.assembly)}
 
 
 def run(args):
@@ -37,6 +50,9 @@ def run(args):
     #                and len(get_trios_for_family(families[name])) > 0)
     # }
 
+    if args.workers and args.jobs > 1:
+        raise ValueError("--workers runs the Bayesian stage in a pool of "
+                         "processes and can not be used with --jobs")
     families = None
     call_set = None
     calls_file = args.f1
@@ -54,28 +70,50 @@ def run(args):
                                        "{sample}:PASSED")
         call_set = tsv_reader.call_list()
 
-    callers = {JointDenovoCaller(f_metadata=args.families, vcf_file=vcf_file,
-                                 path_to_bams=args.bams, path_to_library=args.dnlib,
-                                 bayesian=True, first_stage_calls=calls_file,
-                                 families_subset=families)}
+    callers = create_callers(args, families)
 
     if args.output:
         flush = args.output
     else:
         flush = True
 
-    harness = Harness(vcf_file, family=None, callers=callers, flush=flush,
-                      call_set=call_set, start_pos=args.start)
+    if args.jobs > 1 and not args.start and not args.resume \
+            and not args.profile:
+        harness = ShardedHarness(vcf_file, family=None, callers=callers,
+                                 callers_factory=partial(create_callers,
+                                                         args, families),
+                                 jobs=args.jobs, flush=flush,
+                                 call_set=call_set, reader=args.reader,
+                                 spill_limit=args.spill_limit)
+    else:
+        harness = Harness(vcf_file, family=None, callers=callers, flush=flush,
+                          call_set=call_set, start_pos=args.start,
+                          resume=args.resume, reader=args.reader,
+                          threads=args.threads, spill_limit=args.spill_limit)
+    if args.metrics:
+        harness.collect_metrics(args.metrics)
+    if args.profile:
+        harness.profile_to(args.profile, args.profile_sample_rate,
+                           args.profile_region)
     harness.write_header()
-    t = harness.run()
+    try:
+        t = harness.run()
+    finally:
+        for caller in callers:
+            caller.close()
     n = harness.variant_counter
 
     print("Processed {:d} variants in {:.2f} seconds; rate = {:3.3f} variant/sec".
           format(n, t, n/t))
+    if harness.rejected:
+        print("Rejected by prescreen: {:d} of {:d} variants".
+              format(harness.rejected, n))
     print("Detected {:d} calls in {:d} variants".format(harness.call_counter,
                                                        harness.variant_called))
 
     harness.write_calls()
+    if args.columnar:
+        harness.write_columnar(args.columnar)
     if args.apply:
         harness.apply_calls("xx.vcf")
 
@@ -110,6 +148,56 @@ if __name__ == '__main__':
     parser.add_argument("--output",
             help="Output file with new calls",
             required=False)
+    parser.add_argument("--columnar",
+            help="Also write calls in columnar format with typed columns: "
+                 ".arrow, .feather or .parquet (requires pyarrow) or .npz",
+            required=False)
+    parser.add_argument("--profile",
+            help="Profile callers on a sample of records and write "
+                 "flame graph (folded stacks) to the given file",
+            required=False)
+    parser.add_argument("--profile_sample_rate", "--profile-sample-rate",
+            type=float, default=PROFILE_SAMPLE_RATE,
+            help="Fraction of blocks of records to profile",
+            required=False)
+    parser.add_argument("--profile_region", "--profile-region",
+            help="Profile only records in a region: chrom or chrom:start-end",
+            required=False)
+    parser.add_argument("--reader", choices=VCF_READERS,
+            help="VCF reader: pyvcf (pure Python) or pysam (htslib, "
+                 "also reads BCF). Default: pysam for .bcf, pyvcf otherwise",
+            required=False)
+    parser.add_argument("--spill_limit", "--spill-limit", type=int,
+            default=SPILL_LIMIT,
+            help="Calls kept in memory before they are spilled to temporary "
+                 "files, until written to the calls file; 0: no limit",
+            required=False)
+    parser.add_argument("--threads", type=int, default=1,
+            help="Threads decompressing bgzipped input VCF ahead of "
+                 "parsing, when it is read sequentially; 0: decompress "
+                 "in the reading thread",
+            required=False)
+    parser.add_argument("--metrics",
+            help="File to periodically write run metrics to: Prometheus "
+                 "text format if the name ends with .prom, JSON otherwise",
+            required=False)
+    parser.add_argument("--resume", action="store_true",
+            help="Resume interrupted run from the checkpoint, saved next "
+                 "to the output file with calls. Checkpoints are only saved "
+                 "with this option and removed when the run is complete",
+            required=False)
+    parser.add_argument("--jobs", type=int, default=1,
+            help="Number of processes, running callers over regions of "
+                 "tabix-indexed input VCF",
+            required=False)
+    parser.add_argument("--workers", type=int, default=0,
+            help="Number of processes running the Bayesian stage, while "
+                 "the allele balance screen streams candidate trios to "
+                 "them; 0: run it inline",
+            required=False)
+    parser.add_argument("--assembly", default="hg19",
+            help="Assembly to be used: hg19/hg38",
+            required=False)
     parser.add_argument("--apply", action="store_true",
             help="", required=False)
 
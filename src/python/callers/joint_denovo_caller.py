@@ -18,18 +18,20 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 import os
+from functools import partial
 from typing import Dict, Set, Tuple, List
 from vcf.model import _Record
 
 from callers.ab_denovo_caller import ABDenovoCaller
-from callers.abstract_caller import AbstractCaller
+from callers.abstract_caller import AbstractCaller, DeferredCall
+from callers.denovo_pipeline import DenovoPipeline
 from denovo2.detect.detect2 import DenovoDetector, VariantHandler
 from utils.misc import raiseException
 import sortedcontainers
-import vcf as pyvcf
 
 from utils.case_utils import parse_all_fam_files, get_trios_for_family, get_bam_patterns
 from utils.tsv import TSVReader, create_tsv_reader
+from utils.vcf_wrappers import read_samples
 
 
 class LocalCaller:
@@ -44,19 +46,24 @@ class JointDenovoCaller(AbstractCaller):
     def __init__(self, f_metadata:str, vcf_file:str, path_to_bams: str,
                  path_to_library: str,
                  pp_threshold: float = 0.7, bayesian: bool = True,
-                 first_stage_calls:str = None, families_subset:List = None):
+                 first_stage_calls:str = None, families_subset:List = None,
+                 workers: int = 0, assembly: str = None):
         super().__init__()
         self.local_callers = dict()
         self.path_to_bams = path_to_bams
         self.path_to_library = path_to_library
         self.pp_threshold = pp_threshold
         self.bayesian = bayesian
+        self.assembly = assembly
         self.calculates_pp = True if self.path_to_bams else False
         if self.calculates_pp:
             self.format = "{sample}:{pp:1.2f}"
         else:
             self.format = "{sample}:{passed}"
         self.first_stage_reader = None
+        # Bayesian stage runs in a pool of worker processes if workers > 0
+        self.workers = workers if bayesian else 0
+        self.pipeline = None
         self.check_families(f_metadata, vcf_file, first_stage_calls, families_subset)
 
     def check_families(self, f_metadata:str, vcf_file:str,
@@ -65,7 +72,6 @@ class JointDenovoCaller(AbstractCaller):
         families = parse_all_fam_files(f_metadata)
         if families_subset:
             families = {f:families[f] for f in families_subset}
-        vcf_reader = pyvcf.Reader(filename=vcf_file)
         patterns = get_bam_patterns()
         bam_pattern = None
         if first_stage_calls:
@@ -81,11 +87,13 @@ class JointDenovoCaller(AbstractCaller):
 
         if self.bayesian and self.calculates_pp:
             bam_pattern = os.path.join(self.path_to_bams, patterns[0])
-        samples = {s for s in vcf_reader.samples}
+        samples = set(read_samples(vcf_file))
 
         shared_detector = None
-        if not self.calculates_pp:
+        if not self.calculates_pp and not self.workers:
             shared_detector = DenovoDetector(self.path_to_library)
+        # BAM files of trios for the workers, None without BAM files
+        bams = dict()
 
         for name in families:
             family = families[name]
@@ -103,10 +111,15 @@ class JointDenovoCaller(AbstractCaller):
                             print("Skipping family {} because not all "
                                   "bams are present".format(name))
                             continue
-                        detector = DenovoDetector(self.path_to_library,
-                                        trio_list=list_of_bam_files)
+                        if self.workers:
+                            detector = None
+                            bams[proband] = list_of_bam_files
+                        else:
+                            detector = DenovoDetector(self.path_to_library,
+                                            trio_list=list_of_bam_files)
                     else:
                         detector = shared_detector
+                        bams[proband] = None
                 else:
                     detector = None
                 ab_caller = ABDenovoCaller()
@@ -115,11 +128,19 @@ class JointDenovoCaller(AbstractCaller):
                 local_caller = LocalCaller(proband, ab_caller, detector)
                 self.local_callers[proband] = local_caller
         print("Total trios: {:d}".format(len(self.local_callers)))
+        if self.workers:
+            self.pipeline = DenovoPipeline(self.workers, self.path_to_library,
+                                           bams, self.assembly)
         return
 
     def init(self, families: Dict, samples: Set):
+        self.samples = samples
         return
 
+    def get_required_samples(self) -> Set:
+        # AF is calculated over all samples in VCF
+        return set(self.samples)
+
     def make_call(self, record: _Record) -> Dict:
         chromosome = record.CHROM
         if not chromosome.startswith("chr"):
@@ -130,39 +151,77 @@ class JointDenovoCaller(AbstractCaller):
                 return dict()
 
         result = []
+        futures = []
+        probands = []
+
+        # Genotypes and AF are calculated when a trio caller needs them
+        context = self.variant_context
+        context.reset()
+
+        def genotypes():
+            with self.stage("genotypes"):
+                return ABDenovoCaller.calculate_genotypes(record)
 
-        self.variant_context.reset()
-        samples = {s.sample for s in record.samples}
-        genotypes = ABDenovoCaller.calculate_genotypes(record)
-        af = ABDenovoCaller.calculate_af(genotypes, samples)
-        self.variant_context["genotypes"] = genotypes
-        self.variant_context["af"] = af
+        def af():
+            with self.stage("genotypes"):
+                samples = {s.sample for s in record.samples}
+                return ABDenovoCaller.calculate_af(context["genotypes"],
+                                                   samples)
+
+        context.set_product("genotypes", genotypes)
+        context.set_product(("af", "all"), af)
 
         for proband in self.local_callers:
             if self.first_stage_reader:
                 if not self.first_stage_reader.has_sample(chromosome, pos, proband):
                     continue
             caller = self.local_callers[proband]
-            parent_call = caller.parent_caller.make_call(record)
+            with self.stage("parent"):
+                parent_call = caller.parent_caller.make_call(record)
             if not parent_call:
                 continue
 
             value = None
+            af = context[("af", "all")]
+            if self.pipeline is not None:
+                futures.append(self.pipeline.submit(
+                    proband, chromosome, pos, record.REF, record.ALT, af))
+                probands.append(proband)
+                continue
             if self.bayesian:
-                variant = VariantHandler(chromosome, pos, record.REF, record.ALT, af)
-                passed = caller.detector.detect(variant)
-                if (passed):
-                    if caller.detector.gives_pp():
-                        pp = variant.getProp("PP")
-                        if (pp > self.pp_threshold):
-                            value = self.format.format(sample=proband, pp=pp)
-                    else:
-                        value = self.format.format(sample=proband, passed="PASSED")
+                variant = VariantHandler(chromosome, pos, record.REF, record.ALT, af,
+                                         base_ref=self.assembly)
+                passed = caller.detector.detect(variant, self.stage)
+                value = self.get_value(proband, passed,
+                                       caller.detector.gives_pp(),
+                                       variant.getProp("PP"))
             else:
                 value = self.format.format(sample=proband, pp=1 - af)
             if (value != None):
                 result.append(value)
 
+        if futures:
+            return DeferredCall(futures, partial(self.assemble, probands))
+        if result:
+            return {self.get_my_tag(): ','.join(result)}
+        return dict()
+
+    def get_value(self, proband: str, passed: bool, gives_pp: bool, pp):
+        if not passed:
+            return None
+        if gives_pp:
+            if (pp > self.pp_threshold):
+                return self.format.format(sample=proband, pp=pp)
+            return None
+        return self.format.format(sample=proband, passed="PASSED")
+
+    def assemble(self, probands: List, results: List) -> Dict:
+        '''
+        Calls of a record from the results of workers for probands
+        '''
+        result = [self.get_value(proband, *r)
+                  for proband, r in zip(probands, results)]
+        result = [value for value in result if value is not None]
         if result:
             return {self.get_my_tag(): ','.join(result)}
         return dict()
@@ -178,6 +237,8 @@ class JointDenovoCaller(AbstractCaller):
         return "Probability of de novo by BGM Bayes caller"
 
     def close(self):
+        if self.pipeline is not None:
+            self.pipeline.close()
         for caller in self.local_callers.values():
             if caller.detector:
                 caller.detector.close()
@@ -0,0 +1,196 @@
+#  Copyright (c) 2019. Partners HealthCare, Harvard Medical School’s
+#  Department of Biomedical Informatics
+#
+#  Developed by Sergey Trifonov and Michael Bouzinier, based on contributions by:
+#  Anwoy Kumar Mohanty, Andrew Bjonnes,
+#  Ignat Leshchiner, Shamil Sunyaev and other members of Division of Genetics,
+#  Brigham and Women's Hospital
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import multiprocessing
+import multiprocessing.util
+import time
+from typing import Dict, List, Callable, Tuple
+
+from callers.harness import Harness, LIMIT
+from utils.tsv import SPILL_LIMIT
+from utils.vcf_wrappers import get_indexed_contigs
+
+SHARD_SIZE = 10000000
+
+
+def plan_shards(vcf_file: str, contigs: Dict,
+                shard_size: int = SHARD_SIZE) -> List[Tuple]:
+    '''
+    Splits an indexed VCF or BCF into regions (chromosome, start, end),
+    zero-based and half-open, in the order of the file. Contigs, which
+    length is not declared in the VCF header, make a single shard
+    '''
+    shards = []
+    chromosomes = get_indexed_contigs(vcf_file)
+    if chromosomes is None:
+        raise ValueError("{} is not indexed".format(vcf_file))
+    for chromosome in chromosomes:
+        contig = contigs.get(chromosome)
+        length = contig.length if contig else None
+        if not length:
+            shards.append((chromosome, None, None))
+            continue
+        for start in range(0, length, shard_size):
+            end = start + shard_size
+            if end >= length:
+                end = None
+            shards.append((chromosome, start, end))
+    return shards
+
+
+def plan_target_shards(regions: List[Tuple], n_shards: int) -> List[List]:
+    '''
+    Splits target intervals into groups of consecutive intervals
+    '''
+    size = max(1, -(-len(regions) // n_shards))
+    return [regions[i:i + size] for i in range(0, len(regions), size)]
+
+
+# Callers of a worker process, created once by init_worker() and
+# closed when the worker exits
+_callers = None
+
+
+def init_worker(callers_factory: Callable):
+    global _callers
+    _callers = callers_factory()
+    multiprocessing.util.Finalize(None, close_callers, exitpriority=10)
+
+
+def close_callers():
+    for caller in _callers:
+        if hasattr(caller, "close"):
+            caller.close()
+
+
+def in_regions(chromosome: str, pos: int, regions: List[Tuple]) -> bool:
+    return any(chromosome == region_chromosome
+               and (start is None or pos > start)
+               and (end is None or pos <= end)
+               for region_chromosome, start, end in regions)
+
+
+def run_shard(task: Tuple) -> Tuple:
+    '''
+    Runs callers over the regions of a shard: callers of the task, if it
+    has callers_factory, or callers of the worker (see init_worker()).
+    Calls are not returned to the parent process, but spilled: the result
+    is the names of the run files (see CallBuffer.detach()) and
+    the counters
+    '''
+    vcf_file, family, callers_factory, regions, call_set, debug_mode, \
+        use_prescreen, reader, spill_limit = task
+    if call_set is not None:
+        call_set = [call for call in call_set
+                    if in_regions(call.chromosome, call.pos, regions)]
+        if not call_set:
+            return ([], 0), (0, 0, 0, 0)
+    callers = callers_factory() if callers_factory else _callers
+    if call_set is not None:
+        harness = Harness(vcf_file, family, callers, call_set=call_set,
+                          reader=reader, spill_limit=spill_limit)
+    else:
+        harness = Harness(vcf_file, family, callers, regions=regions,
+                          reader=reader, spill_limit=spill_limit)
+    harness.debug_mode = debug_mode
+    harness.use_prescreen = use_prescreen
+    try:
+        harness.run()
+    except Exception:
+        harness.get_calls().clear()
+        raise
+    finally:
+        if callers_factory:
+            for caller in callers:
+                if hasattr(caller, "close"):
+                    caller.close()
+    counters = (harness.variant_counter, harness.call_counter,
+                harness.variant_called, harness.rejected)
+    return harness.get_calls().detach(), counters
+
+
+class ShardedHarness(Harness):
+    '''
+    Runs callers over regions of the input VCF in a pool of processes.
+    Every worker creates its own callers with callers_factory once and
+    its own reader for every shard; calls from the shards are collected
+    in the order of the file, so that the calls file is identical to
+    the one written by a sequential run.
+    '''
+    def __init__(self, vcf_file: str, family: Dict, callers: set,
+                 callers_factory: Callable, jobs: int,
+                 flush = None, call_set:List = None,
+                 reader: str = None, regions: List = None,
+                 spill_limit: int = SPILL_LIMIT) -> None:
+        super().__init__(vcf_file, family, callers, flush=flush,
+                         call_set=call_set, regions=regions, reader=reader,
+                         spill_limit=spill_limit)
+        self.spill_limit = spill_limit
+        self.callers_factory = callers_factory
+        self.jobs = jobs
+        self.call_set = call_set
+
+    def run(self):
+        t0 = time.time()
+        if self.regions:
+            shards = plan_target_shards(self.regions, self.jobs * 4)
+        else:
+            shards = [[shard] for shard in
+                      plan_shards(self.input_vcf, self.vcf_reader.contigs)]
+        print("Running {:d} shards in {:d} processes".
+              format(len(shards), self.jobs))
+        # Callers are created once by every worker
+        tasks = [(self.input_vcf, self.family, None, shard, self.call_set,
+                  self.debug_mode, self.use_prescreen, self.reader,
+                  self.spill_limit)
+                 for shard in shards]
+        with multiprocessing.Pool(self.jobs, initializer=init_worker,
+                                  initargs=(self.callers_factory,)) as pool:
+            for (runs, n_runs), counters in pool.imap(run_shard, tasks):
+                n, n_calls, n_called, n_rejected = counters
+                self.variant_counter += n
+                self.rejected += n_rejected
+                self.call_counter += n_calls
+                self.variant_called += n_called
+                # Calls of the shard are read from its runs, when flushed
+                self.calls.adopt(runs, n_runs)
+                if self.calls_file_open and len(self.calls) > LIMIT:
+                    self.flush_calls()
+                print("Processed {:d} variants in {:7.2f} sec, detected {:d} calls.".
+                      format(self.variant_counter, time.time() - t0,
+                             self.call_counter))
+                if self.metrics is not None:
+                    # Stages are measured in the workers and are not merged
+                    self.update_metrics()
+                    self.metrics.maybe_write()
+            # Workers exit on their own, closing their callers
+            pool.close()
+            pool.join()
+
+        if self.calls_file_open and len(self.calls) > 0:
+            self.flush_calls()
+            print("Totally: processed {:d} variants, flushed {:d} calls".
+                  format(self.variant_counter, self.call_counter))
+        self.close_calls()
+        if self.metrics is not None:
+            self.update_metrics()
+            self.metrics.write()
+
+        return (time.time() - t0)
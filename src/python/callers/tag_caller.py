@@ -20,8 +20,11 @@
 
 from typing import Dict, Set, Tuple, List
 
+import numpy as np
+
 from .ab_caller import ABCaller
 from vcf.model import _Record
+from utils.vcf_wrappers import find_info
 
 
 class TagCaller(ABCaller):
@@ -34,9 +37,32 @@ class TagCaller(ABCaller):
             return {self.tag: record.INFO[self.tag]}
         return {}
 
+    def has_block_calls(self) -> bool:
+        return False
+
+    def get_output_key(self) -> Tuple:
+        return type(self).__name__, self.tag
+
+    def get_required_samples(self) -> Set:
+        return set()
+
+    def get_required_info(self) -> Set:
+        return {self.tag}
+
+    def get_prescreen_samples(self) -> Set:
+        return set()
+
+    def prescreen(self, fields: List, calls: Dict) -> str:
+        if find_info(fields[7], self.tag) is None:
+            return "no_tag"
+        return None
+
     def check_genotypes(self, a: List, u: List) -> Tuple:
         raise Exception("Should be never called")
 
+    def check_block(self, a: np.ndarray, u: np.ndarray) -> Tuple:
+        raise Exception("Should be never called")
+
     def get_my_tag(self):
         return None
 
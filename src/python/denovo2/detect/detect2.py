@@ -18,6 +18,7 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 
+from contextlib import nullcontext
 
 from .dn_model import DeNovo_Model, DeNovo_MDL_Reader
 from .read_pysam import PysamList, AD_LibCollection
@@ -150,17 +151,22 @@ class DenovoDetector:
     def gives_pp(self):
         return self.mTrioSamFiles is not None
 
-    def detect(self,  variant):
+    def detect(self,  variant, stage = None):
+        # stage(name) returns context manager measuring time of a stage
+        if stage is None:
+            stage = lambda name: nullcontext()
         if self.mDumpFName:
             self.mUnrelLib.mineAD(variant)
-        if self.mUnrelLib is not None:
-            ad_model = DeNovo_Model.createByADLib(variant, self.mUnrelLib)
-        else:
-            ad_model = self.mUnrelMdl.getPosModel(variant)
+        with stage("model"):
+            if self.mUnrelLib is not None:
+                ad_model = DeNovo_Model.createByADLib(variant, self.mUnrelLib)
+            else:
+                ad_model = self.mUnrelMdl.getPosModel(variant)
         if self.mTrioSamFiles is None:
             variant.setProp("PASSED", not ad_model.isBad())
         else:
-            ad_model.evalVariant(variant, self.mTrioSamFiles)
+            with stage("trio"):
+                ad_model.evalVariant(variant, self.mTrioSamFiles)
         return variant.getProp("PASSED")
 
 #========================================
@@ -0,0 +1,146 @@
+#  Copyright (c) 2019. Partners HealthCare, Harvard Medical School’s
+#  Department of Biomedical Informatics
+#
+#  Developed by Sergey Trifonov and Michael Bouzinier, based on contributions by:
+#  Anwoy Kumar Mohanty, Andrew Bjonnes,
+#  Ignat Leshchiner, Shamil Sunyaev and other members of Division of Genetics,
+#  Brigham and Women's Hospital
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+import os
+import sys
+from typing import Dict, List
+
+import pysam
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Trio with a sibling and unrelated samples
+FAMILY = [
+    "FAM1 P1 F1 M1 1 2",
+    "FAM1 M1 0 0 2 1",
+    "FAM1 F1 0 0 1 1",
+    "FAM1 S1 F1 M1 1 1",
+]
+SAMPLES = ["P1", "M1", "F1", "S1"] + ["U{:02d}".format(i) for i in range(12)]
+# Trio appended to the samples of the cohort
+FAMILY2 = [
+    "FAM2 P2 F2 M2 2 2",
+    "FAM2 M2 0 0 2 1",
+    "FAM2 F2 0 0 1 1",
+]
+COHORT_SAMPLES = SAMPLES + ["P2", "M2", "F2"]
+HEADER = [
+    "##fileformat=VCFv4.2",
+    '##INFO=<ID=DP,Number=1,Type=Integer,Description="Depth">',
+    '##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">',
+    '##FORMAT=<ID=AD,Number=R,Type=Integer,Description="Allele depths">',
+    "##contig=<ID=1,length=1000000>",
+    "##contig=<ID=2,length=1000000>",
+]
+CALLS = {0: "0/0:20,0", 1: "0/1:10,10", 2: "1/1:0,20"}
+
+
+def make_records(n: int = 200, samples: List[str] = SAMPLES) -> List[Dict]:
+    '''
+    Records with a pattern of genotypes: de novo, compound heterozygous,
+    homozygous recessive and common variants. The second family has
+    a variant from the father, where the first has a de novo, and
+    a de novo, where the first has none
+    '''
+    records = []
+    for i in range(n):
+        chromosome = "1" if i < n // 2 else "2"
+        pattern = i % 5
+        gts = {s: 0 for s in samples}
+        if pattern == 0:
+            gts["P1"] = 1
+        elif pattern == 1:
+            gts.update(P1=1, M1=1)
+        elif pattern == 2:
+            gts.update(P1=2, M1=1, F1=1, S1=1)
+        elif pattern == 3:
+            gts.update({s: 1 for s in samples})
+        if "P2" in gts and pattern == 0:
+            gts.update(P2=1, F2=1)
+        elif "P2" in gts and pattern == 4:
+            gts["P2"] = 1
+        records.append({"chrom": chromosome, "pos": 100 + 10 * i,
+                        "ref": "A", "alt": "G", "gts": gts})
+    return records
+
+
+def format_record(record: Dict, samples: List[str] = SAMPLES) -> str:
+    return '\t'.join([record["chrom"], str(record["pos"]), ".", record["ref"],
+                      record["alt"], "50", "PASS", "DP=100", "GT:AD"] +
+                     [CALLS[record["gts"][s]] for s in samples])
+
+
+def write_vcf(path: str, records: List[Dict],
+              samples: List[str] = SAMPLES) -> str:
+    with open(path, "w") as f:
+        for line in HEADER:
+            f.write(line + '\n')
+        f.write('\t'.join(["#CHROM", "POS", "ID", "REF", "ALT", "QUAL",
+                           "FILTER", "INFO", "FORMAT"] + samples) + '\n')
+        for record in records:
+            f.write(format_record(record, samples) + '\n')
+    return path
+
+
+@pytest.fixture
+def vcf_file(tmp_path) -> str:
+    return write_vcf(str(tmp_path / "input.vcf"), make_records())
+
+
+@pytest.fixture
+def indexed_vcf_file(tmp_path) -> str:
+    '''
+    Bgzipped and tabix-indexed VCF spanning many BGZF blocks
+    '''
+    path = write_vcf(str(tmp_path / "indexed.vcf"), make_records(4000))
+    return pysam.tabix_index(path, preset="vcf")
+
+
+@pytest.fixture
+def fam_file(tmp_path) -> str:
+    path = str(tmp_path / "FAM1.fam")
+    with open(path, "w") as f:
+        f.write('\n'.join(FAMILY) + '\n')
+    return path
+
+
+@pytest.fixture
+def cohort_vcf_file(tmp_path) -> str:
+    '''
+    Indexed VCF of both families with more unrelated samples, so that
+    AF of homozygous recessive variants is below the threshold
+    '''
+    samples = COHORT_SAMPLES + ["V{:02d}".format(i) for i in range(16)]
+    path = write_vcf(str(tmp_path / "cohort.vcf"),
+                     make_records(2000, samples), samples)
+    return pysam.tabix_index(path, preset="vcf")
+
+
+@pytest.fixture
+def fam_dir(tmp_path) -> str:
+    '''
+    Directory of families with their fam files
+    '''
+    path = tmp_path / "families"
+    for name, family in (("FAM1", FAMILY), ("FAM2", FAMILY2)):
+        (path / name).mkdir(parents=True)
+        with open(str(path / name / (name + ".fam")), "w") as f:
+            f.write('\n'.join(family) + '\n')
+    return str(path)
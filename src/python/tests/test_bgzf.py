@@ -0,0 +1,66 @@
+#  Copyright (c) 2019. Partners HealthCare, Harvard Medical School’s
+#  Department of Biomedical Informatics
+#
+#  Developed by Sergey Trifonov and Michael Bouzinier, based on contributions by:
+#  Anwoy Kumar Mohanty, Andrew Bjonnes,
+#  Ignat Leshchiner, Shamil Sunyaev and other members of Division of Genetics,
+#  Brigham and Women's Hospital
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+import gzip
+
+import pysam
+
+from utils.bgzf import BGZFWriter, BGZFLines, BGZFReader, MAX_BLOCK_DATA, \
+    decompress_block, get_data_size, is_bgzf
+
+
+def make_lines(n: int):
+    return ["1\t{:d}\t.\tA\tG\t50\tPASS\tDP={:d}\tÄ".format(100 + i, i)
+            for i in range(n)]
+
+
+def test_bgzf_round_trip(tmp_path):
+    path = str(tmp_path / "lines.txt.gz")
+    lines = make_lines(20000)
+    with BGZFWriter(path, threads=2) as output:
+        for line in lines:
+            output.write(line + '\n')
+    assert is_bgzf(path)
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        assert f.read().splitlines() == lines
+    assert list(BGZFLines(path, threads=2)) == lines
+
+    with BGZFReader(path) as reader:
+        blocks = [block for _, block in reader.blocks()]
+    assert len(blocks) > 2
+    assert all(get_data_size(block) <= MAX_BLOCK_DATA for block in blocks)
+    # The last block is the empty EOF marker
+    assert get_data_size(blocks[-1]) == 0
+    assert b"".join(decompress_block(block) for block in blocks) == \
+           ''.join(line + '\n' for line in lines).encode("utf-8")
+
+
+def test_bgzf_is_indexed_by_htslib(tmp_path):
+    path = str(tmp_path / "records.vcf.gz")
+    with BGZFWriter(path, threads=1) as output:
+        output.write("##fileformat=VCFv4.2\n")
+        output.write("##contig=<ID=1,length=1000000>\n")
+        output.write('\t'.join(["#CHROM", "POS", "ID", "REF", "ALT", "QUAL",
+                                "FILTER", "INFO"]) + '\n')
+        for line in make_lines(5000):
+            output.write(line[:line.rindex('\t')] + '\n')
+    pysam.tabix_index(path, preset="vcf")
+    with pysam.TabixFile(path) as tabix:
+        rows = list(tabix.fetch("1", 2099, 2110))
+    assert [int(row.split('\t')[1]) for row in rows] == list(range(2100, 2111))
@@ -0,0 +1,47 @@
+#  Copyright (c) 2019. Partners HealthCare, Harvard Medical School’s
+#  Department of Biomedical Informatics
+#
+#  Developed by Sergey Trifonov and Michael Bouzinier, based on contributions by:
+#  Anwoy Kumar Mohanty, Andrew Bjonnes,
+#  Ignat Leshchiner, Shamil Sunyaev and other members of Division of Genetics,
+#  Brigham and Women's Hospital
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+import os
+
+from utils.tsv import CallBuffer
+
+
+def fill(buffer: CallBuffer, positions):
+    for pos in positions:
+        buffer[("1", pos)] = {"TAG": str(pos)}
+
+
+def test_detached_runs_are_adopted_in_order(tmp_path):
+    shard = CallBuffer(limit=3, directory=str(tmp_path))
+    fill(shard, range(10, 20))
+    paths, n = shard.detach()
+    assert n == 10 and len(shard) == 0
+    assert all(os.path.exists(path) for path in paths)
+
+    calls = CallBuffer(limit=3, directory=str(tmp_path))
+    fill(calls, range(1, 5))
+    calls.adopt(paths, n)
+    fill(calls, range(20, 22))
+    assert len(calls) == 16
+    assert [key[1] for key, _ in calls.items()] == \
+           list(range(1, 5)) + list(range(10, 22))
+
+    calls.clear()
+    assert not any(os.path.exists(path) for path in paths)
+    assert os.listdir(str(tmp_path)) == []
@@ -0,0 +1,111 @@
+#  Copyright (c) 2019. Partners HealthCare, Harvard Medical School’s
+#  Department of Biomedical Informatics
+#
+#  Developed by Sergey Trifonov and Michael Bouzinier, based on contributions by:
+#  Anwoy Kumar Mohanty, Andrew Bjonnes,
+#  Ignat Leshchiner, Shamil Sunyaev and other members of Division of Genetics,
+#  Brigham and Women's Hospital
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+import argparse
+import collections
+import contextlib
+import io
+
+import callers.bayes_denovo_caller as bayes
+from callers.ab_denovo_caller import ABDenovoCaller
+from callers.harness import Harness
+from conftest import SAMPLES, make_records, write_vcf
+from utils.case_utils import parse_fam_file
+from variant_caller import create_callers
+
+
+class FakeDetector:
+    def __init__(self, path_to_library, trio_list=None):
+        self.trio = trio_list
+
+    def detect(self, variant, stage=None):
+        variant.setProp("PP", 0.9)
+        return True
+
+    def close(self):
+        pass
+
+
+def run_callers(callers, vcf_file, fam_file):
+    harness = Harness(vcf_file, parse_fam_file(fam_file), callers,
+                      flush=None)
+    with contextlib.redirect_stdout(io.StringIO()):
+        harness.run()
+    return harness
+
+
+def test_equal_parents_are_shared_node(monkeypatch, vcf_file, fam_file):
+    monkeypatch.setattr(bayes, "DenovoDetector", FakeDetector)
+    made = collections.Counter()
+    make_call = ABDenovoCaller.make_call
+
+    def counted(self, record):
+        made[(record.CHROM, record.POS)] += 1
+        return make_call(self, record)
+
+    monkeypatch.setattr(ABDenovoCaller, "make_call", counted)
+    callers = [bayes.BayesDenovoCaller(ABDenovoCaller(), "{}.bam", "lib",
+                                       pp_threshold=threshold)
+               for threshold in (0.5, 0.7)]
+    harness = run_callers(callers, vcf_file, fam_file)
+
+    graph = harness.graph
+    assert len(graph.shared) == 1
+    key, node = graph.shared[0]
+    assert isinstance(node, ABDenovoCaller)
+    assert all(caller.parent is node for caller in callers)
+    # Calls of the allele balance caller are made once per record
+    assert made and max(made.values()) == 1
+
+
+def test_parent_af_source_is_not_merged(monkeypatch, vcf_file, fam_file):
+    monkeypatch.setattr(bayes, "DenovoDetector", FakeDetector)
+    caller = bayes.BayesDenovoCaller(ABDenovoCaller(), "{}.bam", "lib")
+    ab_caller = ABDenovoCaller()
+    harness = run_callers([caller, ab_caller], vcf_file, fam_file)
+    # AF of the parent is over unrelated samples, of the shared caller
+    # over all samples
+    assert caller.parent.get_af_source() == "unrelated"
+    assert ab_caller.get_af_source() == "all"
+    assert harness.graph.shared == []
+
+
+def test_dnlib_calls_match_lone_caller(monkeypatch, tmp_path, fam_file):
+    monkeypatch.setattr(bayes, "DenovoDetector", FakeDetector)
+    # De novo with AF 0.083 over unrelated samples and 0.125 over all
+    gts = {s: 0 for s in SAMPLES}
+    gts.update(P1=2, U00=1, U01=1)
+    records = make_records() + [{"chrom": "2", "pos": 5000, "ref": "A",
+                                 "alt": "G", "gts": gts}]
+    vcf_file = write_vcf(str(tmp_path / "input.vcf"), records)
+
+    args = argparse.Namespace(cohort=False, dnlib="lib", results="{}.bam",
+                              callers=None, assembly="hg19")
+    harness = run_callers(create_callers(args), vcf_file, fam_file)
+    calls = dict(harness.get_calls().items())
+
+    lone = bayes.BayesDenovoCaller(ABDenovoCaller(), "{}.bam", "lib",
+                                   assembly="hg19")
+    expected = dict(run_callers({lone}, vcf_file, fam_file)
+                    .get_calls().items())
+    tags = ("BGM_DE_NOVO", "BGM_BAYES_DE_NOVO")
+    assert expected[("2", 5000)]["BGM_BAYES_DE_NOVO"] == "0.9"
+    for pos in set(calls) | set(expected):
+        assert ({tag: value for tag, value in calls.get(pos, {}).items()
+                 if tag in tags} == expected.get(pos, {})), pos
@@ -0,0 +1,59 @@
+#  Copyright (c) 2019. Partners HealthCare, Harvard Medical School’s
+#  Department of Biomedical Informatics
+#
+#  Developed by Sergey Trifonov and Michael Bouzinier, based on contributions by:
+#  Anwoy Kumar Mohanty, Andrew Bjonnes,
+#  Ignat Leshchiner, Shamil Sunyaev and other members of Division of Genetics,
+#  Brigham and Women's Hospital
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+import contextlib
+import io
+
+from callers.ab_compound_het_caller import ABCompoundHeterozygousCaller
+from callers.ab_denovo_caller import ABDenovoCaller
+from callers.ab_homo_rec_caller import ABHomozygousRecessiveCaller
+from callers.cohort_caller import PATTERNS, CohortCaller
+from callers.harness import Harness
+from variant_caller import read_families
+
+
+def run(vcf_file, family, callers):
+    harness = Harness(vcf_file, family, callers)
+    with contextlib.redirect_stdout(io.StringIO()):
+        harness.run()
+    return dict(harness.get_calls().items())
+
+
+def test_cohort_calls_match_family_callers(cohort_vcf_file, fam_dir):
+    families = read_families(fam_dir)
+    with contextlib.redirect_stdout(io.StringIO()):
+        caller = CohortCaller(families, cohort_vcf_file)
+    cohort = run(cohort_vcf_file, None, {caller})
+
+    # Callers of every family run together, AF is over all samples
+    expected = dict()
+    for name, family in families.items():
+        calls = run(cohort_vcf_file, family,
+                    {ABDenovoCaller(), ABCompoundHeterozygousCaller(),
+                     ABHomozygousRecessiveCaller()})
+        assert calls
+        for key, values in calls.items():
+            for tag, value in values.items():
+                expected.setdefault(key, dict())[tag + "_" + name] = value
+
+    assert cohort == expected
+    tags = {tag for values in cohort.values() for tag in values}
+    assert tags == {"BGM_{}_{}".format(pattern, name)
+                    for pattern in PATTERNS for name in families} - \
+        {"BGM_HOM_REC_FAM2"}
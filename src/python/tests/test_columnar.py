@@ -0,0 +1,91 @@
+#  Copyright (c) 2019. Partners HealthCare, Harvard Medical School’s
+#  Department of Biomedical Informatics
+#
+#  Developed by Sergey Trifonov and Michael Bouzinier, based on contributions by:
+#  Anwoy Kumar Mohanty, Andrew Bjonnes,
+#  Ignat Leshchiner, Shamil Sunyaev and other members of Division of Genetics,
+#  Brigham and Women's Hospital
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+import contextlib
+import io
+
+import numpy as np
+import pytest
+
+from utils.columnar import ColumnarReader, convert_calls
+from utils.tsv import format_calls, iterate_calls
+
+TAGS = ["BGM_FLAG", "BGM_COUNT", "BGM_PP", "BGM_SAMPLES"]
+TYPES = {"BGM_FLAG": "Flag", "BGM_COUNT": "Integer", "BGM_PP": "Float",
+         "BGM_SAMPLES": "String"}
+
+
+def write_calls(path: str, n: int = 20):
+    with open(path, "w") as f:
+        f.write("#CHROM\tPOS\t{}\n".format('\t'.join(TAGS)))
+        for i in range(n):
+            values = {
+                "BGM_FLAG": "1" if i % 2 == 0 else None,
+                "BGM_COUNT": str(i * 1000) if i % 3 else None,
+                "BGM_PP": "0.{:d}5".format(i % 10) if i % 4 else None,
+                "BGM_SAMPLES": "P{:d}:0.9,S{:d}:0.5".format(i, i)
+                if i % 5 else None
+            }
+            values = {tag: v for tag, v in values.items() if v is not None}
+            f.write(format_calls(("1" if i < n // 2 else "X", 100 + i),
+                                 values, TAGS))
+
+
+def convert(calls_file: str, output_file: str) -> str:
+    with contextlib.redirect_stdout(io.StringIO()):
+        return convert_calls(calls_file, output_file, TYPES,
+                             row_group_size=7)
+
+
+def round_trip(tmp_path, extension: str):
+    calls_file = str(tmp_path / "calls.tsv")
+    write_calls(calls_file)
+    output = convert(calls_file, str(tmp_path / ("calls" + extension)))
+    reader = ColumnarReader(output)
+    assert reader.tags == TAGS
+    assert all(reader.types[tag] == TYPES[tag] for tag in TAGS)
+    copy = str(tmp_path / "copy.tsv")
+    with open(copy, "w") as f:
+        f.write("#CHROM\tPOS\t{}\n".format('\t'.join(TAGS)))
+        for chromosome, pos, values in reader.iterate_calls():
+            f.write(format_calls((chromosome, pos), values, TAGS))
+    assert list(reader.iterate_calls()) == list(iterate_calls(calls_file))
+    with open(calls_file) as expected, open(copy) as actual:
+        assert actual.read() == expected.read()
+
+
+def test_npz_round_trip(tmp_path):
+    round_trip(tmp_path, ".npz")
+
+
+def test_npz_row_groups_are_mapped(tmp_path):
+    calls_file = str(tmp_path / "calls.tsv")
+    write_calls(calls_file)
+    reader = ColumnarReader(convert(calls_file, str(tmp_path / "calls.npz")))
+    groups = list(reader.row_groups())
+    assert [len(group["POS"]) for group in groups] == [7, 7, 6]
+    assert isinstance(groups[0]["POS"], np.memmap)
+    assert groups[0]["BGM_COUNT"].dtype.kind == 'i'
+    assert not groups[0]["BGM_COUNT.valid"][0]
+
+
+@pytest.mark.parametrize("extension", [".arrow", ".parquet"])
+def test_arrow_round_trip(tmp_path, extension):
+    pytest.importorskip("pyarrow")
+    round_trip(tmp_path, extension)
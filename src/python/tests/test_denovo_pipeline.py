@@ -0,0 +1,59 @@
+#  Copyright (c) 2019. Partners HealthCare, Harvard Medical School’s
+#  Department of Biomedical Informatics
+#
+#  Developed by Sergey Trifonov and Michael Bouzinier, based on contributions by:
+#  Anwoy Kumar Mohanty, Andrew Bjonnes,
+#  Ignat Leshchiner, Shamil Sunyaev and other members of Division of Genetics,
+#  Brigham and Women's Hospital
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+from collections import OrderedDict
+
+import callers.denovo_pipeline as pipeline
+from callers.denovo_pipeline import DenovoPipeline
+
+
+class FakeDetector:
+    def __init__(self, path_to_library, trio_list=None):
+        self.trio = trio_list
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def test_trios_are_routed_to_one_worker():
+    denovo_pipeline = DenovoPipeline(2, "lib", dict())
+    try:
+        executors = [denovo_pipeline.get_executor(proband)
+                     for proband in ["P1", "P2", "P3", "P1", "P2"]]
+        assert len(denovo_pipeline.executors) == 2
+        assert executors[0] is executors[3] and executors[1] is executors[4]
+        assert executors[0] is not executors[1]
+        assert executors[2] is executors[0]
+    finally:
+        denovo_pipeline.close()
+
+
+def test_least_recently_used_detector_is_closed(monkeypatch):
+    monkeypatch.setattr(pipeline, "DenovoDetector", FakeDetector)
+    monkeypatch.setattr(pipeline, "MAX_DETECTORS", 2)
+    monkeypatch.setattr(pipeline, "_detectors", OrderedDict())
+    bams = {p: [p + ".bam"] for p in ["P1", "P2", "P3"]}
+    monkeypatch.setattr(pipeline, "_config", ("lib", bams))
+    p1 = pipeline.get_detector("P1")
+    p2 = pipeline.get_detector("P2")
+    assert pipeline.get_detector("P1") is p1
+    pipeline.get_detector("P3")
+    assert p2.closed and not p1.closed
+    assert list(pipeline._detectors) == ["P1", "P3"]
@@ -0,0 +1,33 @@
+#  Copyright (c) 2019. Partners HealthCare, Harvard Medical School’s
+#  Department of Biomedical Informatics
+#
+#  Developed by Sergey Trifonov and Michael Bouzinier, based on contributions by:
+#  Anwoy Kumar Mohanty, Andrew Bjonnes,
+#  Ignat Leshchiner, Shamil Sunyaev and other members of Division of Genetics,
+#  Brigham and Women's Hospital
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+from utils.metrics import Metrics, PREFIX
+
+
+def test_latency_summary_has_sum_and_count(tmp_path):
+    metrics = Metrics(str(tmp_path / "metrics.prom"))
+    metrics.observe("BGM_DE_NOVO", 0.5, 10)
+    metrics.observe("BGM_DE_NOVO", 0.25)
+    text = metrics.format_prometheus(metrics.snapshot())
+    name = PREFIX + "_caller_latency_seconds"
+    lines = [line for line in text.splitlines() if line.startswith(name)]
+    assert '{}_sum{{caller="BGM_DE_NOVO"}} 5.25'.format(name) in lines
+    assert '{}_count{{caller="BGM_DE_NOVO"}} 11'.format(name) in lines
+    assert any('quantile="0.5"' in line for line in lines)
+    assert "# TYPE {} summary".format(name) in text
@@ -0,0 +1,92 @@
+#  Copyright (c) 2019. Partners HealthCare, Harvard Medical School’s
+#  Department of Biomedical Informatics
+#
+#  Developed by Sergey Trifonov and Michael Bouzinier, based on contributions by:
+#  Anwoy Kumar Mohanty, Andrew Bjonnes,
+#  Ignat Leshchiner, Shamil Sunyaev and other members of Division of Genetics,
+#  Brigham and Women's Hospital
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+import argparse
+import contextlib
+import io
+from functools import partial
+
+import pysam
+import pytest
+
+import callers.parallel as parallel
+from callers.harness import Harness
+from conftest import make_records, write_vcf
+from utils.case_utils import parse_fam_file
+from variant_caller import create_callers
+
+
+ARGS = argparse.Namespace(cohort=False, callers=None, dnlib=None,
+                          results=None, assembly="hg19")
+
+
+def run(harness):
+    with contextlib.redirect_stdout(io.StringIO()):
+        harness.run()
+    with open(harness.calls_file) as f:
+        return f.read()
+
+
+def run_both(vcf_file, fam_file, tmp_path, monkeypatch):
+    # Shards of a few hundred records, positions are below 41000
+    shards = [(chromosome, start, start + 5000 if start < 40000 else None)
+              for chromosome in ("1", "2") for start in range(0, 45000, 5000)]
+    monkeypatch.setattr(parallel, "plan_shards",
+                        lambda vcf_file, contigs: shards)
+    family = parse_fam_file(fam_file)
+    serial = Harness(vcf_file, family, create_callers(ARGS),
+                     flush=str(tmp_path / "serial.tsv"))
+    sharded = parallel.ShardedHarness(
+        vcf_file, family, create_callers(ARGS),
+        callers_factory=partial(create_callers, ARGS), jobs=2,
+        flush=str(tmp_path / "sharded.tsv"))
+    return run(serial), run(sharded)
+
+
+def test_sharded_calls_match_serial(indexed_vcf_file, fam_file, tmp_path,
+                                    monkeypatch):
+    serial, sharded = run_both(indexed_vcf_file, fam_file, tmp_path,
+                               monkeypatch)
+    assert serial.count('\n') > parallel.LIMIT
+    assert sharded == serial
+
+
+def test_sharded_calls_at_same_position(fam_file, tmp_path, monkeypatch):
+    # Every call is followed by a record at the same position, so that
+    # some of them are at the border of flushed calls
+    records = []
+    for record in make_records(4000):
+        records.append(record)
+        if record["pos"] % 50 in (0, 10, 20):
+            records.append(dict(record, alt="T"))
+    path = write_vcf(str(tmp_path / "input.vcf"), records)
+    vcf_file = pysam.tabix_index(path, preset="vcf")
+    serial, sharded = run_both(vcf_file, fam_file, tmp_path, monkeypatch)
+    positions = [tuple(line.split('\t')[:2])
+                 for line in serial.splitlines()[1:]]
+    assert len(positions) == len(set(positions))
+    assert sharded == serial
+
+
+@pytest.mark.parametrize("chromosome, pos, expected", [
+    ("1", 150, True), ("1", 250, False), ("1", 350, True),
+    ("2", 50, True), ("3", 10, False)])
+def test_call_set_in_all_regions(chromosome, pos, expected):
+    regions = [("1", 100, 200), ("1", 300, 400), ("2", None, None)]
+    assert parallel.in_regions(chromosome, pos, regions) == expected
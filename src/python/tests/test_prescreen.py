@@ -0,0 +1,91 @@
+#  Copyright (c) 2019. Partners HealthCare, Harvard Medical School’s
+#  Department of Biomedical Informatics
+#
+#  Developed by Sergey Trifonov and Michael Bouzinier, based on contributions by:
+#  Anwoy Kumar Mohanty, Andrew Bjonnes,
+#  Ignat Leshchiner, Shamil Sunyaev and other members of Division of Genetics,
+#  Brigham and Women's Hospital
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+import argparse
+import contextlib
+import io
+from typing import Dict
+
+import pytest
+
+from callers.harness import Harness
+from conftest import CALLS, HEADER, SAMPLES, make_records
+from utils.case_utils import parse_fam_file
+from variant_caller import create_callers
+
+# Calls of multiallelic records by genotype type of the first allele
+MULTIALLELIC = {0: "0/0:20,0,0", 1: "0/2:10,0,10", 2: "2/2:0,1,20"}
+
+
+def format_mixed(i: int, record: Dict) -> str:
+    '''
+    Record in one of the formats: GT:AD, GT:DP:AD, multiallelic or with
+    no-calls in the family
+    '''
+    gts = record["gts"]
+    fields = [record["chrom"], str(record["pos"]), ".", "A"]
+    kind = i % 4
+    if kind == 1:
+        calls = ["{}:20:{}".format(*CALLS[gts[s]].split(':'))
+                 for s in SAMPLES]
+        return '\t'.join(fields + ["G", "50", "PASS", "DP=100",
+                                   "GT:DP:AD"] + calls)
+    if kind == 2:
+        calls = [MULTIALLELIC[gts[s]] for s in SAMPLES]
+        return '\t'.join(fields + ["G,T", "50", "PASS", "DP=100",
+                                   "GT:AD"] + calls)
+    calls = [CALLS[gts[s]] for s in SAMPLES]
+    if kind == 3:
+        # The father and one of unrelated samples are not called
+        calls[SAMPLES.index("F1")] = "./.:."
+        calls[SAMPLES.index("U03")] = "."
+    return '\t'.join(fields + ["G", "50", "PASS", "DP=100", "GT:AD"] + calls)
+
+
+@pytest.fixture
+def mixed_vcf_file(tmp_path):
+    path = str(tmp_path / "mixed.vcf")
+    with open(path, "w") as f:
+        for line in HEADER:
+            f.write(line + '\n')
+        f.write('##FORMAT=<ID=DP,Number=1,Type=Integer,'
+                'Description="Depth">\n')
+        f.write('\t'.join(["#CHROM", "POS", "ID", "REF", "ALT", "QUAL",
+                           "FILTER", "INFO", "FORMAT"] + SAMPLES) + '\n')
+        for i, record in enumerate(make_records(400)):
+            f.write(format_mixed(i, record) + '\n')
+    return path
+
+
+@pytest.mark.parametrize("callers", [None, ["de-novo"], ["compound_het"]])
+def test_prescreen_keeps_calls(mixed_vcf_file, fam_file, callers):
+    args = argparse.Namespace(cohort=False, callers=callers, dnlib=None,
+                              results=None, assembly="hg19")
+    calls = dict()
+    rejected = dict()
+    for use_prescreen in (True, False):
+        harness = Harness(mixed_vcf_file, parse_fam_file(fam_file),
+                          create_callers(args), reader="pyvcf")
+        harness.use_prescreen = use_prescreen
+        with contextlib.redirect_stdout(io.StringIO()):
+            harness.run()
+        calls[use_prescreen] = dict(harness.get_calls().items())
+        rejected[use_prescreen] = harness.rejected
+    assert rejected[True] > 0 and rejected[False] == 0
+    assert calls[True] and calls[True] == calls[False]
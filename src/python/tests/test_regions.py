@@ -0,0 +1,84 @@
+#  Copyright (c) 2019. Partners HealthCare, Harvard Medical School’s
+#  Department of Biomedical Informatics
+#
+#  Developed by Sergey Trifonov and Michael Bouzinier, based on contributions by:
+#  Anwoy Kumar Mohanty, Andrew Bjonnes,
+#  Ignat Leshchiner, Shamil Sunyaev and other members of Division of Genetics,
+#  Brigham and Women's Hospital
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+import argparse
+import contextlib
+import io
+
+import pytest
+
+from callers.harness import Harness
+from utils.case_utils import parse_fam_file
+from utils.regions import merge_intervals, read_bed
+from utils.vcf_wrappers import VCF_READERS, get_indexed_contigs
+from variant_caller import create_callers
+
+BED = [
+    "track name=targets",
+    "chr1\t2000\t5000",
+    "1\t4500\t6000",
+    "2\t30000\t30150",
+    "1\t500\t800",
+    "3\t0\t1000",
+]
+
+
+def test_merge_intervals():
+    intervals = [("chr1", 2000, 5000), ("1", 4500, 6000), ("2", 30, 40),
+                 ("1", 6000, 6100), ("1", 500, 800), ("3", 0, 1000)]
+    with contextlib.redirect_stdout(io.StringIO()):
+        merged = merge_intervals(intervals, ["1", "2"])
+    assert merged == [("1", 500, 800), ("1", 2000, 6100), ("2", 30, 40)]
+
+
+def run(vcf_file, fam_file, reader, regions=None):
+    args = argparse.Namespace(cohort=False, callers=None, dnlib=None,
+                              results=None, assembly="hg19")
+    harness = Harness(vcf_file, parse_fam_file(fam_file),
+                      create_callers(args), reader=reader, regions=regions)
+    with contextlib.redirect_stdout(io.StringIO()):
+        harness.run()
+    return harness
+
+
+@pytest.mark.parametrize("reader", VCF_READERS)
+def test_regions_match_full_run(tmp_path, indexed_vcf_file, fam_file,
+                                reader):
+    bed_file = str(tmp_path / "targets.bed")
+    with open(bed_file, "w") as f:
+        f.write('\n'.join(BED) + '\n')
+    with contextlib.redirect_stdout(io.StringIO()):
+        regions = merge_intervals(read_bed(bed_file),
+                                  get_indexed_contigs(indexed_vcf_file))
+    harness = run(indexed_vcf_file, fam_file, reader, regions)
+    full = run(indexed_vcf_file, fam_file, reader)
+
+    def in_regions(chromosome, pos):
+        return any(chromosome == c and start < pos <= end
+                   for c, start, end in regions)
+
+    expected = [(key, values) for key, values in full.get_calls().items()
+                if in_regions(*key)]
+    assert expected
+    assert list(harness.get_calls().items()) == expected
+    # Records at 100, 110, ... on chromosome 1, then on chromosome 2
+    positions = [100 + 10 * i for i in range(4000)]
+    n = sum(1 for i, pos in enumerate(positions)
+            if in_regions("1" if i < 2000 else "2", pos))
+    assert harness.variant_counter == n
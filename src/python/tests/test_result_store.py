@@ -0,0 +1,160 @@
+#  Copyright (c) 2019. Partners HealthCare, Harvard Medical School’s
+#  Department of Biomedical Informatics
+#
+#  Developed by Sergey Trifonov and Michael Bouzinier, based on contributions by:
+#  Anwoy Kumar Mohanty, Andrew Bjonnes,
+#  Ignat Leshchiner, Shamil Sunyaev and other members of Division of Genetics,
+#  Brigham and Women's Hospital
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+import argparse
+import contextlib
+import io
+from functools import partial
+
+import pysam
+
+from callers.harness import Harness
+from callers.incremental import StoredHarness, get_fingerprints
+from conftest import COHORT_SAMPLES, SAMPLES, make_records, write_vcf
+from utils.case_utils import parse_fam_file
+from utils.result_store import ResultStore, make_key
+from variant_caller import create_callers, create_stored_callers, \
+    get_store_config, read_families
+
+
+def test_entry_round_trip(tmp_path):
+    store = ResultStore(str(tmp_path / "store"))
+    key = make_key("1:0-1000", "family", "config", "fingerprint")
+    calls = [(("1", 100), {"BGM_DE_NOVO": "1"}),
+             (("1", 200), {"BGM_CMPD_HET": "P1", "BGM_DE_NOVO": "1"})]
+    store.put("FAM1", key, [("1", 0, 1000)], ["BGM_CMPD_HET", "BGM_DE_NOVO"],
+              calls, 10)
+    entry = store.get("FAM1", key)
+    assert entry["records"] == 10 and entry["calls"] == 3
+    assert [((c, p), values) for c, p, values in
+            store.read_calls("FAM1", key)] == calls
+    assert store.get("FAM1", dict(key, fingerprint="changed")) is None
+
+    assert store.invalidate([("2", None, None)]) == 0
+    assert store.invalidate([("1", 500, 600)]) == 1
+    assert store.get("FAM1", key) is None
+
+
+def run_stored(args, vcf_file, store_dir, output):
+    store = ResultStore(store_dir)
+    callers = create_callers(args)
+    if args.cohort:
+        family = None
+        families = next(iter(callers)).families
+    else:
+        family = parse_fam_file(args.family)
+        families = read_families(args.family)
+    harness = StoredHarness(vcf_file, family, callers,
+                            callers_factory=partial(create_stored_callers,
+                                                    args),
+                            store=store, families=families,
+                            config=get_store_config(args), flush=output)
+    log = io.StringIO()
+    with contextlib.redirect_stdout(log):
+        harness.write_header()
+        harness.run()
+        harness.write_calls()
+    return log.getvalue()
+
+
+def read(path):
+    with open(path) as f:
+        return f.read()
+
+
+def test_store_reuse_and_invalidate(monkeypatch, tmp_path, indexed_vcf_file,
+                                   fam_file):
+    # Header of the calls is written to the current directory
+    monkeypatch.chdir(tmp_path)
+    args = argparse.Namespace(cohort=False, family=fam_file, callers=None,
+                              dnlib=None, results=None, assembly="hg19")
+    expected = str(tmp_path / "expected.tsv")
+    harness = Harness(indexed_vcf_file, parse_fam_file(fam_file),
+                      create_callers(args), flush=expected)
+    with contextlib.redirect_stdout(io.StringIO()):
+        harness.write_header()
+        harness.run()
+        harness.write_calls()
+
+    store_dir = str(tmp_path / "store")
+    output = str(tmp_path / "calls.tsv")
+    log = run_stored(args, indexed_vcf_file, store_dir, output)
+    assert "Computing 2 of 2 shards" in log
+    assert read(output) == read(expected)
+
+    output = str(tmp_path / "reused.tsv")
+    log = run_stored(args, indexed_vcf_file, store_dir, output)
+    assert "Computing 0 of 2 shards" in log
+    assert read(output) == read(expected)
+
+    assert ResultStore(store_dir).invalidate([("2", None, None)]) == 1
+    output = str(tmp_path / "invalidated.tsv")
+    log = run_stored(args, indexed_vcf_file, store_dir, output)
+    assert "Computing 1 of 2 shards" in log
+    assert read(output) == read(expected)
+
+
+def test_fingerprints_of_families(tmp_path):
+    records = make_records(200, COHORT_SAMPLES)
+    families = {"FAM1": {s: None for s in ("P1", "M1", "F1", "S1")},
+                "FAM2": {s: None for s in ("P2", "M2", "F2")}}
+    regions = [("1", None, None), ("2", 0, 1500)]
+
+    def fingerprints(name, records, samples):
+        path = write_vcf(str(tmp_path / name), records, samples)
+        return get_fingerprints(pysam.tabix_index(path, preset="vcf"),
+                                regions, families)
+
+    before = fingerprints("fam1.vcf", records, SAMPLES)
+    after = fingerprints("cohort.vcf", records, COHORT_SAMPLES)
+    # Columns of the second family are appended
+    assert after["FAM1"] == before["FAM1"]
+    assert after["FAM2"] != before["FAM2"]
+    records[4] = dict(records[4], gts=dict(records[4]["gts"], M2=1))
+    changed = fingerprints("changed.vcf", records, COHORT_SAMPLES)
+    assert changed["FAM1"] == after["FAM1"]
+    assert changed["FAM2"] != after["FAM2"]
+    # AF of the de novo of the first family is over the threshold
+    records[0] = dict(records[0], gts=dict(records[0]["gts"], P2=2))
+    common = fingerprints("common.vcf", records, COHORT_SAMPLES)
+    assert common["FAM1"] != changed["FAM1"]
+
+
+def test_store_keeps_families_after_append(monkeypatch, tmp_path, fam_dir):
+    monkeypatch.chdir(tmp_path)
+    args = argparse.Namespace(cohort=True, family=fam_dir, callers=None,
+                              dnlib=None, results=None, assembly="hg19")
+    records = make_records(2000, COHORT_SAMPLES)
+    store_dir = str(tmp_path / "store")
+    for name, samples in (("fam1", SAMPLES), ("cohort", COHORT_SAMPLES)):
+        path = write_vcf(str(tmp_path / (name + ".vcf")), records, samples)
+        vcf_file = pysam.tabix_index(path, preset="vcf")
+        args.vcf = vcf_file
+        expected = str(tmp_path / (name + "_expected.tsv"))
+        harness = Harness(vcf_file, None, create_callers(args),
+                          flush=expected)
+        with contextlib.redirect_stdout(io.StringIO()):
+            harness.write_header()
+            harness.run()
+            harness.write_calls()
+        output = str(tmp_path / (name + ".tsv"))
+        log = run_stored(args, vcf_file, store_dir, output)
+        assert read(output) == read(expected)
+    # Calls of the first family are reused
+    assert "Computing 2 of 2 shards for 1 of 2 families" in log
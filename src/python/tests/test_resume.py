@@ -0,0 +1,92 @@
+#  Copyright (c) 2019. Partners HealthCare, Harvard Medical School’s
+#  Department of Biomedical Informatics
+#
+#  Developed by Sergey Trifonov and Michael Bouzinier, based on contributions by:
+#  Anwoy Kumar Mohanty, Andrew Bjonnes,
+#  Ignat Leshchiner, Shamil Sunyaev and other members of Division of Genetics,
+#  Brigham and Women's Hospital
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+import argparse
+import contextlib
+import io
+import os
+
+import pytest
+
+import callers.harness as harness_module
+from callers.harness import Harness
+from conftest import make_records, write_vcf
+from utils.case_utils import parse_fam_file
+from variant_caller import create_callers
+
+
+class Interrupted(Exception):
+    pass
+
+
+def make_harness(vcf_file, fam_file, calls_file):
+    args = argparse.Namespace(cohort=False, callers=None, dnlib=None,
+                              results=None, assembly="hg19")
+    return Harness(vcf_file, parse_fam_file(fam_file), create_callers(args),
+                   flush=calls_file, resume=True)
+
+
+def read(path):
+    with open(path) as f:
+        return f.read()
+
+
+@pytest.mark.parametrize("indexed", [True, False])
+def test_resume_matches_full_run(request, tmp_path, fam_file, indexed):
+    if indexed:
+        vcf_file = request.getfixturevalue("indexed_vcf_file")
+    else:
+        vcf_file = write_vcf(str(tmp_path / "plain.vcf"), make_records(4000))
+    expected = str(tmp_path / "expected.tsv")
+    harness = make_harness(vcf_file, fam_file, expected)
+    with contextlib.redirect_stdout(io.StringIO()):
+        harness.run()
+    n = harness.variant_counter
+
+    # A checkpoint after every block
+    request.getfixturevalue("monkeypatch").setattr(
+        harness_module, "CHECKPOINT_INTERVAL", 0)
+    output = str(tmp_path / "calls.tsv")
+    harness = make_harness(vcf_file, fam_file, output)
+    report_progress = harness.report_progress
+
+    def interrupt(t0, record, n=1):
+        if harness.variant_counter >= 1000:
+            raise Interrupted()
+        report_progress(t0, record, n)
+
+    harness.report_progress = interrupt
+    with contextlib.redirect_stdout(io.StringIO()), \
+            pytest.raises(Interrupted):
+        harness.run()
+    # Calls written after the checkpoint and a line cut by the interrupt
+    harness.flush_calls()
+    harness.close_calls()
+    with open(output, "a") as f:
+        f.write("1\t")
+    assert os.path.exists(output + ".checkpoint")
+
+    log = io.StringIO()
+    with contextlib.redirect_stdout(log):
+        harness = make_harness(vcf_file, fam_file, output)
+        harness.run()
+    assert "Resuming after" in log.getvalue()
+    assert harness.variant_counter == n
+    assert read(output) == read(expected)
+    assert not os.path.exists(output + ".checkpoint")
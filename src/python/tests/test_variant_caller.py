@@ -0,0 +1,61 @@
+#  Copyright (c) 2019. Partners HealthCare, Harvard Medical School’s
+#  Department of Biomedical Informatics
+#
+#  Developed by Sergey Trifonov and Michael Bouzinier, based on contributions by:
+#  Anwoy Kumar Mohanty, Andrew Bjonnes,
+#  Ignat Leshchiner, Shamil Sunyaev and other members of Division of Genetics,
+#  Brigham and Women's Hospital
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+import os
+import subprocess
+import sys
+
+import pytest
+
+SCRIPT = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), "variant_caller.py")
+
+
+def run_cli(cwd, *args):
+    return subprocess.run([sys.executable, SCRIPT] + list(args), cwd=cwd,
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                          universal_newlines=True)
+
+
+def test_streaming_writes_annotated_vcf(tmp_path, indexed_vcf_file,
+                                        fam_file):
+    result = run_cli(str(tmp_path), "-i", indexed_vcf_file, "-f", fam_file,
+                     "-o", "-")
+    assert result.returncode == 0, result.stderr
+    lines = result.stdout.splitlines()
+    assert lines[0] == "##fileformat=VCFv4.2"
+    records = [line for line in lines if not line.startswith('#')]
+    assert len(records) == 4000
+    assert any("BGM_DE_NOVO" in line for line in records)
+
+
+@pytest.mark.parametrize("options", [
+    ["--regions", "targets.bed"],
+    ["--start", "2:100", "--stop"],
+    ["--jobs", "2"],
+])
+def test_streaming_rejects_partial_runs(tmp_path, indexed_vcf_file, fam_file,
+                                        options):
+    with open(str(tmp_path / "targets.bed"), "w") as f:
+        f.write("1\t1000\t2000\n")
+    result = run_cli(str(tmp_path), "-i", indexed_vcf_file, "-f", fam_file,
+                     "-o", "-", *options)
+    assert result.returncode != 0
+    assert "not supported with '-o -'" in result.stderr
+    assert result.stdout == ""
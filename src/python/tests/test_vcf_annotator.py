@@ -0,0 +1,67 @@
+#  Copyright (c) 2019. Partners HealthCare, Harvard Medical School’s
+#  Department of Biomedical Informatics
+#
+#  Developed by Sergey Trifonov and Michael Bouzinier, based on contributions by:
+#  Anwoy Kumar Mohanty, Andrew Bjonnes,
+#  Ignat Leshchiner, Shamil Sunyaev and other members of Division of Genetics,
+#  Brigham and Women's Hospital
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+import gzip
+
+from conftest import make_records
+from utils.vcf_annotator import VCFAnnotator, BlockAnnotator
+
+HEADER_LINES = [
+    '##INFO=<ID=BGM_TEST,Number=1,Type=String,Description="Test">\n',
+    '##INFO=<ID=BGM_FLAG,Number=0,Type=Flag,Description="Test flag">\n',
+]
+
+
+def make_calls():
+    calls = []
+    for i, record in enumerate(make_records(4000)):
+        if i % 97 == 0:
+            calls.append((record["chrom"], record["pos"],
+                          {"BGM_TEST": str(i), "BGM_FLAG": "1"}))
+        elif i % 131 == 0:
+            # Between two records
+            calls.append((record["chrom"], record["pos"] + 1,
+                          {"BGM_TEST": str(i)}))
+    calls.append(("3", 100, {"BGM_TEST": "x"}))
+    return calls
+
+
+def read_text(path: str) -> str:
+    with gzip.open(path, "rt") as f:
+        return f.read()
+
+
+def test_block_annotator_matches_vcf_annotator(indexed_vcf_file, tmp_path):
+    assert BlockAnnotator.can_annotate(indexed_vcf_file, "out.vcf.gz")
+    sequential = VCFAnnotator.from_header_lines(HEADER_LINES)
+    expected = str(tmp_path / "sequential.vcf.gz")
+    sequential.annotate(indexed_vcf_file, expected, make_calls())
+
+    annotator = VCFAnnotator.from_header_lines(HEADER_LINES)
+    block = BlockAnnotator(annotator.header_lines, annotator.tags,
+                           annotator.flags)
+    output = str(tmp_path / "block.vcf.gz")
+    block.annotate(indexed_vcf_file, output, make_calls())
+
+    assert block.annotated == sequential.annotated == 42
+    assert block.unmatched == sequential.unmatched
+    text = read_text(output)
+    assert text == read_text(expected)
+    assert "BGM_TEST=97;BGM_FLAG\t" in text
+    assert text.count("##INFO=<ID=BGM_") == 2
@@ -0,0 +1,172 @@
+#  Copyright (c) 2019. Partners HealthCare, Harvard Medical School’s
+#  Department of Biomedical Informatics
+#
+#  Developed by Sergey Trifonov and Michael Bouzinier, based on contributions by:
+#  Anwoy Kumar Mohanty, Andrew Bjonnes,
+#  Ignat Leshchiner, Shamil Sunyaev and other members of Division of Genetics,
+#  Brigham and Women's Hospital
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+import argparse
+import contextlib
+import io
+
+import numpy as np
+
+from callers.harness import Harness
+from conftest import make_records, write_vcf
+from utils.case_utils import parse_fam_file
+from utils.vcf_wrappers import LazyFormat, VCF_READERS, open_vcf_reader
+from variant_caller import create_callers
+
+
+HEADER = [
+    "##fileformat=VCFv4.2",
+    '##INFO=<ID=DP,Number=1,Type=Integer,Description="Depth">',
+    '##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">',
+    '##FORMAT=<ID=AD,Number=R,Type=Integer,Description="Allele depths">',
+    "##contig=<ID=1,length=1000000>",
+]
+
+
+class FakeReader:
+    formats = dict()
+
+    @staticmethod
+    def _map(function, values):
+        return [function(v) if v != '.' else None for v in values]
+
+
+def decode(ads, n_alleles):
+    return LazyFormat(FakeReader(), "GT:AD").decode_ad_array(ads, n_alleles)
+
+
+def test_ad_array():
+    ref, alt, has_ad = decode(["10,5", ".", "0,20"], 2)
+    assert ref.tolist() == [10, 0, 0]
+    assert alt.tolist() == [5, 0, 20]
+    assert has_ad.tolist() == [True, False, True]
+
+
+def test_ad_array_with_uneven_samples():
+    # Total number of commas matches two samples with two alleles
+    ref, alt, has_ad = decode(["1,2,3", "4"], 2)
+    assert ref.tolist() == [1, 4]
+    assert alt.tolist() == [5, 0]
+    assert has_ad.tolist() == [True, True]
+
+
+def test_ad_array_with_missing_depth():
+    assert decode(["1,.", "2,3"], 2) is None
+
+
+def test_pysam_arrays_match_text(tmp_path):
+    path = str(tmp_path / "calls.vcf")
+    samples = ["S1", "S2", "S3", "S4"]
+    lines = [
+        ["0/1:10,5", "./.:.", "1/1:0,20", "0|0:7,0"],
+        ["0/2:3,1,4", "1/2:0,2,2", "0/0:9,0,0", ".:."],
+        ["0/1:3,.", "0/0:5,0", "0/0:5,0", "0/0:5,0"],
+        ["0/1", "0/0", "1/1", "./."],
+    ]
+    alts = ["G", "G,T", "G", "G"]
+    with open(path, "w") as f:
+        f.writelines(line + '\n' for line in HEADER)
+        f.write('\t'.join(["#CHROM", "POS", "ID", "REF", "ALT", "QUAL",
+                           "FILTER", "INFO", "FORMAT"] + samples) + '\n')
+        for i, (calls, alt) in enumerate(zip(lines, alts)):
+            fmt = "GT:AD" if ':' in calls[0] else "GT"
+            f.write('\t'.join(["1", str(100 + i), ".", "A", alt, "50",
+                               "PASS", "DP=10", fmt] + calls) + '\n')
+    arrays = dict()
+    for backend in VCF_READERS:
+        reader = open_vcf_reader(path, backend)
+        reader.set_samples({"S1", "S2", "S4"})
+        arrays[backend] = [record.get_gt_ad_arrays() for record in reader]
+    assert arrays["pysam"][2] is None and arrays["pyvcf"][2] is None
+    for text, direct in zip(arrays["pyvcf"], arrays["pysam"]):
+        if text is None:
+            continue
+        for expected, value in zip(text, direct):
+            assert value.dtype == expected.dtype
+            assert value.tolist() == expected.tolist()
+
+
+def write_calls(path, lines, alts):
+    samples = ["S{}".format(i + 1) for i in range(len(lines[0]))]
+    with open(path, "w") as f:
+        f.writelines(line + '\n' for line in HEADER)
+        f.write('\t'.join(["#CHROM", "POS", "ID", "REF", "ALT", "QUAL",
+                           "FILTER", "INFO", "FORMAT"] + samples) + '\n')
+        for i, (calls, alt) in enumerate(zip(lines, alts)):
+            f.write('\t'.join(["1", str(100 + i), ".", "A", alt, "50",
+                               "PASS", "DP=10", "GT:AD"] + calls) + '\n')
+    return samples
+
+
+def test_pysam_missing_ad_matches_text(tmp_path):
+    path = str(tmp_path / "calls.vcf")
+    lines = [
+        ["0/1:.,.", "0/0:5,0", "0/0:.", "0/0"],
+        ["0/1:5,.", "0/0:5,0", "0/0:.", "0/0"],
+        ["0/2:.,.,.", "0/0:5,0,0", "0/0:.", "0/0"],
+        ["0/1:5,5", "0/0:5,0", "0/0:.", "0/0"],
+    ]
+    samples = write_calls(path, lines, ["G", "G", "G,T", "G"])
+    calls = dict()
+    arrays = dict()
+    for backend in VCF_READERS:
+        reader = open_vcf_reader(path, backend)
+        reader.set_samples(set(samples))
+        records = list(reader)
+        calls[backend] = [[record.get_gt_ad(s) for s in samples]
+                          for record in records]
+        arrays[backend] = [record.get_gt_ad_arrays() for record in records]
+    assert calls["pysam"] == calls["pyvcf"]
+    assert calls["pysam"][0][0] == (1, [None, None])
+    assert calls["pysam"][0][2] == (0, None)
+    # Missing depths of alleles can not be represented by arrays
+    for backend in VCF_READERS:
+        assert arrays[backend][:3] == [None] * 3
+        assert arrays[backend][3][3].tolist() == [True, True, False, False]
+
+
+def test_missing_ad_calls_match_text(tmp_path, fam_file):
+    path = write_vcf(str(tmp_path / "input.vcf"), make_records())
+    with open(path) as f:
+        lines = f.read().splitlines()
+    with open(path, "w") as f:
+        for i, line in enumerate(lines):
+            fields = line.split('\t')
+            if not line.startswith('#'):
+                # AD of the proband: missing, missing depths or partial
+                gt = fields[9].split(':')[0]
+                fields[9] = gt + ":" + (".", ".,.", "5,.")[i % 3]
+            f.write('\t'.join(fields) + '\n')
+    args = argparse.Namespace(cohort=False, callers=None, dnlib=None,
+                              results=None, assembly="hg19")
+    calls = dict()
+    for backend in VCF_READERS:
+        harness = Harness(path, parse_fam_file(fam_file),
+                          create_callers(args), reader=backend)
+        with contextlib.redirect_stdout(io.StringIO()):
+            harness.run()
+        calls[backend] = dict(harness.get_calls().items())
+    assert calls["pysam"] == calls["pyvcf"]
+    # Records with missing depths of alleles are not called
+    n_header = sum(line.startswith('#') for line in lines)
+    called = {pos for pos, values in calls["pysam"].items()
+              if "BGM_DE_NOVO" in values}
+    assert called
+    for _, pos in called:
+        assert ((pos - 100) // 10 + n_header) % 3 == 0
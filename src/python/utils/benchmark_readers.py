@@ -0,0 +1,96 @@
+#  Copyright (c) 2019. Partners HealthCare, Harvard Medical School’s
+#  Department of Biomedical Informatics
+#
+#  Developed by Sergey Trifonov and Michael Bouzinier, based on contributions by:
+#  Anwoy Kumar Mohanty, Andrew Bjonnes,
+#  Ignat Leshchiner, Shamil Sunyaev and other members of Division of Genetics,
+#  Brigham and Women's Hospital
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import argparse
+import time
+from typing import Dict
+
+from callers.ab_caller import ABCaller
+from utils.vcf_wrappers import VCF_READERS, open_vcf_reader
+
+BLOCK_SIZE = 256
+
+
+def benchmark(vcf_file: str, backend: str, region: str = None) -> Dict:
+    '''
+    Reads a VCF with a reader backend the way Harness does: every record
+    is read and genotypes of all samples are decoded in blocks
+    '''
+    t0 = time.perf_counter()
+    reader = open_vcf_reader(vcf_file, backend)
+    reader.set_samples(set(reader.samples))
+    if region:
+        chromosome, _, interval = region.partition(':')
+        start, _, end = interval.partition('-')
+        reader.fetch(chromosome, int(start) - 1 if start else None,
+                     int(end) if end else None)
+    t_open = time.perf_counter()
+    n = 0
+    t_genotypes = 0.
+    block = []
+    for record in reader:
+        n += 1
+        block.append(record)
+        if len(block) >= BLOCK_SIZE:
+            t = time.perf_counter()
+            ABCaller.calculate_block_genotypes(block, reader.selected)
+            t_genotypes += time.perf_counter() - t
+            block = []
+    if block:
+        t = time.perf_counter()
+        ABCaller.calculate_block_genotypes(block, reader.selected)
+        t_genotypes += time.perf_counter() - t
+    total = time.perf_counter() - t0
+    return {
+        "records": n,
+        "open": t_open - t0,
+        "reading": total - (t_open - t0) - t_genotypes,
+        "genotypes": t_genotypes,
+        "total": total
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Compare VCF reader backends on the same file")
+    parser.add_argument("-i", "--input", "--vcf", dest="vcf",
+                        help="Input VCF or BCF file", required=True)
+    parser.add_argument("--readers", nargs="*", default=list(VCF_READERS),
+                        choices=VCF_READERS, help="Readers to compare")
+    parser.add_argument("--region",
+                        help="Read only a region: chrom or chrom:start-end",
+                        required=False)
+    parser.add_argument("--repeat", type=int, default=1,
+                        help="Number of runs, the best is reported")
+
+    args = parser.parse_args()
+    print("{:<8} {:>10} {:>10} {:>10} {:>10} {:>12}".format(
+        "reader", "records", "reading", "genotypes", "total", "records/sec"))
+    for backend in args.readers:
+        if backend == "pyvcf" and args.vcf.endswith(".bcf"):
+            print("{:<8} does not read BCF".format(backend))
+            continue
+        result = min((benchmark(args.vcf, backend, args.region)
+                      for _ in range(args.repeat)),
+                     key=lambda r: r["total"])
+        print("{:<8} {:>10d} {:>10.3f} {:>10.3f} {:>10.3f} {:>12.1f}".format(
+            backend, result["records"], result["reading"],
+            result["genotypes"], result["total"],
+            result["records"] / result["total"]))
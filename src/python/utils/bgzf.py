@@ -0,0 +1,323 @@
+#  Copyright (c) 2019. Partners HealthCare, Harvard Medical School’s
+#  Department of Biomedical Informatics
+#
+#  Developed by Sergey Trifonov and Michael Bouzinier, based on contributions by:
+#  Anwoy Kumar Mohanty, Andrew Bjonnes,
+#  Ignat Leshchiner, Shamil Sunyaev and other members of Division of Genetics,
+#  Brigham and Women's Hospital
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import gzip
+import struct
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+# Uncompressed size of a block, as used by bgzip and htslib
+MAX_BLOCK_DATA = 0xff00
+COMPRESS_LEVEL = 6
+HEADER = struct.Struct("<4BI2BH2BHH")
+TRAILER = struct.Struct("<II")
+EOF_BLOCK = bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000")
+# Tabix: size of a window of linear index and the pseudo-bin with metadata
+TBI_SHIFT = 14
+TBI_META_BIN = 37450
+
+
+def compress_block(data: bytes, level: int = COMPRESS_LEVEL) -> bytes:
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    cdata = compressor.compress(data) + compressor.flush()
+    block_size = HEADER.size + len(cdata) + TRAILER.size
+    header = HEADER.pack(0x1f, 0x8b, 8, 4, 0, 0, 0xff, 6,
+                         ord('B'), ord('C'), 2, block_size - 1)
+    trailer = TRAILER.pack(zlib.crc32(data) & 0xffffffff, len(data))
+    return header + cdata + trailer
+
+
+class BGZFWriter:
+    '''
+    Writes BGZF (blocked gzip) files, readable by gzip, tabix and htslib.
+    Blocks are compressed by a pool of threads (zlib releases GIL)
+    and written in order.
+    '''
+    def __init__(self, filename: str, threads: int = 2,
+                 level: int = COMPRESS_LEVEL) -> None:
+        self.output = open(filename, "wb")
+        self.level = level
+        self.buffer = bytearray()
+        self.executor = None
+        self.pending = deque()
+        self.max_pending = 4 * threads
+        if threads > 1:
+            self.executor = ThreadPoolExecutor(threads)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def write(self, text):
+        if isinstance(text, str):
+            text = text.encode("utf-8", "surrogateescape")
+        self.buffer += text
+        while len(self.buffer) >= MAX_BLOCK_DATA:
+            self._submit(bytes(self.buffer[:MAX_BLOCK_DATA]))
+            del self.buffer[:MAX_BLOCK_DATA]
+
+    def write_block(self, block: bytes):
+        '''
+        Writes an already compressed block as is
+        '''
+        self.flush()
+        self._drain(0)
+        self.output.write(block)
+
+    def _submit(self, data: bytes):
+        if self.executor is None:
+            self.output.write(compress_block(data, self.level))
+            return
+        self.pending.append(self.executor.submit(compress_block,
+                                                 data, self.level))
+        self._drain(self.max_pending)
+
+    def _drain(self, limit: int):
+        while len(self.pending) > limit:
+            self.output.write(self.pending.popleft().result())
+
+    def flush(self):
+        if self.buffer:
+            self._submit(bytes(self.buffer))
+            self.buffer.clear()
+
+    def close(self):
+        if self.output is None:
+            return
+        self.flush()
+        self._drain(0)
+        self.output.write(EOF_BLOCK)
+        self.output.close()
+        self.output = None
+        if self.executor is not None:
+            self.executor.shutdown()
+
+
+def get_block_size(header: bytes) -> int:
+    '''
+    Returns the total size of a BGZF block from its first bytes
+    (gzip header with extra fields) or 0 if it is not a BGZF block
+    '''
+    if len(header) < 18 or header[:4] != b"\x1f\x8b\x08\x04":
+        return 0
+    xlen = struct.unpack_from("<H", header, 10)[0]
+    extra = header[12:12 + xlen]
+    i = 0
+    while i + 4 <= len(extra):
+        slen = struct.unpack_from("<H", extra, i + 2)[0]
+        if extra[i:i+2] == b"BC" and slen == 2:
+            return struct.unpack_from("<H", extra, i + 4)[0] + 1
+        i += 4 + slen
+    return 0
+
+
+def decompress_block(block: bytes) -> bytes:
+    xlen = struct.unpack_from("<H", block, 10)[0]
+    return zlib.decompress(block[12 + xlen:-TRAILER.size], -15)
+
+
+def get_data_size(block: bytes) -> int:
+    return struct.unpack_from("<I", block, len(block) - 4)[0]
+
+
+def is_bgzf(filename: str) -> bool:
+    with open(filename, "rb") as f:
+        return get_block_size(f.read(64)) > 0
+
+
+class BGZFReader:
+    '''
+    Gives access to raw (compressed) BGZF blocks by their offsets in the
+    file, without decompressing them
+    '''
+    def __init__(self, filename: str) -> None:
+        self.input = open(filename, "rb", buffering=1 << 20)
+        self.cache = (None, None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        self.input.close()
+
+    def read_block(self, offset: int = None) -> Optional[bytes]:
+        if offset is not None:
+            self.input.seek(offset)
+        header = self.input.read(18)
+        if not header:
+            return None
+        size = get_block_size(header)
+        if size < 18:
+            raise ValueError("Not a BGZF block at {:d}".format(
+                self.input.tell() - len(header)))
+        return header + self.input.read(size - len(header))
+
+    def read_data(self, offset: int) -> Tuple[Optional[bytes], int]:
+        '''
+        Returns decompressed content of a block and the offset
+        of the next block
+        '''
+        if self.cache[0] == offset:
+            return self.cache[1]
+        block = self.read_block(offset)
+        if block is None:
+            result = (None, offset)
+        else:
+            result = (decompress_block(block), offset + len(block))
+        self.cache = (offset, result)
+        return result
+
+    def blocks(self):
+        self.input.seek(0)
+        offset = 0
+        while True:
+            block = self.read_block()
+            if block is None:
+                return
+            yield offset, block
+            offset += len(block)
+
+
+def read_tabix_index(index_file: str) -> Dict[str, List[int]]:
+    '''
+    Reads linear index from a tabix (.tbi) file. Returns for every contig
+    virtual offsets, from which records overlapping every window
+    of 2^14 bases can be found.
+    '''
+    with gzip.open(index_file, "rb") as f:
+        data = f.read()
+    if data[:4] != b"TBI\x01":
+        raise ValueError("Not a tabix index: {}".format(index_file))
+    n_ref = struct.unpack_from("<i", data, 4)[0]
+    l_nm = struct.unpack_from("<i", data, 32)[0]
+    names = data[36:36 + l_nm].split(b"\0")[:n_ref]
+    i = 36 + l_nm
+    index = dict()
+    for name in names:
+        n_bin = struct.unpack_from("<i", data, i)[0]
+        i += 4
+        first = None
+        for _ in range(n_bin):
+            bin_id, n_chunk = struct.unpack_from("<Ii", data, i)
+            i += 8
+            if bin_id != TBI_META_BIN and n_chunk > 0:
+                chunk_begin = min(struct.unpack_from("<{:d}Q".format(
+                    2 * n_chunk), data, i)[0::2])
+                if first is None or chunk_begin < first:
+                    first = chunk_begin
+            i += 16 * n_chunk
+        n_intv = struct.unpack_from("<i", data, i)[0]
+        i += 4
+        linear = list(struct.unpack_from("<{:d}Q".format(n_intv), data, i))
+        i += 8 * n_intv
+        # Fill windows without records
+        offset = first if first is not None else 0
+        for w in range(len(linear)):
+            if linear[w] == 0:
+                linear[w] = offset
+            else:
+                offset = linear[w]
+        if not linear:
+            linear = [offset]
+        index[name.decode()] = linear
+    return index
+
+
+def decompress_blocks(blocks: List[bytes]) -> bytes:
+    return b"".join(decompress_block(block) for block in blocks)
+
+
+class BGZFLines:
+    '''
+    Lines (without line ends) of a BGZF file, which blocks are
+    decompressed ahead of the reader by a pool of threads (zlib releases
+    GIL). Blocks are read in order, decompressed in batches and joined
+    back in order; lines are decoded a batch at a time
+    '''
+    # Compressed blocks decompressed by a single task
+    BATCH_SIZE = 16
+
+    def __init__(self, filename: str, threads: int = 2,
+                 encoding: str = "utf-8") -> None:
+        self.name = filename
+        self.encoding = encoding
+        self.reader = BGZFReader(filename)
+        self.executor = ThreadPoolExecutor(threads)
+        self.max_pending = 2 * threads
+
+    def __iter__(self):
+        return self.lines()
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+        self.reader.close()
+
+    def read_batch(self) -> List[bytes]:
+        blocks = []
+        while len(blocks) < self.BATCH_SIZE:
+            block = self.reader.read_block()
+            if block is None:
+                break
+            blocks.append(block)
+        return blocks
+
+    def data(self):
+        pending = deque()
+        eof = False
+        while True:
+            while not eof and len(pending) < self.max_pending:
+                blocks = self.read_batch()
+                if not blocks:
+                    eof = True
+                    break
+                pending.append(self.executor.submit(decompress_blocks,
+                                                    blocks))
+            if not pending:
+                return
+            yield pending.popleft().result()
+
+    def lines(self):
+        rest = b""
+        try:
+            for data in self.data():
+                end = data.rfind(b"\n") + 1
+                if end == 0:
+                    rest += data
+                    continue
+                text = (rest + data[:end]).decode(self.encoding,
+                                                   "surrogateescape")
+                rest = data[end:]
+                lines = text.split("\n")
+                # The text ends with a line end
+                lines.pop()
+                yield from lines
+            if rest:
+                yield rest.decode(self.encoding, "surrogateescape")
+        finally:
+            self.close()
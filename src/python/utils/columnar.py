@@ -0,0 +1,345 @@
+#  Copyright (c) 2019. Partners HealthCare, Harvard Medical School’s
+#  Department of Biomedical Informatics
+#
+#  Developed by Sergey Trifonov and Michael Bouzinier, based on contributions by:
+#  Anwoy Kumar Mohanty, Andrew Bjonnes,
+#  Ignat Leshchiner, Shamil Sunyaev and other members of Division of Genetics,
+#  Brigham and Women's Hospital
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import argparse
+import json
+import re
+import struct
+import zipfile
+from typing import Dict, List, Iterator, Tuple
+
+import numpy as np
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+ROW_GROUP_SIZE = 65536
+ARROW_EXTENSIONS = (".arrow", ".feather", ".ipc")
+PARQUET_EXTENSIONS = (".parquet",)
+COLUMNAR_EXTENSIONS = ARROW_EXTENSIONS + PARQUET_EXTENSIONS + (".npz",)
+SCHEMA_MEMBER = "schema.json"
+INFO_PATTERN = re.compile(r"##INFO=<ID=([^,>]+),.*?Type=([^,>]+)")
+# Local file header of a zip member: name and extra field lengths
+ZIP_LOCAL_HEADER = struct.Struct("<26xHH")
+
+
+def read_tag_types(header_lines: List[str]) -> Dict[str, str]:
+    '''
+    Types (Flag, Integer, Float or String) of tags by INFO header lines
+    '''
+    types = dict()
+    for line in header_lines:
+        match = INFO_PATTERN.match(line)
+        if match:
+            types[match.group(1)] = match.group(2)
+    return types
+
+
+def get_format(filename: str) -> str:
+    if filename.endswith(ARROW_EXTENSIONS):
+        return "arrow"
+    if filename.endswith(PARQUET_EXTENSIONS):
+        return "parquet"
+    if filename.endswith(".npz"):
+        return "npz"
+    raise ValueError("Unknown columnar format of {}, expected one of {}".
+                     format(filename, ', '.join(COLUMNAR_EXTENSIONS)))
+
+
+def is_columnar(filename: str) -> bool:
+    return filename.endswith(COLUMNAR_EXTENSIONS)
+
+
+class ColumnarWriter:
+    '''
+    Writes calls with a typed column per tag: Flag as bool, Integer as
+    int64, Float as float64, String as str; missing values are nulls
+    (Arrow, Parquet) or are marked by a "<tag>.valid" mask (npz). Rows
+    are written in row groups: record batches of Arrow IPC file, row
+    groups of Parquet or, without pyarrow, arrays of a group in an
+    uncompressed npz, which can be memory mapped
+    '''
+    def __init__(self, filename: str, tags: List[str], types: Dict,
+                 row_group_size: int = ROW_GROUP_SIZE) -> None:
+        self.format = get_format(filename)
+        if self.format != "npz" and pyarrow is None:
+            filename = filename.rsplit('.', 1)[0] + ".npz"
+            print("pyarrow is not installed, writing calls to {}".
+                  format(filename))
+            self.format = "npz"
+        self.filename = filename
+        self.tags = list(tags)
+        self.types = {tag: types.get(tag, "String") for tag in self.tags}
+        self.row_group_size = row_group_size
+        self.rows = []
+        self.n_groups = 0
+        self.n_rows = 0
+        self.writer = None
+        if self.format == "npz":
+            self.output = zipfile.ZipFile(filename, "w", zipfile.ZIP_STORED,
+                                          allowZip64=True)
+        else:
+            self.schema = pyarrow.schema(
+                [("CHROM", pyarrow.string()), ("POS", pyarrow.int64())] +
+                [(tag, self.get_arrow_type(self.types[tag]))
+                 for tag in self.tags])
+            if self.format == "arrow":
+                self.output = pyarrow.OSFile(filename, "wb")
+                self.writer = pyarrow.ipc.new_file(self.output, self.schema)
+            else:
+                self.writer = pyarrow.parquet.ParquetWriter(filename,
+                                                            self.schema)
+
+    @staticmethod
+    def get_arrow_type(tag_type: str):
+        return {
+            "Flag": pyarrow.bool_(),
+            "Integer": pyarrow.int64(),
+            "Float": pyarrow.float64()
+        }.get(tag_type, pyarrow.string())
+
+    def write(self, chromosome: str, pos: int, values: Dict):
+        '''
+        Adds a row: values by tag as in calls file, missing tags are
+        not in values
+        '''
+        self.rows.append((chromosome, pos, values))
+        if len(self.rows) >= self.row_group_size:
+            self.write_group()
+
+    def make_column(self, tag: str) -> Tuple[np.ndarray, np.ndarray]:
+        tag_type = self.types[tag]
+        values = [row[2].get(tag) for row in self.rows]
+        valid = np.array([value is not None for value in values], dtype=bool)
+        if tag_type == "Flag":
+            return valid, None
+        if tag_type == "Integer":
+            column = np.array([int(v) if v is not None else 0
+                               for v in values], dtype=np.int64)
+        elif tag_type == "Float":
+            column = np.array([float(v) if v is not None else np.nan
+                               for v in values], dtype=np.float64)
+        else:
+            column = np.array([v if v is not None else "" for v in values],
+                              dtype=str)
+        return column, valid
+
+    def write_group(self):
+        if not self.rows:
+            return
+        chromosomes = np.array([row[0] for row in self.rows], dtype=str)
+        positions = np.array([row[1] for row in self.rows], dtype=np.int64)
+        columns = [(tag, self.make_column(tag)) for tag in self.tags]
+        if self.format == "npz":
+            prefix = "{:06d}/".format(self.n_groups)
+            self.write_array(prefix + "CHROM", chromosomes)
+            self.write_array(prefix + "POS", positions)
+            for tag, (column, valid) in columns:
+                self.write_array(prefix + tag, column)
+                if valid is not None:
+                    self.write_array(prefix + tag + ".valid", valid)
+        else:
+            arrays = [pyarrow.array(chromosomes), pyarrow.array(positions)]
+            for tag, (column, valid) in columns:
+                arrays.append(pyarrow.array(
+                    column, type=self.get_arrow_type(self.types[tag]),
+                    mask=None if valid is None else ~valid))
+            batch = pyarrow.RecordBatch.from_arrays(arrays,
+                                                    schema=self.schema)
+            if self.format == "arrow":
+                self.writer.write_batch(batch)
+            else:
+                self.writer.write_table(pyarrow.Table.from_batches([batch]))
+        self.n_groups += 1
+        self.n_rows += len(self.rows)
+        self.rows = []
+
+    def write_array(self, name: str, array: np.ndarray):
+        with self.output.open(name + ".npy", "w", force_zip64=True) as f:
+            np.lib.format.write_array(f, array, allow_pickle=False)
+
+    def close(self):
+        self.write_group()
+        if self.format == "npz":
+            schema = {"tags": self.tags, "types": self.types,
+                      "row_groups": self.n_groups}
+            self.output.writestr(SCHEMA_MEMBER, json.dumps(schema))
+            self.output.close()
+        else:
+            self.writer.close()
+            if self.format == "arrow":
+                self.output.close()
+
+
+def map_npz_member(filename: str, info: zipfile.ZipInfo) -> np.ndarray:
+    '''
+    Memory maps an array stored without compression in an npz file
+    '''
+    with open(filename, "rb") as f:
+        f.seek(info.header_offset)
+        name_length, extra_length = ZIP_LOCAL_HEADER.unpack(
+            f.read(ZIP_LOCAL_HEADER.size))
+        f.seek(info.header_offset + ZIP_LOCAL_HEADER.size +
+               name_length + extra_length)
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = \
+                np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = \
+                np.lib.format.read_array_header_2_0(f)
+        offset = f.tell()
+    if int(np.prod(shape)) == 0:
+        return np.empty(shape, dtype=dtype)
+    return np.memmap(filename, dtype=dtype, mode="r", shape=shape,
+                     offset=offset, order="F" if fortran_order else "C")
+
+
+class ColumnarReader:
+    '''
+    Reads calls written by ColumnarWriter. Row groups are returned as
+    dictionaries of numpy arrays: CHROM, POS, a column per tag and
+    "<tag>.valid" masks of values, which are not missing. Arrays of npz
+    and of Arrow IPC files (except strings) are mapped, not copied
+    '''
+    def __init__(self, filename: str) -> None:
+        self.filename = filename
+        self.format = get_format(filename)
+        if self.format == "npz":
+            with zipfile.ZipFile(filename) as zf:
+                schema = json.loads(zf.read(SCHEMA_MEMBER))
+            self.tags = schema["tags"]
+            self.types = schema["types"]
+        else:
+            if pyarrow is None:
+                raise ImportError("pyarrow is required to read {}".
+                                  format(filename))
+            schema = self.read_table().schema
+            self.tags = schema.names[2:]
+            self.types = {field.name: "Flag"
+                          if pyarrow.types.is_boolean(field.type) else
+                          "Integer" if pyarrow.types.is_integer(field.type)
+                          else "Float" if pyarrow.types.is_floating(field.type)
+                          else "String" for field in schema}
+
+    def read_table(self):
+        '''
+        Calls as pyarrow.Table (Arrow and Parquet only)
+        '''
+        if self.format == "arrow":
+            return pyarrow.ipc.open_file(
+                pyarrow.memory_map(self.filename)).read_all()
+        return pyarrow.parquet.read_table(self.filename, memory_map=True)
+
+    def row_groups(self) -> Iterator[Dict[str, np.ndarray]]:
+        if self.format == "npz":
+            with zipfile.ZipFile(self.filename) as zf:
+                groups = dict()
+                for info in zf.infolist():
+                    if info.filename == SCHEMA_MEMBER:
+                        continue
+                    group, name = info.filename[:-len(".npy")].split('/', 1)
+                    groups.setdefault(group, dict())[name] = info
+            for group in sorted(groups):
+                yield {name: map_npz_member(self.filename, info)
+                       for name, info in groups[group].items()}
+            return
+        for batch in self.read_table().to_batches():
+            columns = dict()
+            for name, column in zip(batch.schema.names, batch.columns):
+                if name not in ("CHROM", "POS"):
+                    columns[name + ".valid"] = np.asarray(
+                        column.is_valid())
+                    if column.null_count:
+                        column = column.fill_null(
+                            False if self.types[name] == "Flag" else
+                            "" if self.types[name] == "String" else 0)
+                columns[name] = column.to_numpy(zero_copy_only=False)
+            yield columns
+
+    def iterate_calls(self) -> Iterator[Tuple[str, int, Dict]]:
+        '''
+        Same as utils.tsv.iterate_calls(): chromosome, position and
+        the values by tag as text, missing values are skipped
+        '''
+        for columns in self.row_groups():
+            present = dict()
+            for tag in self.tags:
+                if self.types[tag] == "Flag":
+                    present[tag] = columns[tag]
+                else:
+                    present[tag] = columns[tag + ".valid"]
+            for i in range(len(columns["POS"])):
+                values = dict()
+                for tag in self.tags:
+                    if not present[tag][i]:
+                        continue
+                    if self.types[tag] == "Flag":
+                        values[tag] = "1"
+                    else:
+                        values[tag] = str(columns[tag][i].item())
+                yield str(columns["CHROM"][i]), int(columns["POS"][i]), values
+
+
+def convert_calls(calls_file: str, output_file: str, types: Dict,
+                  row_group_size: int = ROW_GROUP_SIZE) -> str:
+    '''
+    Writes calls file in columnar format, streaming it in row groups.
+    Returns the name of the written file
+    '''
+    writer = None
+    with open(calls_file) as calls:
+        for line in calls:
+            if line.startswith('#'):
+                tags = line[1:].split()[2:]
+                continue
+            if writer is None:
+                writer = ColumnarWriter(output_file, tags, types,
+                                        row_group_size)
+            data = line.rstrip('\n').split('\t')
+            writer.write(data[0], int(data[1]),
+                         {tag: v for tag, v in zip(tags, data[2:])
+                          if v != '.'})
+    if writer is None:
+        writer = ColumnarWriter(output_file, tags, types, row_group_size)
+    writer.close()
+    print("Written {:d} calls in {:d} row groups to {}".format(
+        writer.n_rows, writer.n_groups, writer.filename))
+    return writer.filename
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Convert calls file to columnar format")
+    parser.add_argument("calls", help="Calls file (TSV)")
+    parser.add_argument("output", help="Output file: .arrow, .feather or "
+                        ".parquet (requires pyarrow) or .npz")
+    parser.add_argument("--header", help="File with VCF headers of the "
+                        "tags, giving their types. Default: all are strings")
+    args = parser.parse_args()
+    types = dict()
+    if args.header:
+        with open(args.header) as header:
+            types = read_tag_types(header)
+    convert_calls(args.calls, args.output, types)
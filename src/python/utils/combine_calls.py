@@ -5,7 +5,8 @@ import sortedcontainers
 from typing import Dict
 
 from callers.harness import CALLS_FILE_NAME
-from utils.tsv import TSVReader
+from utils.columnar import ColumnarReader, COLUMNAR_EXTENSIONS
+from utils.tsv import TSVReader, Pos
 
 
 class CallSet:
@@ -19,16 +20,34 @@ class CallSet:
 
 
 
+def read_columnar_calls(f) -> (Dict, str):
+    '''
+    Same as candidate calls of TSVReader for a file in columnar format
+    '''
+    reader = ColumnarReader(f)
+    candidate_calls = sortedcontainers.SortedDict()
+    for chromosome, pos, values in reader.iterate_calls():
+        candidate_calls[Pos(chromosome, pos)] = [values.get(tag, '.')
+                                                 for tag in reader.tags]
+    headerline = "# CHROM\tPOS\t{}\n".format('\t'.join(reader.tags))
+    return candidate_calls, headerline
+
+
 def read_all_calls(folder) -> (Dict, str):
     files = glob.glob(os.path.join(folder, "*.tsv"))
+    for extension in COLUMNAR_EXTENSIONS:
+        files += glob.glob(os.path.join(folder, "*" + extension))
     calls = sortedcontainers.SortedDict()
     headerline = "#"
     for f in files:
-        with open(f) as ff:
-            headerline = ff.readline()
-        tsv_reader = TSVReader(f, "", [])
-        for pos in tsv_reader.candidate_calls:
-            samples = tsv_reader.candidate_calls[pos]
+        if f.endswith(".tsv"):
+            with open(f) as ff:
+                headerline = ff.readline()
+            candidate_calls = TSVReader(f, "", []).candidate_calls
+        else:
+            candidate_calls, headerline = read_columnar_calls(f)
+        for pos in candidate_calls:
+            samples = candidate_calls[pos]
             if pos in calls:
                 call_set = calls[pos]
             else:
@@ -52,7 +71,8 @@ def write_all_calls(output, headerline, calls):
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description="Run BGM variant callers")
     parser.add_argument("-f", "--folder",
-                        help="Folder, containing individual call files, *.tsv",
+                        help="Folder, containing individual call files, *.tsv or "
+                             "columnar (*.npz, *.arrow, *.parquet)",
                         required=True)
     parser.add_argument("-o", "--output",
             help="Output file with combined calls",
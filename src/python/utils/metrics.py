@@ -0,0 +1,205 @@
+#  Copyright (c) 2019. Partners HealthCare, Harvard Medical School’s
+#  Department of Biomedical Informatics
+#
+#  Developed by Sergey Trifonov and Michael Bouzinier, based on contributions by:
+#  Anwoy Kumar Mohanty, Andrew Bjonnes,
+#  Ignat Leshchiner, Shamil Sunyaev and other members of Division of Genetics,
+#  Brigham and Women's Hospital
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import json
+import math
+import os
+import time
+from collections import OrderedDict
+from typing import Dict
+
+METRICS_INTERVAL = 10
+PREFIX = "variant_callers"
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+class Histogram:
+    '''
+    Histogram of durations with logarithmic buckets: bucket i counts
+    values between 2^(i-1) and 2^i microseconds
+    '''
+    N_BUCKETS = 40
+
+    def __init__(self) -> None:
+        self.counts = [0] * self.N_BUCKETS
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, seconds: float, n: int = 1):
+        '''
+        Adds n observations of the given duration
+        '''
+        bucket = math.frexp(seconds * 1e6)[1]
+        if bucket < 0:
+            bucket = 0
+        elif bucket >= self.N_BUCKETS:
+            bucket = self.N_BUCKETS - 1
+        self.counts[bucket] += n
+        self.count += n
+        self.total += seconds * n
+
+    def quantile(self, q: float) -> float:
+        '''
+        Upper bound of the bucket containing the quantile, in seconds
+        '''
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        n = 0
+        for bucket, count in enumerate(self.counts):
+            n += count
+            if n >= rank:
+                return math.ldexp(1.0, bucket) * 1e-6
+        return math.ldexp(1.0, self.N_BUCKETS - 1) * 1e-6
+
+
+class Stage:
+    def __init__(self, metrics: "Metrics", name: str) -> None:
+        self.metrics = metrics
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.metrics.add_time(self.name, time.perf_counter() - self.start)
+
+
+class Metrics:
+    '''
+    Time spent in stages of processing, latency of callers and counters
+    of a run. Periodically written to a file: Prometheus text format
+    if the file name ends with .prom, JSON otherwise
+    '''
+    def __init__(self, filename: str, interval: float = METRICS_INTERVAL) -> None:
+        self.filename = filename
+        self.interval = interval
+        self.t0 = time.time()
+        self.last_write = self.t0
+        self.stages = OrderedDict()
+        self.latency = OrderedDict()
+        self.counters = OrderedDict()
+
+    def stage(self, name: str) -> Stage:
+        return Stage(self, name)
+
+    def add_time(self, stage: str, seconds: float):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def observe(self, name: str, seconds: float, n: int = 1):
+        histogram = self.latency.get(name)
+        if histogram is None:
+            histogram = Histogram()
+            self.latency[name] = histogram
+        histogram.add(seconds, n)
+
+    def set_counters(self, **counters):
+        self.counters.update(counters)
+
+    def snapshot(self) -> Dict:
+        elapsed = time.time() - self.t0
+        rates = {name: value / elapsed if elapsed > 0 else 0.0
+                 for name, value in self.counters.items()}
+        callers = OrderedDict()
+        for name, histogram in self.latency.items():
+            callers[name] = {
+                "count": histogram.count,
+                "seconds": histogram.total,
+                "quantiles": {str(q): histogram.quantile(q)
+                              for q in QUANTILES}
+            }
+        return {
+            "elapsed": elapsed,
+            "counters": dict(self.counters),
+            "rates": rates,
+            "stages": dict(self.stages),
+            "callers": callers
+        }
+
+    def format_prometheus(self, snapshot: Dict) -> str:
+        lines = []
+
+        def metric(name, kind, help_text, values, suffixed=()):
+            '''
+            Values are pairs of labels and value; suffixed values are
+            samples with a suffix of the name, as _sum and _count of
+            a summary
+            '''
+            name = "{}_{}".format(PREFIX, name)
+            lines.append("# HELP {} {}".format(name, help_text))
+            lines.append("# TYPE {} {}".format(name, kind))
+            samples = [("", labels, value) for labels, value in values]
+            for suffix, labels, value in samples + list(suffixed):
+                if labels:
+                    labels = "{{{}}}".format(','.join(
+                        '{}="{}"'.format(k, v) for k, v in labels))
+                else:
+                    labels = ""
+                lines.append("{}{}{} {}".format(name, suffix, labels,
+                                                repr(value)))
+
+        metric("elapsed_seconds", "gauge", "Time since start of the run",
+               [((), snapshot["elapsed"])])
+        for counter, value in snapshot["counters"].items():
+            metric("{}_total".format(counter), "counter",
+                   "Number of {}".format(counter.replace('_', ' ')),
+                   [((), value)])
+            metric("{}_per_second".format(counter), "gauge",
+                   "Average rate of {}".format(counter.replace('_', ' ')),
+                   [((), snapshot["rates"][counter])])
+        metric("stage_seconds_total", "counter",
+               "Time spent in stages of processing",
+               [((("stage", stage),), value)
+                for stage, value in snapshot["stages"].items()])
+        latency = []
+        totals = []
+        for caller, data in snapshot["callers"].items():
+            for q, value in data["quantiles"].items():
+                latency.append(((("caller", caller), ("quantile", q)), value))
+            totals.append(("_sum", (("caller", caller),), data["seconds"]))
+            totals.append(("_count", (("caller", caller),), data["count"]))
+        metric("caller_latency_seconds", "summary",
+               "Time per record spent by a caller", latency, totals)
+        metric("caller_records_total", "counter",
+               "Number of records processed by a caller",
+               [((("caller", caller),), data["count"])
+                for caller, data in snapshot["callers"].items()])
+        metric("caller_seconds_total", "counter",
+               "Total time spent by a caller",
+               [((("caller", caller),), data["seconds"])
+                for caller, data in snapshot["callers"].items()])
+        return '\n'.join(lines) + '\n'
+
+    def write(self):
+        snapshot = self.snapshot()
+        tmp = self.filename + ".tmp"
+        with open(tmp, "w") as f:
+            if self.filename.endswith(".prom"):
+                f.write(self.format_prometheus(snapshot))
+            else:
+                json.dump(snapshot, f, indent=2)
+        os.replace(tmp, self.filename)
+        self.last_write = time.time()
+
+    def maybe_write(self):
+        if time.time() - self.last_write >= self.interval:
+            self.write()
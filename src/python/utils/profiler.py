@@ -0,0 +1,187 @@
+#  Copyright (c) 2019. Partners HealthCare, Harvard Medical School’s
+#  Department of Biomedical Informatics
+#
+#  Developed by Sergey Trifonov and Michael Bouzinier, based on contributions by:
+#  Anwoy Kumar Mohanty, Andrew Bjonnes,
+#  Ignat Leshchiner, Shamil Sunyaev and other members of Division of Genetics,
+#  Brigham and Women's Hospital
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import random
+import sys
+import time
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+# Functions of denovo2, which mark stages of Bayesian de novo calling
+DENOVO_STAGES = {
+    "AD_LibCollection.mineAD": "library lookup",
+    "RhoModel.create": "EM",
+    "EM_full": "EM",
+    "evalAF": "EM",
+    "PysamList.mineAD": "trio pileup",
+    "evalPP": "PP evaluation"
+}
+PROFILE_SAMPLE_RATE = 0.01
+
+
+def parse_region(region: str) -> Tuple:
+    '''
+    Parses chrom or chrom:start-end, positions are one-based, inclusive
+    '''
+    if not region:
+        return None
+    if ':' not in region:
+        return region, None, None
+    chromosome, interval = region.split(':', 1)
+    start, _, end = interval.partition('-')
+    return (chromosome, int(start.replace(',', '')) if start else None,
+            int(end.replace(',', '')) if end else None)
+
+
+def get_frame_name(code) -> str:
+    return getattr(code, "co_qualname", code.co_name)
+
+
+class Profile:
+    def __init__(self, profiler: "SamplingProfiler", root: str) -> None:
+        self.profiler = profiler
+        self.root = root
+
+    def __enter__(self):
+        self.profiler.start(self.root)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.profiler.stop()
+
+
+EXIT_CODE = Profile.__exit__.__code__
+
+
+class SamplingProfiler:
+    '''
+    Deterministic profiler, which is enabled only for a random sample
+    of records (or records in a region). Time is collected as stacks
+    rooted at the caller class (or a stage of Harness), with frames for
+    the stages of Bayesian de novo calling inserted above denovo2
+    functions. Output is in "folded stacks" format, understood by
+    flamegraph.pl and speedscope, values are in microseconds.
+    '''
+    def __init__(self, filename: str, rate: float = PROFILE_SAMPLE_RATE,
+                 region: str = None, seed: int = None) -> None:
+        self.filename = filename
+        self.rate = rate
+        self.region = parse_region(region)
+        self.random = random.Random(seed)
+        self.stacks = defaultdict(float)
+        self.stack = []
+        self.last = None
+        self.sampled = 0
+
+    def in_region(self, record) -> bool:
+        if not self.region:
+            return True
+        chromosome, start, end = self.region
+        if record.CHROM != chromosome:
+            return False
+        if start is not None and record.POS < start:
+            return False
+        if end is not None and record.POS > end:
+            return False
+        return True
+
+    def sample_block(self, block: List) -> bool:
+        '''
+        Tells if a block of records (processed together) is profiled.
+        Blocks are sampled with the given rate, a block is a candidate
+        if any of its records is in the region
+        '''
+        if not any(self.in_region(record) for record in block):
+            return False
+        if self.rate >= 1 or self.random.random() < self.rate:
+            self.sampled += len(block)
+            return True
+        return False
+
+    def profile(self, root: str) -> Profile:
+        return Profile(self, root)
+
+    def start(self, root: str):
+        self.stack = [root]
+        self.last = time.perf_counter()
+        sys.setprofile(self.trace)
+
+    def stop(self):
+        sys.setprofile(None)
+        self.add_time(time.perf_counter())
+        self.stack = []
+
+    def add_time(self, now: float):
+        self.stacks[tuple(self.stack)] += now - self.last
+        self.last = now
+
+    def trace(self, frame, event, arg):
+        now = time.perf_counter()
+        self.add_time(now)
+        if event == "call" and frame.f_code is EXIT_CODE:
+            # End of the profiled block
+            sys.setprofile(None)
+        elif event == "call":
+            name = get_frame_name(frame.f_code)
+            stage = DENOVO_STAGES.get(name)
+            if stage and "[{}]".format(stage) not in self.stack:
+                self.stack.append("[{}]".format(stage))
+            self.stack.append(name)
+        elif event == "c_call":
+            self.stack.append(getattr(arg, "__qualname__",
+                                      getattr(arg, "__name__", "?")))
+        elif event in ("return", "c_return", "c_exception"):
+            # The frame of start() returns without being entered
+            if len(self.stack) > 1:
+                self.stack.pop()
+                if len(self.stack) > 1 and self.stack[-1].startswith('[') \
+                        and event == "return" and \
+                        DENOVO_STAGES.get(get_frame_name(frame.f_code)):
+                    self.stack.pop()
+        self.last = time.perf_counter()
+
+    def summary(self) -> Dict:
+        '''
+        Total time (seconds) by roots (callers) and by stages
+        '''
+        roots = defaultdict(float)
+        stages = defaultdict(float)
+        for stack, seconds in self.stacks.items():
+            roots[stack[0]] += seconds
+            for frame in stack:
+                if frame.startswith('['):
+                    stages[frame[1:-1]] += seconds
+        return {"roots": dict(roots), "stages": dict(stages)}
+
+    def write(self):
+        with open(self.filename, "w") as f:
+            for stack, seconds in sorted(self.stacks.items()):
+                value = int(round(seconds * 1e6))
+                if value > 0:
+                    f.write("{} {:d}\n".format(
+                        ';'.join(frame.replace(';', ',').replace(' ', '_')
+                                 for frame in stack), value))
+        summary = self.summary()
+        print("Profiled {:d} records, folded stacks are written to {}".
+              format(self.sampled, self.filename))
+        for name in ("roots", "stages"):
+            for key, seconds in sorted(summary[name].items(),
+                                       key=lambda x: -x[1]):
+                print("    {:<40} {:10.3f} sec".format(key, seconds))
@@ -0,0 +1,86 @@
+#  Copyright (c) 2019. Partners HealthCare, Harvard Medical School’s
+#  Department of Biomedical Informatics
+#
+#  Developed by Sergey Trifonov and Michael Bouzinier, based on contributions by:
+#  Anwoy Kumar Mohanty, Andrew Bjonnes,
+#  Ignat Leshchiner, Shamil Sunyaev and other members of Division of Genetics,
+#  Brigham and Women's Hospital
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+from typing import List, Tuple
+
+
+def read_bed(bed_file: str) -> List[Tuple]:
+    '''
+    Reads intervals (chromosome, start, end) of a BED file, coordinates
+    are zero-based, half-open
+    '''
+    intervals = []
+    with open(bed_file) as bed:
+        for line in bed:
+            if not line.strip() or line.startswith(('#', "track", "browser")):
+                continue
+            fields = line.split('\t') if '\t' in line else line.split()
+            intervals.append((fields[0], int(fields[1]), int(fields[2])))
+    return intervals
+
+
+def match_contig(chromosome: str, contigs: set) -> str:
+    '''
+    Name of the contig in the VCF, allowing for "chr" prefix mismatch
+    '''
+    if chromosome in contigs:
+        return chromosome
+    if chromosome.startswith("chr") and chromosome[3:] in contigs:
+        return chromosome[3:]
+    if "chr" + chromosome in contigs:
+        return "chr" + chromosome
+    return None
+
+
+def merge_intervals(intervals: List[Tuple], contigs: List[str]) -> List[Tuple]:
+    '''
+    Sorts intervals in the order of contigs (of the VCF index) and merges
+    overlapping and adjacent ones, so that every record is fetched once.
+    Intervals on contigs, which are not in the list, are dropped
+    '''
+    order = {contig: i for i, contig in enumerate(contigs)}
+    located = []
+    dropped = set()
+    for chromosome, start, end in intervals:
+        contig = match_contig(chromosome, order.keys())
+        if contig is None:
+            dropped.add(chromosome)
+            continue
+        if end > start:
+            located.append((order[contig], start, end, contig))
+    if dropped:
+        print("Warning: contigs {} are not in the VCF index, their intervals "
+              "are skipped".format(', '.join(sorted(dropped))))
+    merged = []
+    for _, start, end, contig in sorted(located):
+        if merged and merged[-1][0] == contig and start <= merged[-1][2]:
+            if end > merged[-1][2]:
+                merged[-1] = (contig, merged[-1][1], end)
+            continue
+        merged.append((contig, start, end))
+    return merged
+
+
+def format_interval(interval: Tuple) -> str:
+    chromosome, start, end = interval
+    if start is None and end is None:
+        return chromosome
+    return "{}:{}-{}".format(chromosome, start + 1 if start is not None
+                             else 1, end if end is not None else "")
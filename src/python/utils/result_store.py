@@ -0,0 +1,146 @@
+#  Copyright (c) 2019. Partners HealthCare, Harvard Medical School’s
+#  Department of Biomedical Informatics
+#
+#  Developed by Sergey Trifonov and Michael Bouzinier, based on contributions by:
+#  Anwoy Kumar Mohanty, Andrew Bjonnes,
+#  Ignat Leshchiner, Shamil Sunyaev and other members of Division of Genetics,
+#  Brigham and Women's Hospital
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import hashlib
+import json
+import os
+import re
+from typing import Dict, List, Tuple, Iterator
+
+import pysam
+
+from utils.regions import format_interval
+from utils.tsv import format_calls, iterate_calls
+
+STORE_VERSION = 1
+# Characters not allowed in names of files of the store
+NAME_PATTERN = re.compile(r"[^0-9A-Za-z_.-]")
+
+
+def get_hash(data) -> str:
+    return hashlib.sha1(json.dumps(data, sort_keys=True).encode()).hexdigest()
+
+
+def overlaps(region: Tuple, other: Tuple) -> bool:
+    chromosome, start, end = region
+    if chromosome != other[0]:
+        return False
+    return (start is None or other[2] is None or start < other[2]) and \
+        (end is None or other[1] is None or other[1] < end)
+
+
+class ResultStore:
+    '''
+    Persistent store of calls of families by shard of the input VCF.
+    Every family has a directory with a calls file per configuration of
+    callers and shard, the first line of which holds the key of the
+    entry: hash of the pedigree, hash of the configuration of callers
+    and fingerprint of the shard of the input VCF for the family (see
+    get_fingerprints() of callers.incremental). An entry is only used
+    if all of them match
+    '''
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def get_family_dir(self, name: str) -> str:
+        return os.path.join(self.directory, NAME_PATTERN.sub('_', name))
+
+    def get_file(self, name: str, key: Dict) -> str:
+        return os.path.join(self.get_family_dir(name), key["config"][:16],
+                            NAME_PATTERN.sub('_', key["shard"]) + ".tsv")
+
+    @staticmethod
+    def read_entry(path: str) -> Dict:
+        try:
+            with open(path) as f:
+                line = f.readline()
+        except FileNotFoundError:
+            return None
+        if not line.startswith("## "):
+            return None
+        try:
+            return json.loads(line[3:])
+        except ValueError:
+            return None
+
+    def get(self, name: str, key: Dict) -> Dict:
+        '''
+        Entry of the family for the shard, if its key matches
+        '''
+        entry = self.read_entry(self.get_file(name, key))
+        if entry is None or entry["key"] != key:
+            return None
+        return entry
+
+    def put(self, name: str, key: Dict, regions: List[Tuple],
+            tags: List[str], calls: List[Tuple[Tuple, Dict]], records: int):
+        '''
+        Stores calls of the family in the shard: pairs of (chromosome, pos)
+        and values by tag, the number of records of the shard is kept
+        '''
+        entry = {
+            "key": key,
+            "regions": [list(region) for region in regions],
+            "records": records,
+            "calls": sum(len(values) for _, values in calls),
+            "variants_called": len(calls)
+        }
+        path = self.get_file(name, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", "w") as f:
+            f.write("## {}\n".format(json.dumps(entry)))
+            f.write("# CHROM\tPOS\t{}\n".format('\t'.join(tags)))
+            f.writelines(format_calls(k, values, tags) for k, values in calls)
+        os.replace(path + ".tmp", path)
+
+    def read_calls(self, name: str, key: Dict) -> Iterator[Tuple[str, int, Dict]]:
+        return iterate_calls(self.get_file(name, key))
+
+    def invalidate(self, regions: List[Tuple]) -> int:
+        '''
+        Removes entries of all families for shards overlapping any of
+        the regions. Returns the number of removed entries
+        '''
+        removed = 0
+        for directory, _, file_names in os.walk(self.directory):
+            for file_name in file_names:
+                if not file_name.endswith(".tsv"):
+                    continue
+                path = os.path.join(directory, file_name)
+                entry = self.read_entry(path)
+                if entry is None:
+                    continue
+                if any(overlaps(tuple(stored), region)
+                       for stored in entry["regions"] for region in regions):
+                    os.remove(path)
+                    removed += 1
+        return removed
+
+
+def make_key(shard: str, family_hash: str, config_hash: str,
+             fingerprint: str) -> Dict:
+    return {
+        "version": STORE_VERSION,
+        "shard": shard,
+        "family": family_hash,
+        "config": config_hash,
+        "fingerprint": fingerprint
+    }
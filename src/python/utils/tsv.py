@@ -17,13 +17,23 @@
 #  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
+import os
+import pickle
+import queue
+import tempfile
+import threading
+from collections import OrderedDict
 from functools import total_ordering
-from typing import Collection, List, Dict
+from typing import Collection, List, Dict, Iterator, Tuple, Callable
 
 import sortedcontainers
 
 from utils.case_utils import get_trios_for_family
 
+# Calls kept in memory by CallBuffer before they are spilled to disk
+SPILL_LIMIT = 100000
+SPILL_CHUNK = 4096
+
 
 @total_ordering
 class Pos:
@@ -124,3 +134,214 @@ def create_tsv_reader(families:List,
     return TSVReader(tsv_calls_file, format_string, samples)
 
 
+def iterate_calls(tsv_calls_file:str) -> Iterator[Tuple[str, int, Dict]]:
+    '''
+    Reads calls file, written by Harness. Yields chromosome, position and
+    a dictionary of values by tag, missing values ('.') are skipped
+    '''
+    tags = []
+    with open(tsv_calls_file) as calls:
+        for line in calls:
+            if line.startswith('#'):
+                tags = line[1:].split()[2:]
+                continue
+            data = line.rstrip('\n').split('\t')
+            values = {tag: v for tag, v in zip(tags, data[2:]) if v != '.'}
+            yield data[0], int(data[1]), values
+
+
+def format_calls(key: Tuple, values: Dict, tags: List[str]) -> str:
+    '''
+    Line of calls file: chromosome, position and values of the tags,
+    flags (None) are written as 1, missing values as '.'
+    '''
+    fields = [str(k) for k in key]
+    for tag in tags:
+        if tag not in values:
+            fields.append('.')
+        elif values[tag] is None:
+            # Flag
+            fields.append("1")
+        else:
+            fields.append(values[tag])
+    return '\t'.join(fields) + '\n'
+
+
+class CallsWriter:
+    '''
+    Appends calls to the calls file in a background thread, so that
+    formatting and file I/O overlap with calling. Batches of calls are
+    passed through a bounded queue, the file is kept open. Errors of
+    the writer are raised in the calling thread by the next operation.
+    '''
+    QUEUE_SIZE = 16
+    BUFFER_SIZE = 1 << 20
+
+    def __init__(self, tsv_calls_file: str, tags: List[str]) -> None:
+        self.tags = list(tags)
+        self.output = open(tsv_calls_file, "a", buffering=self.BUFFER_SIZE)
+        self.queue = queue.Queue(self.QUEUE_SIZE)
+        self.error = None
+        self.thread = threading.Thread(target=self.run, daemon=True,
+                                       name="calls-writer")
+        self.thread.start()
+
+    def format(self, key: Tuple, values: Dict) -> str:
+        return format_calls(key, values, self.tags)
+
+    def run(self):
+        while True:
+            task, data = self.queue.get()
+            try:
+                if task == "close":
+                    return
+                if self.error is not None:
+                    continue
+                if task == "calls":
+                    self.output.write(''.join(self.format(key, values)
+                                              for key, values in data))
+                elif task == "callback":
+                    # Called when all preceding calls are in the file
+                    self.output.flush()
+                    data(os.fstat(self.output.fileno()).st_size)
+            except Exception as e:
+                self.error = e
+            finally:
+                self.queue.task_done()
+
+    def check(self):
+        if self.error is not None:
+            raise self.error
+
+    def write(self, calls: List[Tuple[Tuple, Dict]]):
+        '''
+        Queues calls: pairs of (chromosome, pos) and values by tag,
+        values are strings or None for flags
+        '''
+        self.check()
+        self.queue.put(("calls", calls))
+
+    def callback(self, function: Callable[[int], None]):
+        '''
+        Queues function to be called with the size of the file after all
+        calls queued before are written
+        '''
+        self.check()
+        self.queue.put(("callback", function))
+
+    def close(self):
+        self.queue.put(("close", None))
+        self.thread.join()
+        self.output.close()
+        self.check()
+
+
+class CallBuffer:
+    '''
+    Calls by (chromosome, pos) in the order they are added, as in
+    OrderedDict, in bounded memory: when more than limit calls are
+    buffered, they are spilled to a temporary file as a run. Runs are
+    streamed back in order by items(); as positions are added in
+    the order of the VCF, a position can only be repeated at the border
+    of two runs, then the later value replaces the earlier one. Runs are
+    named files, so that they can be passed to another process by
+    detach() and adopt()
+    '''
+    def __init__(self, limit: int = SPILL_LIMIT, directory: str = None) -> None:
+        self.limit = limit
+        self.directory = directory
+        self.memory = OrderedDict()
+        self.runs = []
+        self.spilled = 0
+
+    def __setitem__(self, key: Tuple, values: Dict):
+        self.memory[key] = values
+        if self.limit and len(self.memory) > self.limit:
+            self.spill()
+
+    def __len__(self) -> int:
+        return self.spilled + len(self.memory)
+
+    def spill(self):
+        run = tempfile.NamedTemporaryFile(prefix="calls-", dir=self.directory,
+                                          delete=False)
+        items = list(self.memory.items())
+        for i in range(0, len(items), SPILL_CHUNK):
+            pickle.dump(items[i:i + SPILL_CHUNK], run,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        self.runs.append(run)
+        self.spilled += len(items)
+        self.memory = OrderedDict()
+
+    def read_run(self, run) -> Iterator[Tuple[Tuple, Dict]]:
+        run.seek(0)
+        while True:
+            try:
+                yield from pickle.load(run)
+            except EOFError:
+                return
+
+    def items(self) -> Iterator[Tuple[Tuple, Dict]]:
+        previous = None
+        for run in self.runs:
+            for item in self.read_run(run):
+                if previous is not None and previous[0] != item[0]:
+                    yield previous
+                previous = item
+        for item in self.memory.items():
+            if previous is not None and previous[0] != item[0]:
+                yield previous
+            previous = item
+        if previous is not None:
+            yield previous
+
+    def batches(self, size: int = SPILL_CHUNK) -> Iterator[List]:
+        batch = []
+        for item in self.items():
+            batch.append(item)
+            if len(batch) >= size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def detach(self) -> Tuple[List[str], int]:
+        '''
+        Spills all calls and gives up their runs: returns the names of
+        the run files, in order, and the number of calls in them.
+        The buffer is left empty
+        '''
+        if self.memory:
+            self.spill()
+        paths = []
+        for run in self.runs:
+            run.close()
+            paths.append(run.name)
+        n = self.spilled
+        self.runs = []
+        self.spilled = 0
+        return paths, n
+
+    def adopt(self, paths: List[str], n: int):
+        '''
+        Appends runs detached from another buffer, with n calls in them,
+        after the calls of this buffer. The run files are removed
+        by clear()
+        '''
+        if self.memory:
+            self.spill()
+        for path in paths:
+            self.runs.append(open(path, "rb"))
+        self.spilled += n
+
+    def clear(self):
+        for run in self.runs:
+            run.close()
+            os.remove(run.name)
+        self.runs = []
+        self.spilled = 0
+        self.memory = OrderedDict()
+
+    def __del__(self):
+        # Runs, which are not detached, are temporary
+        self.clear()
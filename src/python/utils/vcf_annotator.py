@@ -0,0 +1,396 @@
+#  Copyright (c) 2019. Partners HealthCare, Harvard Medical School’s
+#  Department of Biomedical Informatics
+#
+#  Developed by Sergey Trifonov and Michael Bouzinier, based on contributions by:
+#  Anwoy Kumar Mohanty, Andrew Bjonnes,
+#  Ignat Leshchiner, Shamil Sunyaev and other members of Division of Genetics,
+#  Brigham and Women's Hospital
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import gzip
+import io
+import os
+import re
+import sys
+from typing import List, Dict, Iterable, Collection, Set, Tuple
+
+import pysam
+
+from utils.bgzf import BGZFWriter, BGZFReader, TBI_SHIFT, get_data_size, \
+    decompress_block, is_bgzf, read_tabix_index
+
+ID_PATTERN = re.compile(r"ID=([^,>]+)")
+
+
+class BCFText:
+    '''
+    Lines of a BCF file formatted as VCF text by htslib
+    '''
+    def __init__(self, filename: str) -> None:
+        self.variant_file = pysam.VariantFile(filename)
+
+    def __iter__(self):
+        yield from str(self.variant_file.header).splitlines(keepends=True)
+        for record in self.variant_file:
+            yield str(record)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.variant_file.close()
+
+
+def open_vcf_text(filename: str):
+    if filename.endswith(".bcf"):
+        return BCFText(filename)
+    if filename.endswith("gz"):
+        return gzip.open(filename, "rt", encoding="utf-8",
+                         errors="surrogateescape")
+    return open(filename, encoding="utf-8", errors="surrogateescape")
+
+
+def open_output(filename: str, threads: int = 2):
+    if filename == "-":
+        # Standard output by its descriptor, also if sys.stdout is
+        # redirected to keep messages out of the VCF
+        return io.TextIOWrapper(
+            os.fdopen(os.dup(sys.__stdout__.fileno()), "wb"),
+            encoding="utf-8", errors="surrogateescape")
+    if filename.endswith("gz"):
+        return BGZFWriter(filename, threads=threads)
+    return open(filename, "w", encoding="utf-8", errors="surrogateescape")
+
+
+def get_header_id(line: str) -> str:
+    match = ID_PATTERN.search(line)
+    return match.group(1) if match else None
+
+
+class VCFAnnotator:
+    '''
+    Adds INFO tags with calls to the records of a VCF file in a single
+    sequential pass, replaces "bcftools annotate -c CHROM,POS,...".
+    Calls must come in the order of the VCF file. All records at a called
+    position are annotated, missing values are not written and existing
+    values of the same tags are replaced.
+    '''
+    def __init__(self, header_lines: List[str], tags: Collection = None,
+                 flags: Set = None) -> None:
+        self.header_lines = [line.rstrip('\n') for line in header_lines
+                             if line.strip()]
+        self.tags = set(tags) if tags is not None else None
+        self.flags = flags if flags else set()
+        self.annotated = 0
+        self.unmatched = 0
+        self.output = None
+
+    @classmethod
+    def from_header_file(cls, header_file: str, tags: Collection = None):
+        with open(header_file) as hdr:
+            return cls.from_header_lines(hdr.readlines(), tags)
+
+    @classmethod
+    def from_header_lines(cls, lines: List[str], tags: Collection = None):
+        flags = {get_header_id(line) for line in lines
+                 if line.startswith("##INFO=") and "Type=Flag" in line}
+        return VCFAnnotator(lines, tags, flags)
+
+    def format_info(self, info: str, values: Dict) -> str:
+        entries = []
+        for tag, value in values.items():
+            if tag in self.flags:
+                if value != "0":
+                    entries.append(tag)
+            else:
+                entries.append("{}={}".format(tag, value))
+        if not entries:
+            return info
+        if info != '.':
+            entries = [entry for entry in info.split(';')
+                       if entry.split('=', 1)[0] not in values] + entries
+        return ';'.join(entries)
+
+    def annotate_line(self, line: str, values: Dict) -> str:
+        fields = line.split('\t', 8)
+        if len(fields) < 8:
+            return line
+        info = fields[7]
+        if len(fields) == 8:
+            eol = info[len(info.rstrip('\r\n')):]
+            info = info[:len(info) - len(eol)]
+            fields[7] = self.format_info(info, values) + eol
+        else:
+            fields[7] = self.format_info(info, values)
+        return '\t'.join(fields)
+
+    def write_header(self, output, existing: Set):
+        for line in self.header_lines:
+            if line.startswith("##INFO=") and get_header_id(line) in existing:
+                continue
+            output.write(line + '\n')
+
+    def write_input_header(self, output, header: List[str]) -> Set:
+        '''
+        Writes header of the input VCF with the lines for new tags
+        inserted before #CHROM line, returns the contigs declared
+        in the header
+        '''
+        existing = set()
+        contigs = set()
+        for line in header:
+            if line.startswith("##INFO="):
+                existing.add(get_header_id(line))
+            elif line.startswith("##contig="):
+                contigs.add(get_header_id(line))
+            elif line.startswith("#CHROM"):
+                self.write_header(output, existing)
+            output.write(line)
+        return contigs
+
+    def select(self, values: Dict) -> Dict:
+        if self.tags is None:
+            return values
+        return {tag: v for tag, v in values.items() if tag in self.tags}
+
+    def open(self, input_vcf: str, output_file: str, threads: int = 2,
+             header: List[str] = None):
+        '''
+        Starts writing annotated copy of input VCF, records are then
+        passed one by one to write(). Header of the input is read from
+        the file, if not given
+        '''
+        if header is None:
+            header = []
+            with open_vcf_text(input_vcf) as vcf:
+                for line in vcf:
+                    if not line.startswith('#'):
+                        break
+                    header.append(line)
+                    if line.startswith("#CHROM"):
+                        break
+        self.output = open_output(output_file, threads)
+        self.write_input_header(self.output, header)
+
+    def write(self, line: str, values: Dict = None):
+        if values:
+            values = self.select(values)
+        if values:
+            line = self.annotate_line(line, values)
+            self.annotated += 1
+        self.output.write(line + '\n')
+
+    def close(self):
+        if self.output is not None:
+            self.output.close()
+            self.output = None
+
+    def annotate(self, input_vcf: str, output_file: str,
+                 calls: Iterable, threads: int = 2):
+        calls = iter(calls)
+        pending = next(calls, None)
+        matched = False
+        contigs = set()
+        header = []
+        passed = set()
+        current = None
+        with open_vcf_text(input_vcf) as vcf, \
+                open_output(output_file, threads) as output:
+            for line in vcf:
+                if line.startswith('#'):
+                    header.append(line)
+                    if line.startswith("#CHROM"):
+                        contigs = self.write_input_header(output, header)
+                    continue
+                if not line.strip():
+                    output.write(line)
+                    continue
+                chromosome, pos, _ = line.split('\t', 2)
+                pos = int(pos)
+                if chromosome != current:
+                    if current is not None:
+                        passed.add(current)
+                    current = chromosome
+                # Skip calls, which are behind the current record or
+                # refer to contigs not present in the VCF
+                while pending is not None:
+                    c, p, _ = pending
+                    if c in passed or (c == chromosome and p < pos) or \
+                            (contigs and c not in contigs):
+                        if not matched:
+                            self.unmatched += 1
+                        pending = next(calls, None)
+                        matched = False
+                        continue
+                    break
+                if pending is not None and pending[0] == chromosome \
+                        and pending[1] == pos:
+                    values = self.select(pending[2])
+                    if values:
+                        line = self.annotate_line(line, values)
+                        self.annotated += 1
+                    matched = True
+                output.write(line)
+        if pending is not None:
+            if not matched:
+                self.unmatched += 1
+            self.unmatched += sum(1 for _ in calls)
+        return self.annotated
+
+
+class BlockAnnotator(VCFAnnotator):
+    '''
+    Annotates a BGZF-compressed and tabix-indexed VCF, copying compressed
+    blocks, which do not contain called records, as they are. Records
+    are located with the linear index, only blocks with the header and
+    with called records are decompressed and compressed again.
+    The index of the output should be rebuilt afterwards.
+    '''
+    def __init__(self, header_lines: List[str], tags: Collection = None,
+                 flags: Set = None) -> None:
+        super().__init__(header_lines, tags, flags)
+        # offset of a block -> [(offset in block, length, new text)]
+        self.edits = dict()
+        self.dirty = set()
+
+    @staticmethod
+    def can_annotate(input_vcf: str, output_file: str) -> bool:
+        return (output_file.endswith("gz") and input_vcf.endswith("gz")
+                and os.path.exists(input_vcf + ".tbi") and is_bgzf(input_vcf))
+
+    @classmethod
+    def from_header_file(cls, header_file: str, tags: Collection = None):
+        annotator = VCFAnnotator.from_header_file(header_file, tags)
+        return BlockAnnotator(annotator.header_lines, annotator.tags,
+                              annotator.flags)
+
+    @staticmethod
+    def lines(reader: BGZFReader, offset: int, position: int):
+        '''
+        Iterates over lines starting from a virtual offset, yields
+        (offset of the block, offset in the block), the line and the list
+        of offsets of all blocks, which the line spans
+        '''
+        data, next_offset = reader.read_data(offset)
+        parts = []
+        blocks = []
+        while data is not None:
+            if position >= len(data) and not parts:
+                offset, position = next_offset, 0
+                data, next_offset = reader.read_data(offset)
+                continue
+            if not parts:
+                start = (offset, position)
+            end = data.find(b'\n', position)
+            blocks.append(offset)
+            if end < 0:
+                parts.append(data[position:])
+                offset, position = next_offset, 0
+                data, next_offset = reader.read_data(offset)
+                continue
+            parts.append(data[position:end + 1])
+            yield start, b''.join(parts), blocks
+            parts = []
+            blocks = []
+            position = end + 1
+        if parts:
+            yield start, b''.join(parts), blocks
+
+    def add_edit(self, start: Tuple, length: int, text: bytes, blocks: List):
+        self.edits.setdefault(start[0], []).append((start[1], length, text))
+        self.dirty.update(blocks)
+
+    def edit_header(self, reader: BGZFReader):
+        existing = set()
+        for start, line, blocks in self.lines(reader, 0, 0):
+            if line.startswith(b"##INFO="):
+                existing.add(get_header_id(line.decode()))
+            elif line.startswith(b"#CHROM"):
+                header = io.StringIO()
+                self.write_header(header, existing)
+                self.add_edit(start, 0, header.getvalue().encode(),
+                              blocks[:1])
+                return
+            elif not line.startswith(b'#'):
+                break
+        raise ValueError("No #CHROM line in the VCF header")
+
+    def locate(self, reader: BGZFReader, input_vcf: str, calls: Iterable):
+        index = read_tabix_index(input_vcf + ".tbi")
+        lines = None
+        current = None
+        cursor = None
+        for chromosome, pos, values in calls:
+            values = self.select(values)
+            if not values:
+                continue
+            linear = index.get(chromosome)
+            if linear is None:
+                self.unmatched += 1
+                continue
+            w = min((pos - 1) >> TBI_SHIFT, len(linear) - 1)
+            target = (linear[w] >> 16, linear[w] & 0xffff)
+            if chromosome != current or cursor is None or cursor[0] < target:
+                lines = self.lines(reader, *target)
+                cursor = next(lines, None)
+            current = chromosome
+            matched = False
+            while cursor is not None:
+                start, line, blocks = cursor
+                fields = line.split(b'\t', 2)
+                if fields[0].decode() != chromosome or int(fields[1]) > pos:
+                    break
+                if int(fields[1]) == pos:
+                    text = line.decode("utf-8", "surrogateescape")
+                    text = self.annotate_line(text, values)
+                    self.add_edit(start, len(line),
+                                  text.encode("utf-8", "surrogateescape"),
+                                  blocks)
+                    self.annotated += 1
+                    matched = True
+                cursor = next(lines, None)
+            if not matched:
+                self.unmatched += 1
+
+    def write_blocks(self, output: BGZFWriter, blocks: List[Tuple]):
+        data = bytearray()
+        edits = []
+        for offset, block in blocks:
+            for position, length, text in self.edits.get(offset, []):
+                edits.append((len(data) + position, length, text))
+            data += decompress_block(block)
+        for position, length, text in sorted(edits, reverse=True):
+            data[position:position + length] = text
+        output.write(bytes(data))
+        output.flush()
+
+    def annotate(self, input_vcf: str, output_file: str,
+                 calls: Iterable, threads: int = 2):
+        with BGZFReader(input_vcf) as reader:
+            self.edit_header(reader)
+            self.locate(reader, input_vcf, calls)
+            with BGZFWriter(output_file, threads) as output:
+                dirty = []
+                for offset, block in reader.blocks():
+                    if offset in self.dirty:
+                        dirty.append((offset, block))
+                        continue
+                    if dirty:
+                        self.write_blocks(output, dirty)
+                        dirty = []
+                    if get_data_size(block) > 0:
+                        output.write_block(block)
+                if dirty:
+                    self.write_blocks(output, dirty)
+        return self.annotated
@@ -18,33 +18,822 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 
-from typing import List
+import gzip
+import io
+import os
+import re
+import sys
+from typing import List, Collection, Callable, Dict, Tuple
+
+import numpy as np
+import pysam
+from vcf.model import allele_delimiter
 from vcf.parser import Reader
 
+from utils.bgzf import TBI_SHIFT, BGZFLines, is_bgzf, read_tabix_index
 from utils.case_utils import parse_all_fam_files
 from utils.tsv import create_tsv_reader
 
 
-class JumpVCFReader(Reader):
+# GT and AD of every sample, when FORMAT starts with GT:AD
+GT_AD_PATTERN = re.compile(r"\t([^\t:]*):?([^\t:]*)")
+
+
+def find_info(info: str, key: str):
+    '''
+    Finds an entry in the text of INFO column without splitting it.
+    Returns the text of the value, True for a flag or None if the
+    key is not present
+    '''
+    n = len(info)
+    start = 0
+    while True:
+        idx = info.find(key, start)
+        if idx < 0:
+            return None
+        end = idx + len(key)
+        if (idx == 0 or info[idx - 1] == ';') and \
+                (end == n or info[end] in "=;"):
+            if end == n or info[end] == ';':
+                return True
+            stop = info.find(';', end)
+            if stop < 0:
+                stop = n
+            return info[end + 1:stop]
+        start = end
+
+
+class LazyCall:
+    '''
+    Genotype call of a single sample. Only GT and AD are decoded and
+    only when they are accessed. Mimics vcf.model._Call: data is the call
+    itself, so that both call.gt_type and call.data.AD work.
+    '''
+    __slots__ = ["sample", "text", "format", "fields", "_gt_type", "_ad"]
+    NOT_DECODED = object()
+
+    def __init__(self, sample: str, text: str, format) -> None:
+        self.sample = sample
+        self.text = text
+        self.format = format
+        self.fields = None
+        self._gt_type = self.NOT_DECODED
+        self._ad = self.NOT_DECODED
+
+    @property
+    def data(self):
+        return self
+
+    def _field(self, idx):
+        if idx is None:
+            return None
+        if self.fields is None:
+            self.fields = self.text.split(':')
+        if idx >= len(self.fields):
+            return None
+        return self.fields[idx]
+
+    @property
+    def gt_type(self):
+        if self._gt_type is self.NOT_DECODED:
+            self._gt_type = self.format.decode_gt(self._field(self.format.gt))
+        return self._gt_type
+
+    @property
+    def AD(self):
+        if self._ad is self.NOT_DECODED:
+            self._ad = self.format.decode_ad(self._field(self.format.ad))
+        return self._ad
+
+
+class LazyFormat:
+    '''
+    Positions of GT and AD in a FORMAT string of a VCF file
+    '''
+    gt_types = dict()
+    gt_codes = dict()
+
+    def __init__(self, reader: Reader, fmt: str) -> None:
+        fields = fmt.split(':') if fmt else []
+        self.gt = fields.index("GT") if "GT" in fields else None
+        self.ad = fields.index("AD") if "AD" in fields else None
+        self.reader = reader
+        ad_format = reader.formats.get("AD")
+        self.ad_is_list = not (ad_format and ad_format.num == 1)
+
+    @classmethod
+    def decode_gt(cls, gt: str):
+        if gt is None:
+            return None
+        gt_type = cls.gt_types.get(gt, LazyCall.NOT_DECODED)
+        if gt_type is LazyCall.NOT_DECODED:
+            gt_type = cls._decode_gt(gt)
+            cls.gt_types[gt] = gt_type
+        return gt_type
+
+    @staticmethod
+    def _decode_gt(gt: str):
+        # Same as vcf.model._Call.gt_type
+        alleles = [(al if al != '.' else None)
+                   for al in allele_delimiter.split(gt)]
+        if not any(al is not None for al in alleles):
+            return None
+        if all(al == alleles[0] for al in alleles[1:]):
+            if alleles[0] == "0":
+                return 0
+            return 2
+        return 1
+
+    def decode_ad(self, ad: str):
+        if not ad or ad == '.':
+            return None
+        if not self.ad_is_list:
+            try:
+                return int(ad)
+            except ValueError:
+                return float(ad)
+        values = ad.split(',')
+        try:
+            return [int(v) for v in values]
+        except ValueError:
+            pass
+        try:
+            return self.reader._map(int, values)
+        except ValueError:
+            return self.reader._map(float, values)
+
+    @classmethod
+    def decode_gt_array(cls, gts: List) -> np.ndarray:
+        '''
+        Genotype types of many samples, -1 stands for no call
+        '''
+        codes = cls.gt_codes
+        for gt in set(gts) - codes.keys():
+            gt_type = cls.decode_gt(gt)
+            codes[gt] = -1 if gt_type is None else gt_type
+        return np.fromiter(map(codes.__getitem__, gts), dtype=np.int8,
+                           count=len(gts))
+
+    def decode_ad_array(self, ads: List, n_alleles: int):
+        '''
+        Reference and alternative depths of many samples and a mask
+        of samples having AD. Returns None if some AD could not be
+        represented by integers (missing or fractional values)
+        '''
+        n = len(ads)
+        ref = np.zeros(n, dtype=np.int64)
+        alt = np.zeros(n, dtype=np.int64)
+        has_ad = np.zeros(n, dtype=bool)
+        if self.ad is None or not self.ad_is_list:
+            return ref, alt, has_ad
+        texts = np.array(ads)
+        missing = (texts == '.') | (texts == '')
+        if missing.any():
+            texts = np.where(missing, ','.join(['0'] * n_alleles), texts)
+        # Every sample must have a depth for each allele, so that
+        # the values of a sample make a row
+        if (np.char.count(texts, ',') == n_alleles - 1).all():
+            joined = ','.join(texts.tolist())
+        else:
+            joined = '.'
+        if '.' not in joined:
+            values = np.fromstring(joined, dtype=np.int64, sep=',')
+            if len(values) == n * n_alleles:
+                values = values.reshape(n, n_alleles)
+                ref[:] = values[:, 0]
+                alt[:] = values[:, 1:].sum(axis=1)
+                has_ad[:] = ~missing
+                return ref, alt, has_ad
+        for i, text in enumerate(ads):
+            ad = self.decode_ad(text)
+            if not ad:
+                continue
+            if not all(isinstance(v, int) for v in ad):
+                return None
+            ref[i] = ad[0]
+            alt[i] = sum(ad[1:])
+            has_ad[i] = True
+        return ref, alt, has_ad
+
+    def decode(self, text: str):
+        fields = text.split(':')
+        n = len(fields)
+        gt = self.decode_gt(fields[self.gt]) \
+            if self.gt is not None and self.gt < n else None
+        ad = self.decode_ad(fields[self.ad]) \
+            if self.ad is not None and self.ad < n else None
+        return gt, ad
+
+
+class LazyRecord:
+    '''
+    VCF record, which keeps the text of the line and decodes
+    ALT, INFO and sample calls only when a caller accesses them.
+    Calls are available only for the samples selected by
+    LazyVCFReader.set_samples(), INFO contains only the keys selected by
+    LazyVCFReader.set_info_keys()
+    '''
+    # Lines rejected by prescreen right before the record
+    skipped = 0
+
+    def __init__(self, reader: "LazyVCFReader", row: List,
+                 line: str = None) -> None:
+        self.reader = reader
+        self.row = row
+        self.line = line
+        chrom = row[0]
+        if reader._prepend_chr:
+            chrom = "chr" + chrom
+        self.CHROM = chrom
+        self.POS = int(row[1])
+        self.ID = row[2] if row[2] != '.' else None
+        self.REF = row[3]
+        self._alt = None
+        self._info = None
+        self._sample_columns = None
+        self._format = None
+        self._calls = dict()
+
+    @property
+    def ALT(self):
+        if self._alt is None:
+            self._alt = self.reader._map(self.reader._parse_alt,
+                                         self.row[4].split(','))
+        return self._alt
+
+    @property
+    def INFO(self):
+        if self._info is None:
+            if self.reader.info_keys is None:
+                self._info = self.reader._parse_info(self.row[7])
+            else:
+                self._info = self.reader.parse_info_keys(self.row[7])
+        return self._info
+
+    def _sample_text(self, sample: str) -> str:
+        if not self.reader.is_selected(sample):
+            raise KeyError(sample)
+        if self._sample_columns is None:
+            if len(self.row) < 10:
+                self._sample_columns = []
+            else:
+                self._sample_columns = self.reader._row_pattern.\
+                    split(self.row[9])
+        return self._sample_columns[self.reader._sample_indexes[sample]]
+
+    def get_format(self) -> LazyFormat:
+        if self._format is None:
+            self._format = self.reader.get_format(
+                self.row[8] if len(self.row) > 8 else None)
+        return self._format
+
+    def get_call(self, sample: str) -> LazyCall:
+        call = self._calls.get(sample)
+        if call is None:
+            call = LazyCall(sample, self._sample_text(sample),
+                            self.get_format())
+            self._calls[sample] = call
+        return call
+
+    def get_gt_ad(self, sample: str):
+        return self.get_format().decode(self._sample_text(sample))
+
+    def get_gt_ad_arrays(self):
+        '''
+        Decodes GT and AD of all selected samples at once. Returns
+        genotype types (-1 for no call), reference and alternative depths
+        and a mask of samples having AD, or None if the record can not
+        be decoded this way
+        '''
+        if len(self.row) < 10:
+            return None
+        fmt = self.get_format()
+        if fmt.gt == 0 and fmt.ad == 1:
+            pairs = GT_AD_PATTERN.findall('\t' + self.row[9])
+            gts = [pair[0] for pair in pairs]
+            ads = [pair[1] for pair in pairs]
+        else:
+            gts, ads = [], []
+            for text in self.reader._row_pattern.split(self.row[9]):
+                fields = text.split(':')
+                n = len(fields)
+                gts.append(fields[fmt.gt]
+                           if fmt.gt is not None and fmt.gt < n else '.')
+                ads.append(fields[fmt.ad]
+                           if fmt.ad is not None and fmt.ad < n else '.')
+        if len(gts) != len(self.reader.samples):
+            return None
+        if not self.reader.all_selected:
+            gts = [gts[i] for i in self.reader.selected_indices]
+            ads = [ads[i] for i in self.reader.selected_indices]
+        n_alleles = self.row[4].count(',') + 2
+        depths = fmt.decode_ad_array(ads, n_alleles)
+        if depths is None:
+            return None
+        return (fmt.decode_gt_array(gts),) + depths
+
+    @property
+    def samples(self) -> List[LazyCall]:
+        return [self.get_call(sample) for sample in self.reader.selected]
+
+
+class LazyGenotypes(dict):
+    '''
+    Maps sample to genotype, genotype is decoded when a sample
+    is looked up for the first time
+    '''
+    def __init__(self, record: LazyRecord, recall: Callable = None) -> None:
+        super().__init__()
+        self.record = record
+        self.recall = recall
+
+    def __missing__(self, sample):
+        gt, ad = self.record.get_gt_ad(sample)
+        if self.recall:
+            gt = self.recall(gt, ad)
+        self[sample] = gt
+        return gt
+
+
+class Prescreen:
+    '''
+    Check of raw VCF lines, done before records are constructed.
+    check(fields, calls) gets the fields of a line, split up to the last
+    sample of interest, and GT type and AD of these samples; it returns
+    the list of rules rejecting the line or None to accept it. Lines,
+    which can not be decoded, are accepted and counted as errors.
+    '''
+    def __init__(self, reader: "LazyVCFReader", samples: Collection,
+                 check: Callable[[List, Dict], List]) -> None:
+        self.reader = reader
+        self.check = check
+        self.columns = [(s, 9 + reader._sample_indexes[s]) for s in samples]
+        if self.columns:
+            self.maxsplit = max(c for _, c in self.columns) + 1
+        else:
+            self.maxsplit = 9
+        self.counts = dict()
+        self.accepted = 0
+        self.rejected = 0
+        self.errors = 0
+        self.error = None
+
+    def __call__(self, line: str) -> bool:
+        try:
+            fields = self.reader._row_pattern.split(line, self.maxsplit)
+            calls = dict()
+            if self.columns:
+                fmt = self.reader.get_format(
+                    fields[8] if len(fields) > 8 else None)
+                for sample, column in self.columns:
+                    calls[sample] = fmt.decode(fields[column])
+            rules = self.check(fields, calls)
+        except Exception as e:
+            self.errors += 1
+            if self.error is None:
+                self.error = "{}: {}".format(type(e).__name__, e)
+            rules = None
+        if not rules:
+            self.accepted += 1
+            return True
+        self.rejected += 1
+        for rule in rules:
+            self.counts[rule] = self.counts.get(rule, 0) + 1
+        return False
+
+
+class LazyVCFReader(Reader):
+    '''
+    VCF reader returning LazyRecord instead of fully parsed
+    vcf.model._Record. Sample columns are split only for records, where
+    a caller looks at the genotypes, and only GT and AD are decoded.
+    '''
+    def __init__(self, fsock=None, filename=None, compressed=None,
+                 prepend_chr=False, strict_whitespace=False,
+                 encoding='ascii', threads=1):
+        if threads > 0 and fsock is None and filename and is_bgzf(filename):
+            # Blocks are decompressed by a pool of threads ahead of parsing,
+            # with threads=0 by gzip module in the reading thread
+            fsock = BGZFLines(filename, threads, encoding)
+            compressed = False
+        super().__init__(fsock, filename, compressed, prepend_chr,
+                         strict_whitespace, encoding)
+        self.set_samples(self.samples)
+        self.info_keys = None
+        self.lazy_formats = dict()
+        self.prescreen = None
+        # Lines rejected by prescreen since the last record
+        self.skipped = 0
+
+    def set_samples(self, samples: Collection):
+        self.selected = [s for s in self.samples if s in samples]
+        self.selected_set = set(self.selected)
+        self.selected_indices = [self._sample_indexes[s]
+                                 for s in self.selected]
+        self.all_selected = len(self.selected) == len(self.samples)
+
+    def set_info_keys(self, keys: Collection):
+        self.info_keys = sorted(keys)
+
+    def parse_info_keys(self, info: str) -> Dict:
+        result = dict()
+        if info == '.':
+            return result
+        for key in self.info_keys:
+            value = find_info(info, key)
+            if value is None:
+                continue
+            if value is True:
+                result.update(self._parse_info(key))
+            else:
+                result.update(self._parse_info(key + '=' + value))
+        return result
+
+    def set_prescreen(self, prescreen: Prescreen):
+        '''
+        Lines rejected by prescreen are skipped
+        '''
+        self.prescreen = prescreen
+
+    def get_header_lines(self) -> List[str]:
+        '''
+        Header of the input as parsed, for input, which can not be
+        read again
+        '''
+        return [line + '\n' for line in self._header_lines] + \
+            ['#' + '\t'.join(self._column_headers + self.samples) + '\n']
+
+    def is_selected(self, sample: str) -> bool:
+        return sample in self.selected_set
+
+    def get_format(self, fmt: str) -> LazyFormat:
+        lazy_format = self.lazy_formats.get(fmt)
+        if lazy_format is None:
+            lazy_format = LazyFormat(self, fmt)
+            self.lazy_formats[fmt] = lazy_format
+        return lazy_format
+
+    def __next__(self):
+        line = next(self.reader).rstrip()
+        if self.prescreen is None:
+            return LazyRecord(self, self._row_pattern.split(line, 9), line)
+        while not self.prescreen(line):
+            self.skipped += 1
+            line = next(self.reader).rstrip()
+        record = LazyRecord(self, self._row_pattern.split(line, 9), line)
+        record.skipped = self.skipped
+        self.skipped = 0
+        return record
+
+
+class JumpVCFReader(LazyVCFReader):
+    '''
+    Reads only the records at the positions of candidate calls (sorted
+    list of tsv.Pos). Candidates are grouped into windows, which share
+    compressed blocks according to the linear tabix index (or are close,
+    if there is no .tbi): every window is fetched once and streamed,
+    so the number of seeks is bounded by the number of blocks with
+    candidates rather than by the number of candidates.
+    pos_in_call_set is the first candidate, which records may not have
+    been read yet
+    '''
+    # Compressed bytes, which are read through rather than seeking
+    MAX_GAP = 1 << 16
+
     def __init__(self, call_set: List, fsock=None, filename=None,
                  compressed=None, prepend_chr=False, strict_whitespace=False,
                  encoding='ascii'):
+        # Records are fetched with the index, the stream is only used
+        # for the header
         super().__init__(fsock, filename, compressed, prepend_chr,
-                         strict_whitespace, encoding)
+                         strict_whitespace, encoding, threads=0)
         self.call_set = call_set
         self.pos_in_call_set = 0
+        self.window_end = None
+        self.n_windows = 0
+        self.linear_index = None
+        if self.filename and os.path.exists(self.filename + ".tbi"):
+            self.linear_index = read_tabix_index(self.filename + ".tbi")
 
-    def jump(self):
-        if (self.pos_in_call_set >= len(self.call_set)):
+    def get_offset(self, call) -> int:
+        linear = self.linear_index.get(call.chromosome)
+        if not linear:
             return None
-        call = self.call_set[self.pos_in_call_set]
-        self.pos_in_call_set += 1
-        return self.fetch(call.chromosome, call.pos-1, call.pos)
+        w = min((call.pos - 1) >> TBI_SHIFT, len(linear) - 1)
+        # Offset of the compressed block
+        return linear[w] >> 16
+
+    def shares_blocks(self, call, next_call) -> bool:
+        if call.chromosome != next_call.chromosome:
+            return False
+        if self.linear_index is None:
+            return next_call.pos - call.pos <= 1 << TBI_SHIFT
+        offset = self.get_offset(call)
+        next_offset = self.get_offset(next_call)
+        if offset is None or next_offset is None:
+            return False
+        return next_offset - offset <= self.MAX_GAP
+
+    def jump(self) -> bool:
+        '''
+        Fetches the window starting at the current candidate
+        '''
+        while self.pos_in_call_set < len(self.call_set):
+            first = self.pos_in_call_set
+            last = first
+            while last + 1 < len(self.call_set) and self.shares_blocks(
+                    self.call_set[last], self.call_set[last + 1]):
+                last += 1
+            call = self.call_set[first]
+            try:
+                self.fetch(call.chromosome, call.pos - 1,
+                           self.call_set[last].pos)
+            except ValueError:
+                # Contig is not in the index
+                self.pos_in_call_set = last + 1
+                continue
+            self.window_end = last + 1
+            self.n_windows += 1
+            return True
+        return False
 
     def __next__(self):
-        me = self.jump()
-        _record = super().__next__()
-        return _record
+        while True:
+            if self.window_end is None and not self.jump():
+                raise StopIteration
+            try:
+                record = super().__next__()
+            except StopIteration:
+                # Candidates without records are skipped
+                self.pos_in_call_set = self.window_end
+                self.window_end = None
+                continue
+            while self.pos_in_call_set < self.window_end and \
+                    self.call_set[self.pos_in_call_set].pos < record.POS:
+                self.pos_in_call_set += 1
+            if self.pos_in_call_set >= self.window_end:
+                self.window_end = None
+                continue
+            # Records starting before the candidate, but overlapping it,
+            # are skipped
+            if self.call_set[self.pos_in_call_set].pos == record.POS:
+                return record
+
+
+def get_gt_type(alleles) -> int:
+    # Same as LazyFormat.decode_gt() for allele indices
+    if all(al is None for al in alleles):
+        return None
+    if all(al == alleles[0] for al in alleles[1:]):
+        if alleles[0] == 0:
+            return 0
+        return 2
+    return 1
+
+
+def get_info_value(value):
+    # htslib keeps floats in single precision, the shortest decimal
+    # representing it is the value as written in the VCF
+    if isinstance(value, float):
+        return float(str(np.float32(value)))
+    if isinstance(value, tuple):
+        return [get_info_value(v) for v in value]
+    return value
+
+
+def is_missing(values: Tuple) -> bool:
+    '''
+    Whether AD read by pysam is missing ('.'). Like LazyFormat.decode_ad(),
+    a list of missing values ('.,.') is kept and fails recalling genotypes
+    '''
+    return values == (None,)
+
+
+class PysamRecord(LazyRecord):
+    '''
+    Adapter of pysam.VariantRecord, exposing the same fields as
+    LazyRecord. GT and AD are read directly from htslib, the record
+    is formatted as text only if its line is needed
+    '''
+    def __init__(self, reader: "PysamVCFReader",
+                 record: pysam.VariantRecord, line: str = None) -> None:
+        self.reader = reader
+        self.record = record
+        self._line = line
+        chrom = record.chrom
+        if reader._prepend_chr:
+            chrom = "chr" + chrom
+        self.CHROM = chrom
+        self.POS = record.pos
+        self.ID = record.id
+        self.REF = record.ref
+        self._alt = None
+        self._info = None
+        self._text_record = None
+        self._calls = dict()
+
+    @property
+    def line(self) -> str:
+        if self._line is None:
+            self._line = str(self.record).rstrip('\n')
+        return self._line
+
+    @property
+    def row(self) -> List:
+        return self.get_text_record().row
+
+    def get_text_record(self) -> LazyRecord:
+        if self._text_record is None:
+            self._text_record = LazyRecord(
+                self.reader, self.reader._row_pattern.split(self.line, 9),
+                self.line)
+        return self._text_record
+
+    @property
+    def ALT(self):
+        if self._alt is None:
+            alts = self.record.alts
+            if alts is None:
+                self._alt = [None]
+            else:
+                self._alt = [self.reader._parse_alt(alt) for alt in alts]
+        return self._alt
+
+    @property
+    def INFO(self):
+        if self._info is None:
+            info = self.record.info
+            keys = self.reader.info_keys
+            if keys is None:
+                keys = list(info.keys())
+            self._info = dict()
+            for key in keys:
+                if key not in info:
+                    continue
+                self._info[key] = get_info_value(info[key])
+        return self._info
+
+    def get_call(self, sample: str) -> LazyCall:
+        call = self._calls.get(sample)
+        if call is None:
+            call = LazyCall(sample, None, None)
+            call._gt_type, call._ad = self.get_gt_ad(sample)
+            self._calls[sample] = call
+        return call
+
+    def get_gt_ad(self, sample: str):
+        if not self.reader.is_selected(sample):
+            raise KeyError(sample)
+        fmt = self.record.format
+        data = self.record.samples[sample]
+        gt = get_gt_type(data.allele_indices) if "GT" in fmt else None
+        ad = data["AD"] if "AD" in fmt else None
+        if isinstance(ad, tuple):
+            ad = None if is_missing(ad) else list(ad)
+        return gt, ad
+
+    def get_gt_ad_arrays(self):
+        '''
+        Same as LazyRecord.get_gt_ad_arrays(), from the allele indices
+        and AD of the selected samples
+        '''
+        fmt = self.record.format
+        has_gt = "GT" in fmt
+        has_ad = "AD" in fmt and self.reader.get_format("AD").ad_is_list
+        samples = self.record.samples
+        n = len(self.reader.selected)
+        alleles = []
+        ads = []
+        for index in self.reader.selected_indices:
+            data = samples[index]
+            if has_gt:
+                alleles.append(data.allele_indices)
+            if has_ad:
+                ads.append(data["AD"])
+        if has_gt:
+            codes = self.reader.allele_codes
+            for indices in set(alleles) - codes.keys():
+                gt_type = get_gt_type(indices)
+                codes[indices] = -1 if gt_type is None else gt_type
+            gt = np.fromiter(map(codes.__getitem__, alleles), dtype=np.int8,
+                             count=n)
+        else:
+            gt = np.full(n, -1, dtype=np.int8)
+        ref = np.zeros(n, dtype=np.int64)
+        alt = np.zeros(n, dtype=np.int64)
+        mask = np.zeros(n, dtype=bool)
+        if not has_ad:
+            return gt, ref, alt, mask
+        try:
+            values = np.array(ads)
+        except ValueError:
+            # Samples with different number of values
+            values = None
+        if values is not None and values.ndim == 2 and \
+                values.dtype.kind == 'i':
+            ref[:] = values[:, 0]
+            alt[:] = values[:, 1:].sum(axis=1)
+            mask[:] = True
+            return gt, ref, alt, mask
+        for i, ad in enumerate(ads):
+            if is_missing(ad):
+                continue
+            if not all(isinstance(v, int) for v in ad):
+                return None
+            ref[i] = ad[0]
+            alt[i] = sum(ad[1:])
+            mask[i] = True
+        return gt, ref, alt, mask
+
+
+class PysamVCFReader(LazyVCFReader):
+    '''
+    Reader backed by htslib (pysam.VariantFile): reads VCF, bgzipped VCF
+    and BCF, regions are fetched with the native index (.tbi or .csi).
+    The header is parsed by PyVCF, so that samples, contigs and types of
+    INFO values are the same as with LazyVCFReader; records are
+    PysamRecord adapters. Prescreen is not supported: raw lines are not
+    available without formatting every record
+    '''
+    def __init__(self, fsock=None, filename=None, compressed=None,
+                 prepend_chr=False, strict_whitespace=False,
+                 encoding='ascii', threads=1):
+        self.variant_file = pysam.VariantFile(filename, threads=threads)
+        # Genotype types by allele indices, -1 for no call
+        self.allele_codes = dict()
+        super().__init__(io.StringIO(str(self.variant_file.header)), None,
+                         False, prepend_chr, strict_whitespace, encoding)
+        self.filename = filename
+        self.iterator = iter(self.variant_file)
+
+    def fetch(self, chrom, start=None, end=None):
+        self.iterator = self.variant_file.fetch(chrom, start, end)
+        return self
+
+    def __next__(self):
+        return PysamRecord(self, next(self.iterator))
+
+
+class PysamJumpReader(JumpVCFReader, PysamVCFReader):
+    '''
+    JumpVCFReader over htslib
+    '''
+
+
+VCF_READERS = ("pyvcf", "pysam")
+# Name of the input VCF read from standard input
+STDIN = "-"
+
+
+def open_input_stream():
+    '''
+    Text stream of VCF from standard input, plain or (b)gzipped
+    '''
+    stream = sys.stdin.buffer
+    if stream.peek(2)[:2] == b"\x1f\x8b":
+        stream = gzip.GzipFile(fileobj=stream)
+    return io.TextIOWrapper(stream, encoding="utf-8",
+                            errors="surrogateescape")
+
+
+def open_vcf_reader(filename: str, backend: str = None,
+                    call_set: List = None, threads: int = 1) -> LazyVCFReader:
+    '''
+    Opens a VCF with the given backend: "pyvcf" (pure Python) or "pysam"
+    (htslib). By default BCF is read with pysam and VCF with PyVCF.
+    With a call set, the reader jumps to the positions of the calls.
+    Threads decompress BGZF input ahead of a sequential reader.
+    File name "-" stands for standard input
+    '''
+    if backend is None:
+        backend = "pysam" if filename.endswith(".bcf") else "pyvcf"
+    if backend == "pysam":
+        if call_set:
+            return PysamJumpReader(call_set=call_set, filename=filename)
+        return PysamVCFReader(filename=filename, threads=threads)
+    if backend == "pyvcf":
+        if filename == STDIN:
+            return LazyVCFReader(fsock=open_input_stream())
+        if call_set:
+            return JumpVCFReader(call_set=call_set, filename=filename)
+        return LazyVCFReader(filename=filename, threads=threads)
+    raise ValueError("Unknown VCF reader: {}".format(backend))
+
+
+def read_samples(filename: str) -> List[str]:
+    with pysam.VariantFile(filename) as variant_file:
+        return list(variant_file.header.samples)
+
+
+def get_indexed_contigs(filename: str) -> List[str]:
+    '''
+    Contigs of the index (.tbi or .csi) of a VCF or BCF file, in the
+    order of the file, or None if the file is not indexed
+    '''
+    with pysam.VariantFile(filename) as variant_file:
+        if variant_file.index is None:
+            return None
+        return list(variant_file.index)
 
 
 if __name__ == '__main__':
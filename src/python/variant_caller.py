@@ -19,24 +19,91 @@
 #  limitations under the License.
 
 import argparse
+import contextlib
+import sys
+from typing import Dict, List, Set, Tuple
+from functools import partial
 
 from callers.ab_compound_het_caller import ABCompoundHeterozygousCaller
 from callers.ab_denovo_caller import ABDenovoCaller
 from callers.ab_homo_rec_caller import ABHomozygousRecessiveCaller
 from callers.bayes_denovo_caller import BayesDenovoCaller
+from callers.cohort_caller import CohortCaller, DE_NOVO, HOM_REC, CMPD_HET, \
+    PATTERNS
 from callers.harness import Harness, HEADER_FILE_NAME, CALLS_FILE_NAME
+from callers.incremental import StoredHarness
+from callers.parallel import ShardedHarness
 from callers.tag_caller import TagCaller
 from utils.case_utils import parse_fam_file, parse_all_fam_files
+from utils.profiler import PROFILE_SAMPLE_RATE, parse_region
+from utils.regions import read_bed, merge_intervals
+from utils.result_store import ResultStore
+from utils.tsv import SPILL_LIMIT
+from utils.vcf_wrappers import VCF_READERS, STDIN, get_indexed_contigs
 
 
-def run (args):
-    vcf_file = args.vcf
-    fam_file = args.family
+COHORT_PATTERNS = {
+    "de-novo": DE_NOVO,
+    "homo-rec": HOM_REC,
+    "compound_het": CMPD_HET
+}
+
 
+def read_families(fam_file: str) -> Dict:
+    '''
+    Families by name from a fam file or a directory or archive of fam files
+    '''
     if fam_file.endswith(".fam"):
         family = parse_fam_file(fam_file)
-    else:
-        family = parse_all_fam_files(fam_file)
+        name = next(iter(family.values()))['family']
+        return {name: family}
+    return parse_all_fam_files(fam_file)
+
+
+def create_cohort_caller(args, names: List = None) -> CohortCaller:
+    patterns = [COHORT_PATTERNS[c] for c in args.callers or []
+                if c in COHORT_PATTERNS]
+    families = read_families(args.family)
+    if names is not None:
+        # Families are already checked against the samples of the VCF
+        return CohortCaller({name: families[name] for name in names},
+                            patterns=patterns if patterns else PATTERNS)
+    # Standard input can not be opened twice, samples are checked by init()
+    return CohortCaller(families, args.vcf if args.vcf != STDIN else None,
+                        patterns if patterns else PATTERNS)
+
+
+def create_stored_callers(args, names: List) -> Set:
+    '''
+    Callers for a subset of families, computed for the result store
+    '''
+    if args.cohort:
+        return {create_cohort_caller(args, names)}
+    return create_callers(args)
+
+
+def get_store_config(args) -> Dict:
+    '''
+    Options, which calls depend on
+    '''
+    return {
+        "callers": sorted(args.callers) if args.callers else None,
+        "cohort": args.cohort,
+        "dnlib": args.dnlib,
+        "results": args.results,
+        "assembly": args.assembly
+    }
+
+
+def parse_store_region(region: str) -> Tuple:
+    chromosome, start, end = parse_region(region)
+    return chromosome, start - 1 if start else None, end
+
+
+def create_callers(args):
+    if args.cohort:
+        return {create_cohort_caller(args)}
+
     b = args.callers and ("de-novo-b" in args.callers)
 
     need_standard_de_novo = (not args.callers) or ("de-novo" in args.callers) or b
@@ -67,35 +134,143 @@ def run (args):
             ABCompoundHeterozygousCaller(),
             ABHomozygousRecessiveCaller()
         }
+    return callers
+
+
+def run (args):
+    vcf_file = args.vcf
+    fam_file = args.family
+
+    if fam_file.endswith(".fam"):
+        family = parse_fam_file(fam_file)
+    else:
+        family = parse_all_fam_files(fam_file)
+
+    # Streaming: annotated VCF is written to stdout in a single pass
+    streaming = args.execute and args.ovcf == "-"
+    if streaming or (vcf_file == STDIN and args.apply):
+        args.apply = True
+        args.single_pass = True
+    if vcf_file == STDIN and (args.jobs > 1 or args.store or args.regions
+                              or args.start or args.resume):
+        raise ValueError("Input from stdin is read sequentially, --jobs, "
+                         "--store, --regions, --start and --resume are "
+                         "not supported")
+
+    if streaming and (args.jobs > 1 or args.store or args.regions
+                      or args.start or args.resume):
+        raise ValueError("Annotated VCF is streamed to stdout in a single "
+                         "sequential pass over the whole input, --jobs, "
+                         "--store, --regions, --start and --resume are "
+                         "not supported with '-o -'")
+
+    callers = create_callers(args)
+
+    regions = None
+    if args.regions:
+        contigs = get_indexed_contigs(vcf_file)
+        if contigs is None:
+            raise ValueError("--regions requires indexed input VCF")
+        regions = merge_intervals(read_bed(args.regions), contigs)
+        print("Calling in {:d} intervals of {}".format(len(regions),
+                                                      args.regions))
+        if args.start:
+            print("Start position is ignored with --regions")
+            args.start = None
 
     if args.output and args.execute:
         flush = args.output
-    elif not args.execute:
+    elif not args.execute or streaming:
         flush = False
     else:
         flush = True
 
-    harness = Harness(vcf_file, family, callers, flush=flush,
-                      start_pos=args.start, stop = args.stop)
+    if args.store and args.execute:
+        if args.start or args.resume or args.profile:
+            print("Start position, resume and profiling are ignored "
+                  "with the result store")
+            args.start = None
+        if not args.cohort and not fam_file.endswith(".fam"):
+            raise ValueError("--store requires a fam file or --cohort")
+        store = ResultStore(args.store)
+        if args.invalidate:
+            removed = store.invalidate([parse_store_region(region)
+                                        for region in args.invalidate])
+            print("Removed {:d} stored entries in {}".format(
+                removed, ', '.join(args.invalidate)))
+        if args.cohort:
+            families = next(iter(callers)).families
+        else:
+            families = read_families(fam_file)
+        harness = StoredHarness(vcf_file, None if args.cohort else family,
+                                callers,
+                                callers_factory=partial(
+                                    create_stored_callers, args),
+                                store=store, families=families,
+                                config=get_store_config(args),
+                                jobs=args.jobs, flush=flush,
+                                reader=args.reader, regions=regions,
+                                spill_limit=args.spill_limit)
+    elif args.jobs > 1 and args.execute and not args.start \
+            and not args.resume and not args.profile:
+        harness = ShardedHarness(vcf_file, family, callers,
+                                 callers_factory=partial(create_callers, args),
+                                 jobs=args.jobs, flush=flush,
+                                 reader=args.reader, regions=regions,
+                                 spill_limit=args.spill_limit)
+    else:
+        if args.jobs > 1 and (args.start or args.resume or args.profile):
+            print("Start position, resume or profiling is given, running "
+                  "in a single process")
+        harness = Harness(vcf_file, family, callers, flush=flush,
+                          start_pos=args.start, stop = args.stop,
+                          resume=args.resume and args.execute,
+                          reader=args.reader, regions=regions,
+                          threads=args.threads, spill_limit=args.spill_limit)
+        harness.report_intervals = regions is not None
+        # Without calls file, calls of streaming run are only in the VCF
+        harness.keep_calls = not streaming or bool(args.output)
     if args.debug:
         harness.debug_mode = True
+    if args.no_prescreen:
+        harness.use_prescreen = False
+    if args.metrics and args.execute:
+        harness.collect_metrics(args.metrics)
+    if args.profile and args.execute:
+        harness.profile_to(args.profile, args.profile_sample_rate,
+                           args.profile_region)
+    single_pass = args.single_pass and args.apply and args.execute
+    if single_pass and (args.start or regions is not None or
+                        isinstance(harness, ShardedHarness)):
+        print("Single pass annotation requires sequential run over "
+              "the whole VCF, annotating after the run")
+        single_pass = False
     if args.execute:
-        harness.write_header()
+        if harness.keep_calls:
+            harness.write_header()
+        if single_pass:
+            harness.annotate_to(args.ovcf if args.ovcf else "xx.vcf")
         t = harness.run()
         n = harness.variant_counter
 
         print("Processed {:d} variants in {:.2f} seconds; rate = {:3.3f} variant/sec".
               format(n, t, n/t))
+        if harness.rejected:
+            print("Rejected by prescreen: {:d} of {:d} variants".
+                  format(harness.rejected, n))
         print("Detected {:d} calls in {:d} variants".format(harness.call_counter,
                                                            harness.variant_called))
 
-        harness.write_calls()
+        if harness.keep_calls:
+            harness.write_calls()
+        if args.columnar and harness.keep_calls:
+            harness.write_columnar(args.columnar)
         tags = None
     else:
         harness.calls_file = args.output
         harness.header_file = args.header
         tags = [t for t in Harness.read_header(args.header)]
-    if args.apply:
+    if args.apply and not single_pass:
         if args.ovcf:
             harness.apply_calls(args.ovcf, tags)
         else:
@@ -108,7 +283,7 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser(description="Run BGM variant callers")
     parser.add_argument("-i", "--input", "--vcf", dest="vcf",
             help="Input VCF file, required. Use jointly called VCF "
-                             "for better results",
+                             "for better results, '-' to read from stdin",
             required=True)
     parser.add_argument("-f", "--family", help="Family (fam) file, required",
                         required=True)
@@ -121,20 +296,87 @@ if __name__ == '__main__':
             required=False)
     parser.add_argument("--callers", nargs="*",
                         help="List of callers if different from default")
+    parser.add_argument("--cohort", action="store_true",
+            help="Screen all families given by --family (a directory or "
+                 "an archive of fam files) in a single pass, writing calls "
+                 "of allele balance callers to a column per family",
+            required=False)
     parser.add_argument("--start",
             help="Start position in input VCF File",
             required=False)
+    parser.add_argument("--regions",
+            help="BED file with target intervals: only records starting "
+                 "in these intervals are read, through the index of "
+                 "the input VCF",
+            required=False)
+    parser.add_argument("--store",
+            help="Directory of the result store: calls of every family "
+                 "are kept by shard of tabix-indexed input VCF and only "
+                 "new or changed families and shards are called again",
+            required=False)
+    parser.add_argument("--invalidate", nargs="+",
+            help="With --store: remove stored calls of all families in "
+                 "regions (chrom or chrom:start-end) before the run",
+            required=False)
     parser.add_argument("--stop", action="store_true",
             help="If start position is given then tells if to stop when reaches "
                  "the end of chromosome",
             required=False)
+    parser.add_argument("--resume", action="store_true",
+            help="Resume interrupted run from the checkpoint, saved next "
+                 "to the output file with calls. Checkpoints are only saved "
+                 "with this option and removed when the run is complete",
+            required=False)
+    parser.add_argument("--jobs", type=int, default=1,
+            help="Number of processes, running callers over regions of "
+                 "tabix-indexed input VCF",
+            required=False)
     parser.add_argument("--debug", action="store_true",
             help="Debug mode: detailed diagnostics", required=False)
+    parser.add_argument("--no_prescreen", "--no-prescreen",
+            action="store_true",
+            help="Parse every record, do not skip records, which callers "
+                 "reject from the raw text of the line", required=False)
+    parser.add_argument("--reader", choices=VCF_READERS,
+            help="VCF reader: pyvcf (pure Python) or pysam (htslib, "
+                 "also reads BCF). Default: pysam for .bcf, pyvcf otherwise",
+            required=False)
+    parser.add_argument("--spill_limit", "--spill-limit", type=int,
+            default=SPILL_LIMIT,
+            help="Calls kept in memory before they are spilled to temporary "
+                 "files, until written to the calls file; 0: no limit",
+            required=False)
+    parser.add_argument("--threads", type=int, default=1,
+            help="Threads decompressing bgzipped input VCF ahead of "
+                 "parsing, when it is read sequentially; 0: decompress "
+                 "in the reading thread",
+            required=False)
+    parser.add_argument("--metrics",
+            help="File to periodically write run metrics to: Prometheus "
+                 "text format if the name ends with .prom, JSON otherwise",
+            required=False)
+    parser.add_argument("--profile",
+            help="Profile callers on a sample of records and write "
+                 "flame graph (folded stacks) to the given file",
+            required=False)
+    parser.add_argument("--profile_sample_rate", "--profile-sample-rate",
+            type=float, default=PROFILE_SAMPLE_RATE,
+            help="Fraction of blocks of records to profile",
+            required=False)
+    parser.add_argument("--profile_region", "--profile-region",
+            help="Profile only records in a region: chrom or chrom:start-end",
+            required=False)
     parser.add_argument("--output",
             help="Output file with new calls",
             required=False)
+    parser.add_argument("--columnar",
+            help="Also write calls in columnar format with typed columns: "
+                 ".arrow, .feather or .parquet (requires pyarrow) or .npz",
+            required=False)
     parser.add_argument("-o", "--out_vcf", "--ovcf",
-            help="Output file with new calls", dest= "ovcf",
+            help="Output file with new calls, '-' to stream annotated VCF "
+                 "to stdout in a single pass (messages go to stderr)",
+            dest= "ovcf",
             required=False)
     parser.add_argument("--assembly", default="hg19",
             help="Assembly to be used: hg19/hg38",
@@ -146,6 +388,9 @@ if __name__ == '__main__':
             help="Apply calls after execution is complete", required=False)
     parser.add_argument("--apply_calls", help="Do not run the caller, just "
                         "apply calls from a given file", required=False)
+    parser.add_argument("--single_pass", action="store_true",
+            help="With --apply: write annotated VCF while running callers, "
+                 "without reading the input VCF again", required=False)
 
     args = parser.parse_args()
 
@@ -161,7 +406,12 @@ if __name__ == '__main__':
     else:
         args.execute = True
 
-    print(args)
-
-    run(args)
+    if args.ovcf == "-":
+        # Standard output is the annotated VCF, messages go to stderr
+        with contextlib.redirect_stdout(sys.stderr):
+            print(args)
+            run(args)
+    else:
+        print(args)
+        run(args)
 